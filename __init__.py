@@ -1,4 +1,4 @@
-import bpy, sys, os
+import bpy, sys, os, time
 
 ### Constants
 ADDON_FOLDER = os.path.dirname(os.path.abspath(__file__))
@@ -23,6 +23,13 @@ DEPENDENCIES = (
     Dependency(module='imwatermark', package='invisible-watermark', name=None),
 )
 
+# Only needed for quantized loads and UNet step caching, installed from the preferences on request
+OPTIONAL_DEPENDENCIES = (
+    Dependency(module='DeepCache', package='DeepCache', name=None),
+    Dependency(module='bitsandbytes', package=None, name=None),
+    Dependency(module='torchao', package=None, name=None),
+)
+
 ### Blender Addon Initialization
 bl_info = {
     "name" : "Blender Unexpected Diffusion",
@@ -42,15 +49,19 @@ blender_globals = {}
 sys.path.append(DEPENDENCIES_FOLDER)
 
 def register():
+    # Torch and diffusers are only imported by the first job, registration is timed to keep it that way
+    timings = [('start', time.perf_counter())]
     from .functions import modules as mod
 
     global dependencies_installed
     dependencies_installed = mod.are_dependencies_installed(DEPENDENCIES, DEPENDENCIES_FOLDER)
+    timings.append(('dependencies', time.perf_counter()))
 
     from . import preferences as pref
     mod.reload_modules([pref])
     registered_classes.extend(mod.register_classes(mod.get_classes([pref])))
     preferences = bpy.context.preferences.addons[__package__].preferences
+    timings.append(('preferences', time.perf_counter()))
 
     from . import operators as op
     from . import panels as pn
@@ -59,10 +70,17 @@ def register():
     registered_classes.extend(mod.register_classes(mod.get_classes([op,pn,pg])))
 
     setattr(bpy.types.WorkSpace, PG_NAME_LC, bpy.props.PointerProperty(type=pg.UDPropertyGroup))
+    timings.append(('interface', time.perf_counter()))
+
+    blender_globals['register_timings'] = {name: end - start for (_, start), (name, end) in zip(timings, timings[1:])}
+    report = ', '.join(f'{name} {seconds * 1000:.0f} ms' for name, seconds in blender_globals['register_timings'].items())
+    print(f"UD: registered in {(timings[-1][1] - timings[0][1]) * 1000:.0f} ms ({report})")
 
 def unregister():   
     from .functions import modules as mod
+    from . import operators as op
 
+    op.shutdown_pool()
     mod.unregister_classes(registered_classes)
 
 
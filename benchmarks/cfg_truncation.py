@@ -0,0 +1,43 @@
+# Speed/quality of CFG truncation and adaptive guidance against full guidance on fixed seeds
+import os, sys, tempfile
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import common
+
+def main():
+    parser = common.argument_parser("CFG truncation benchmark")
+    parser.add_argument('--cutoffs', type=float, nargs='+', default=[0.4, 0.6, 0.8])
+    parser.add_argument('--thresholds', type=float, nargs='+', default=[0.99, 0.995])
+    parser.add_argument('--steps', type=int, default=30)
+    parser.add_argument('--cfg', type=float, default=5)
+    args = common.parse_args(parser)
+
+    ud = common.load_module('ud_processor')
+    worker = ud.UD_Processor()
+    manager = common.BenchManager()
+    filepath = os.path.join(tempfile.gettempdir(), 'ud_bench_cfg_truncation.png')
+
+    # Warm-up so model loading is not counted
+    worker.run(params=common.base_params(args.model, filepath, inference_steps=2), manager=manager)
+
+    settings = [{'cfg_cutoff': cutoff} for cutoff in args.cutoffs] + [{'adaptive_cfg': threshold} for threshold in args.thresholds]
+
+    results = {'model': args.model, 'steps': args.steps, 'cfg': args.cfg, 'runs': []}
+    for seed in args.seeds:
+        params = common.base_params(args.model, filepath, seed=seed, inference_steps=args.steps, cfg_scale=args.cfg)
+        baseline, baseline_time = common.timed(worker.run, params=params, manager=manager)
+        results['runs'].append({'seed': seed, 'settings': {}, 'seconds': baseline_time, 'speedup': 1.0, 'psnr': None})
+
+        for overrides in settings:
+            params = common.base_params(args.model, filepath, seed=seed, inference_steps=args.steps, cfg_scale=args.cfg, **overrides)
+            image, seconds = common.timed(worker.run, params=params, manager=manager)
+            results['runs'].append({
+                'seed': seed,
+                'settings': overrides,
+                'seconds': seconds,
+                'speedup': baseline_time / seconds,
+                'psnr': common.psnr(image, baseline),
+            })
+
+    common.write_results(results, args.output)
+
+main()
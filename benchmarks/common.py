@@ -0,0 +1,93 @@
+# Shared helpers for the benchmark scripts. Run them through Blender so the addon package can be imported:
+#   blender --background --factory-startup --python benchmarks/<script>.py -- [args]
+
+import os, sys, importlib, argparse, json, time
+import numpy as np
+
+ADDON_FOLDER = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+ADDON_NAME = os.path.basename(ADDON_FOLDER)
+
+def load_module(name):
+    if os.path.dirname(ADDON_FOLDER) not in sys.path:
+        sys.path.insert(0, os.path.dirname(ADDON_FOLDER))
+    return importlib.import_module(f'{ADDON_NAME}.{name}' if name else ADDON_NAME)
+
+def parse_args(parser):
+    argv = sys.argv[sys.argv.index('--') + 1:] if '--' in sys.argv else []
+    return parser.parse_args(argv)
+
+def argument_parser(description):
+    parser = argparse.ArgumentParser(description=description)
+    parser.add_argument('--model', default='stabilityai/stable-diffusion-xl-base-1.0')
+    parser.add_argument('--seeds', type=int, nargs='+', default=[1, 2, 3])
+    parser.add_argument('--output', help="Write the results as JSON to this file")
+    return parser
+
+class BenchManager:
+    """Stand-in for ProcessManager that keeps progress in memory"""
+
+    def __init__(self, tracer=None):
+        self.tracer = tracer or load_module('tracing').Tracer('benchmark')
+        self.running = 0
+        self.progress = 0
+        self.progress_text = ''
+        self.stop = 0
+
+    def set_running(self, value):
+        self.running = value
+
+    def set_progress(self, value):
+        self.progress = value
+
+    def set_progress_text(self, value):
+        self.progress_text = value
+
+    def set_trace_summary(self, value):
+        self.trace_summary = value
+
+    def set_stop_process(self, value):
+        self.stop = value
+
+    def stop_process(self):
+        return self.stop
+
+def base_params(model, filepath, **overrides):
+    bf = load_module('functions.basic_functions')
+    params = {
+        'model': model,
+        'pipeline_type': bf.get_model_type(model) or 'SDXL',
+        'prompt': "A close up of a cat with sunglasses driving a ferrari, golden hour",
+        'negative_prompt': "",
+        'scale': 100,
+        'width': 1024,
+        'height': 1024,
+        'use_buckets': False,
+        'seed': 1,
+        'inference_steps': 30,
+        'step_cache_interval': 1,
+        'cfg_scale': 5,
+        'init_image_slot': None,
+        'init_mask_slot': None,
+        'denoise_strength': 0.4,
+        'temp_image_filepath': filepath,
+        'mode': 'generate',
+    }
+    params.update(overrides)
+    return params
+
+def timed(fn, *args, **kwargs):
+    start = time.perf_counter()
+    result = fn(*args, **kwargs)
+    return result, time.perf_counter() - start
+
+def psnr(image, reference):
+    a = np.asarray(image.convert('RGB'), dtype=np.float64)
+    b = np.asarray(reference.convert('RGB'), dtype=np.float64)
+    mse = np.mean((a - b) ** 2)
+    return float('inf') if mse == 0 else 10 * np.log10(255 ** 2 / mse)
+
+def write_results(results, filepath):
+    print(json.dumps(results, indent=2))
+    if filepath:
+        with open(filepath, 'w') as f:
+            json.dump(results, f, indent=2)
@@ -0,0 +1,79 @@
+# Dispatch of batch jobs over several CPU "devices": load counts per model, per-device job counts and throughput.
+# --fake uses sleeping stand-in processors to check the scheduling alone, otherwise the tiny SDXL model is used.
+import os, sys, time, tempfile
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import common, tiny_models
+
+class FakeProcessor:
+    load_seconds = 0.2
+    step_seconds = 0.05
+
+    def __init__(self, device):
+        self.device = device
+        self.loaded_model = None
+        self.loads = []
+
+    def run(self, params, manager):
+        if self.loaded_model != params['model']:
+            time.sleep(self.load_seconds)
+            self.loaded_model = params['model']
+            self.loads.append(params['model'])
+        time.sleep(self.step_seconds * params['inference_steps'])
+        return params['seed']
+
+def dispatch(pool_module, factory, devices, jobs):
+    pool = pool_module.DevicePool(devices, factory)
+    manager = common.BenchManager()
+
+    start = time.perf_counter()
+    submitted = [pool.submit(lambda processor, p=params: processor.run(params=p, manager=manager), model=params['model']) for params in jobs]
+    for job in submitted:
+        job.wait()
+    seconds = time.perf_counter() - start
+
+    per_device = {}
+    for job in submitted:
+        per_device[str(job.device)] = per_device.get(str(job.device), 0) + 1
+
+    pool.shutdown()
+    return {
+        'devices': len(devices),
+        'seconds': seconds,
+        'images_per_minute': len(jobs) / seconds * 60,
+        'jobs_per_device': per_device,
+    }, pool
+
+def main():
+    parser = common.argument_parser("Device pool dispatch benchmark")
+    parser.add_argument('--devices', type=int, default=2)
+    parser.add_argument('--batch', type=int, default=8)
+    parser.add_argument('--models', type=int, default=1, help="Number of distinct models interleaved in the batch (--fake only)")
+    parser.add_argument('--fake', action='store_true')
+    args = common.parse_args(parser)
+
+    pool_module = common.load_module('device_pool')
+    filepath = os.path.join(tempfile.gettempdir(), 'ud_bench_pool_{}.png')
+
+    if args.fake:
+        factory = FakeProcessor
+        jobs = [{'model': f'model-{i % args.models}', 'seed': i, 'inference_steps': 4} for i in range(args.batch)]
+    else:
+        import torch
+        torch.set_num_threads(max(1, (os.cpu_count() or 2) // args.devices))
+        ud = common.load_module('ud_processor')
+        factory = ud.UD_Processor
+        models = tiny_models.tiny_models()
+        jobs = [common.base_params(models['sdxl'], filepath.format(i), pipeline_type='SDXL', width=128, height=128, inference_steps=4, seed=i)
+                for i in range(args.batch)]
+
+    results = {}
+    for devices in [['cpu'], ['cpu'] * args.devices]:
+        result, pool = dispatch(pool_module, factory, devices, jobs)
+        if args.fake:
+            loads = [model for worker in pool.workers if worker.processor for model in worker.processor.loads]
+            result['model_loads'] = {model: loads.count(model) for model in set(loads)}
+        results[f'{len(devices)}_devices'] = result
+
+    common.write_results(results, args.output)
+
+main()
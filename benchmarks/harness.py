@@ -0,0 +1,172 @@
+# Cold/warm latency, peak RSS and per-stage timings of the UD_Processor flows on CPU with tiny random models.
+#   blender --background --factory-startup --python benchmarks/harness.py -- --baseline benchmarks/baselines/cpu.json [--update-baseline]
+import os, sys, json, time, tempfile, threading, subprocess
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import common, tiny_models
+
+FLOWS = ['generate', 'img2img', 'inpaint', 'controlnet', 'upscale_re', 'upscale_sd']
+
+def rss_bytes():
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except OSError:
+        import resource
+        rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return rss if sys.platform == 'darwin' else rss * 1024
+
+class PeakRss:
+    def __init__(self, interval=0.01):
+        self.interval = interval
+        self.peak = 0
+
+    def sample(self):
+        while not self.done.wait(self.interval):
+            self.peak = max(self.peak, rss_bytes())
+
+    def __enter__(self):
+        self.peak = rss_bytes()
+        self.done = threading.Event()
+        self.thread = threading.Thread(target=self.sample, daemon=True)
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.done.set()
+        self.thread.join()
+        self.peak = max(self.peak, rss_bytes())
+
+def blender_image(name, size, hole=False):
+    import bpy
+    import numpy as np
+
+    image = bpy.data.images.new(name, size, size, alpha=True)
+    pixels = np.random.default_rng(0).random((size, size, 4), dtype=np.float32)
+    pixels[..., 3] = 1
+    if hole:
+        pixels[size // 4:size // 2, size // 4:size // 2, 3] = 0
+    image.pixels.foreach_set(pixels.ravel())
+    return image
+
+def flow_params(flow, models, filepath, size):
+    params = common.base_params(models['sdxl'], filepath, pipeline_type='SDXL', width=size, height=size, inference_steps=4, mode=flow)
+    if flow == 'img2img':
+        params['init_image_slot'] = blender_image('bench_init', size)
+    elif flow == 'inpaint':
+        params['init_image_slot'] = blender_image('bench_inpaint', size, hole=True)
+    elif flow == 'controlnet':
+        params['controlnet_model'] = [models['controlnet']]
+        params['controlnet_image_slot'] = [blender_image('bench_control', size)]
+        params['controlnet_factor'] = [0.5]
+    return params
+
+def run_flow(ud, flow, params):
+    manager = common.BenchManager()
+    worker = ud.UD_Processor()
+    timings = []
+
+    for phase in ['cold', 'warm']:
+        manager.tracer = common.load_module('tracing').Tracer(f'{flow}-{phase}')
+        with PeakRss() as rss:
+            start = time.perf_counter()
+            if flow.startswith('upscale'):
+                result = worker.upscale(params=dict(params), manager=manager)
+            else:
+                result = worker.run(params=dict(params), manager=manager)
+            seconds = time.perf_counter() - start
+
+        if result is None:
+            raise RuntimeError(f"{flow} returned no image")
+
+        timings.append({
+            'phase': phase,
+            'seconds': seconds,
+            'peak_rss_mb': round(rss.peak / 2**20, 1),
+            'stages': {name: round(entry['seconds'], 4) for name, entry in manager.tracer.totals().items()},
+        })
+    return timings
+
+def git_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], cwd=common.ADDON_FOLDER, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def compare(results, baseline, tolerance, flows):
+    # Flows and phases of the baseline that did not run count as failures too, a crash must not pass as no regression
+    regressions = []
+    for flow, reference_runs in baseline['flows'].items():
+        if flow not in flows:
+            continue
+        runs = results['flows'].get(flow, {}).get('runs', [])
+        for reference in reference_runs.get('runs', []):
+            run = next((r for r in runs if r['phase'] == reference['phase']), None)
+            if run is None:
+                print(f"{flow:>12} {reference['phase']:>5}: missing from the results")
+                regressions.append(f"{flow} {reference['phase']} missing")
+                continue
+            ratio = run['seconds'] / reference['seconds']
+            print(f"{flow:>12} {run['phase']:>5}: {run['seconds']:.3f}s vs {reference['seconds']:.3f}s ({ratio:.2f}x)")
+            if ratio > tolerance:
+                regressions.append(f"{flow} {run['phase']}")
+    return regressions
+
+def main():
+    parser = common.argument_parser("UD_Processor benchmark harness")
+    parser.add_argument('--flows', nargs='+', default=FLOWS, choices=FLOWS)
+    parser.add_argument('--size', type=int, default=128)
+    parser.add_argument('--baseline', help="Baseline JSON file to compare against or update")
+    parser.add_argument('--update-baseline', action='store_true')
+    parser.add_argument('--tolerance', type=float, default=1.25, help="Slowdown ratio reported as a regression")
+    args = common.parse_args(parser)
+
+    import torch
+    torch.manual_seed(0)
+    ud = common.load_module('ud_processor')
+    constants = common.load_module('constants')
+
+    models = tiny_models.tiny_models()
+    constants.CONTROLNET_MODELS[models['controlnet']] = {'name': 'tiny-controlnet', 'model_type': 'diffusers'}
+    ud.UD_Processor.device = torch.device('cpu')
+    ud.UD_Processor.upscaler_model = models['upscaler']
+
+    filepath = os.path.join(tempfile.gettempdir(), 'ud_bench_harness.png')
+    results = {'commit': git_commit(), 'torch': torch.__version__, 'size': args.size, 'flows': {}}
+
+    for flow in args.flows:
+        params = flow_params(flow, models, filepath, args.size)
+        try:
+            if flow.startswith('upscale'):
+                # Upscalers start from the last generated image
+                ud.UD_Processor().run(params=flow_params('generate', models, filepath, args.size), manager=common.BenchManager())
+            results['flows'][flow] = {'runs': run_flow(ud, flow, params)}
+        except Exception as e:
+            results['flows'][flow] = {'error': str(e)}
+        print(f"{flow}: {results['flows'][flow]}")
+
+    common.write_results(results, args.output)
+
+    errors = [flow for flow, entry in results['flows'].items() if 'error' in entry]
+    if errors:
+        print(f"Failed flows: {', '.join(errors)}")
+
+    if args.baseline and args.update_baseline:
+        if errors:
+            print("Baseline not updated, every flow must complete")
+            sys.exit(1)
+        os.makedirs(os.path.dirname(os.path.abspath(args.baseline)), exist_ok=True)
+        with open(args.baseline, 'w') as f:
+            json.dump(results, f, indent=2)
+    elif args.baseline and os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            regressions = compare(results, json.load(f), args.tolerance, args.flows)
+        if regressions:
+            print(f"Regressions: {', '.join(regressions)}")
+            sys.exit(1)
+    elif args.baseline:
+        print(f"No baseline at {args.baseline}, create it with --update-baseline")
+
+    if errors:
+        sys.exit(1)
+
+main()
@@ -0,0 +1,41 @@
+# Two-pass hires fix against a single pass at the same output size
+import os, sys, tempfile
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import common
+
+def main():
+    parser = common.argument_parser("Hires fix benchmark")
+    parser.add_argument('--scales', type=int, nargs='+', default=[150, 200])
+    parser.add_argument('--steps', type=int, default=30)
+    parser.add_argument('--denoise', type=float, default=0.45)
+    args = common.parse_args(parser)
+
+    ud = common.load_module('ud_processor')
+    worker = ud.UD_Processor()
+    manager = common.BenchManager()
+    filepath = os.path.join(tempfile.gettempdir(), 'ud_bench_hires_fix.png')
+
+    # Warm-up both pipelines so loading and the first switch are not counted
+    worker.run(params=common.base_params(args.model, filepath, inference_steps=2, scale=150, hires_fix=True), manager=manager)
+
+    results = {'model': args.model, 'steps': args.steps, 'denoise': args.denoise, 'runs': []}
+    for scale in args.scales:
+        for seed in args.seeds:
+            params = common.base_params(args.model, filepath, seed=seed, scale=scale, inference_steps=args.steps)
+            single, single_time = common.timed(worker.run, params=params, manager=manager)
+
+            params = common.base_params(args.model, filepath, seed=seed, scale=scale, inference_steps=args.steps, hires_fix=True, hires_denoise=args.denoise)
+            image, hires_time = common.timed(worker.run, params=params, manager=manager)
+
+            results['runs'].append({
+                'scale': scale,
+                'size': list(image.size),
+                'seed': seed,
+                'single_pass_seconds': single_time,
+                'hires_fix_seconds': hires_time,
+                'speedup': single_time / hires_time,
+            })
+
+    common.write_results(results, args.output)
+
+main()
@@ -0,0 +1,47 @@
+# Addon registration cost and what the first job pays for the deferred imports
+#   blender --background --factory-startup --python benchmarks/import_time.py
+import os, sys, time
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import common
+
+HEAVY_MODULES = ['torch', 'diffusers', 'transformers', 'realesrgan_ncnn_py', 'cv2', 'accelerate']
+
+def timed_ms(fn, *args):
+    start = time.perf_counter()
+    result = fn(*args)
+    return result, (time.perf_counter() - start) * 1000
+
+def main():
+    parser = common.argument_parser("Addon import time report")
+    parser.add_argument('--lookups', type=int, default=100000)
+    args = common.parse_args(parser)
+
+    import addon_utils
+    common.load_module('constants') # puts the addon's parent folder on sys.path
+    _, register_ms = timed_ms(lambda: addon_utils.enable(common.ADDON_NAME, default_set=True))
+
+    addon = sys.modules[common.ADDON_NAME]
+    results = {
+        'register_ms': register_ms,
+        'register_phases_ms': {name: seconds * 1000 for name, seconds in addon.blender_globals.get('register_timings', {}).items()},
+        'heavy_modules_at_register': [name for name in HEAVY_MODULES if name in sys.modules],
+    }
+
+    # Panel redraws look the model type up on every draw
+    bf = common.load_module('functions.basic_functions')
+    _, lookup_ms = timed_ms(lambda: [bf.get_model_type(args.model) for _ in range(args.lookups)])
+    results['model_lookup_us'] = lookup_ms * 1000 / args.lookups
+
+    # Deferred to the first job
+    ud, results['processor_import_ms'] = timed_ms(common.load_module, 'ud_processor')
+    _, results['device_resolve_ms'] = timed_ms(ud.UD_Processor)
+    pipelines = common.load_module('pipelines')
+    results['pipeline_class_ms'] = {}
+    for pipeline_type in pipelines.pipeline_settings:
+        _, results['pipeline_class_ms'][pipeline_type] = timed_ms(pipelines.pipeline_class, pipeline_type)
+
+    common.write_results(results, args.output)
+    if results['heavy_modules_at_register']:
+        sys.exit(1)
+
+main()
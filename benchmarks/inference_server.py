@@ -0,0 +1,52 @@
+# Shared-memory transport against PNG round trips, and cold/warm jobs through a localhost inference server.
+import os, sys, io, time
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import common, tiny_models
+
+def transport(srv, size):
+    import numpy as np
+    from PIL import Image
+
+    array = np.random.default_rng(0).integers(0, 255, (size, size, 4), dtype=np.uint8)
+
+    start = time.perf_counter()
+    shm, descriptor = srv.share_array(array)
+    received = srv.read_array(descriptor)
+    srv.release([shm])
+    shared_seconds = time.perf_counter() - start
+
+    start = time.perf_counter()
+    buffer = io.BytesIO()
+    Image.fromarray(array).save(buffer, format='PNG')
+    buffer.seek(0)
+    decoded = np.asarray(Image.open(buffer))
+    png_seconds = time.perf_counter() - start
+
+    assert (received == array).all() and (decoded == array).all()
+    return {'size': size, 'shared_memory_seconds': shared_seconds, 'png_seconds': png_seconds}
+
+def main():
+    parser = common.argument_parser("Inference server benchmark")
+    parser.add_argument('--port', type=int, default=7862)
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1024, 2048, 4096])
+    args = common.parse_args(parser)
+
+    srv = common.load_module('inference_server')
+    results = {'transport': [transport(srv, size) for size in args.sizes], 'jobs': []}
+
+    client = srv.InferenceClient(args.port)
+    models = tiny_models.tiny_models()
+    params = common.base_params(models['sdxl'], None, pipeline_type='SDXL', width=128, height=128, inference_steps=4)
+    manager = common.BenchManager()
+
+    try:
+        for phase in ['cold', 'warm']:
+            array, seconds = common.timed(client.run, params, manager)
+            results['jobs'].append({'phase': phase, 'seconds': seconds, 'shape': list(array.shape) if array is not None else None})
+        results['server_summary'] = client.server_summary
+    finally:
+        client.command('shutdown')
+
+    common.write_results(results, args.output)
+
+main()
@@ -0,0 +1,105 @@
+# Model fetching against a local stand-in for the hub: throughput per worker count, resume after a cancel, checksum rejection
+# and two devices fetching the same model at once
+import os, sys, json, shutil, hashlib, tempfile, threading
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import common
+
+def build_hub(folder, megabytes):
+    # A pipeline repo with an fp16 and a full precision unet, an unused folder and a root checkpoint, plus a controlnet repo
+    def write(path, size):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'wb') as f:
+            f.write(os.urandom(size))
+
+    mb = 1024 ** 2
+    pipe = os.path.join(folder, 'bench', 'pipeline')
+    os.makedirs(pipe, exist_ok=True)
+    with open(os.path.join(pipe, 'model_index.json'), 'w') as f:
+        json.dump({'_class_name': 'StableDiffusionXLPipeline', 'unet': ['diffusers', 'UNet2DConditionModel'], 'vae': ['diffusers', 'AutoencoderKL']}, f)
+    write(os.path.join(pipe, 'unet', 'diffusion_pytorch_model.fp16.safetensors'), megabytes * mb)
+    write(os.path.join(pipe, 'unet', 'diffusion_pytorch_model.safetensors'), 2 * megabytes * mb)
+    write(os.path.join(pipe, 'vae', 'diffusion_pytorch_model.fp16.safetensors'), megabytes * mb // 8)
+    write(os.path.join(pipe, 'vae_1_0', 'diffusion_pytorch_model.fp16.safetensors'), megabytes * mb // 8)
+    write(os.path.join(pipe, 'checkpoint.safetensors'), megabytes * mb)
+    for component in ['unet', 'vae']:
+        with open(os.path.join(pipe, component, 'config.json'), 'w') as f:
+            f.write('{}')
+    write(os.path.join(folder, 'bench', 'controlnet', 'diffusion_pytorch_model.fp16.safetensors'), megabytes * mb // 2)
+    return ['bench/pipeline', 'bench/controlnet']
+
+def main():
+    parser = common.argument_parser("Model fetch benchmark")
+    parser.add_argument('--megabytes', type=int, default=256, help="Size of the largest file")
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4])
+    args = common.parse_args(parser)
+
+    model_fetch = common.load_module('model_fetch')
+    folder = tempfile.mkdtemp(prefix='ud_bench_fetch_')
+    hub, output = os.path.join(folder, 'hub'), os.path.join(folder, 'models')
+    model_ids = build_hub(hub, args.megabytes)
+
+    try:
+        results = {'megabytes': args.megabytes, 'runs': []}
+        for workers in args.workers:
+            shutil.rmtree(output, ignore_errors=True)
+            fetcher = model_fetch.ModelFetcher(model_fetch.LocalSource(hub), folder=output, workers=workers)
+            _, seconds = common.timed(fetcher.fetch, model_ids)
+            size = sum(os.path.getsize(os.path.join(root, name)) for root, _, names in os.walk(output) for name in names)
+            results['runs'].append({'workers': workers, 'seconds': seconds, 'bytes': size, 'mb_per_second': size / 1024 ** 2 / seconds})
+
+        # Cancel halfway, then resume: only the missing bytes are read again
+        shutil.rmtree(output, ignore_errors=True)
+        fetcher = model_fetch.ModelFetcher(model_fetch.LocalSource(hub, chunk_delay=0.001), folder=output, report_interval=0)
+        stop = threading.Event()
+        progress = []
+        def report(done, total, fetched):
+            progress.append((done, total, fetched))
+            if done > total / 2:
+                stop.set()
+        try:
+            fetcher.fetch(model_ids, progress=report, cancel=stop.is_set)
+        except model_fetch.FetchCancelled:
+            pass
+        cancelled_at = progress[-1][0]
+
+        progress.clear()
+        failed = fetcher.fetch(model_ids, progress=report)
+        results['resume'] = {'cancelled_at': cancelled_at, 'total': progress[-1][1], 'fetched_after_resume': progress[-1][2], 'failed': failed}
+
+        # A corrupted partial file is rejected and fetched again on the next attempt
+        target = os.path.join(fetcher.local_path(model_ids[1]), 'diffusion_pytorch_model.fp16.safetensors')
+        os.remove(os.path.join(fetcher.local_path(model_ids[1]), model_fetch.COMPLETE_MARKER))
+        os.replace(target, target + '.part')
+        with open(target + '.part', 'r+b') as f:
+            f.write(b'corrupt')
+        rejected = fetcher.fetch([model_ids[1]])
+        refetched = fetcher.fetch([model_ids[1]])
+        results['checksum'] = {'rejected': rejected == [model_ids[1]], 'refetched': not refetched and fetcher.complete(model_ids[1])}
+
+        # Two device workers starting the same uncached model: one downloads, the other waits and finds it complete
+        shutil.rmtree(output, ignore_errors=True)
+        fetcher = model_fetch.ModelFetcher(model_fetch.LocalSource(hub, chunk_delay=0.001), folder=output)
+        outcomes = []
+        threads = [threading.Thread(target=lambda: outcomes.append(fetcher.fetch([model_ids[0]]))) for _ in range(2)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        source = {entry.path: entry.sha256 for entry in model_fetch.LocalSource(hub).files(model_ids[0])}
+        local = fetcher.local_path(model_ids[0])
+        matching = all(model_fetch.hash_file(os.path.join(root, name), hashlib.sha256()).hexdigest() == source.get(os.path.relpath(os.path.join(root, name), local).replace(os.sep, '/'))
+                       for root, _, names in os.walk(local) for name in names if name != model_fetch.COMPLETE_MARKER)
+        results['concurrent'] = {'failed': outcomes, 'complete': fetcher.complete(model_ids[0]), 'checksums_match': matching}
+
+        results['selected_files'] = sorted(os.path.relpath(os.path.join(root, name), output).replace(os.sep, '/')
+                                           for root, _, names in os.walk(output) for name in names)
+    finally:
+        shutil.rmtree(folder, ignore_errors=True)
+
+    common.write_results(results, args.output)
+    concurrent = results['concurrent']
+    if concurrent['failed'] != [[], []] or not concurrent['complete'] or not concurrent['checksums_match']:
+        print(f"Concurrent fetch failed: {concurrent}")
+        sys.exit(1)
+
+main()
@@ -0,0 +1,48 @@
+# ControlNet set changes on a loaded model, with the module cache against reloading every module
+import os, sys, tempfile
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import common
+
+SEQUENCE = [
+    ['diffusers/controlnet-depth-sdxl-1.0-small'],
+    ['diffusers/controlnet-depth-sdxl-1.0-small', 'diffusers/controlnet-canny-sdxl-1.0-small'],
+    ['diffusers/controlnet-canny-sdxl-1.0-small'],
+    ['diffusers/controlnet-depth-sdxl-1.0-small'],
+]
+
+def main():
+    parser = common.argument_parser("Module cache benchmark")
+    parser.add_argument('--steps', type=int, default=4)
+    args = common.parse_args(parser)
+
+    from PIL import Image
+    ud = common.load_module('ud_processor')
+    tracing = common.load_module('tracing')
+    filepath = os.path.join(tempfile.gettempdir(), 'ud_bench_module_cache.png')
+    control = Image.new('RGBA', (1024, 1024), (128, 128, 128, 255))
+
+    results = {'model': args.model, 'runs': []}
+    for budget in [0, ud.UD_Processor.module_cache_budget]:
+        worker = ud.UD_Processor()
+        worker.module_cache.budget = budget
+        manager = common.BenchManager()
+
+        for index, models in enumerate(SEQUENCE):
+            params = common.base_params(args.model, filepath, inference_steps=args.steps, controlnet_model=models,
+                                        controlnet_image_slot=[control] * len(models), controlnet_factor=[0.5] * len(models))
+            manager.tracer = tracing.Tracer(f'modules-{index}')
+            _, seconds = common.timed(worker.run, params=params, manager=manager)
+            totals = manager.tracer.totals()
+            results['runs'].append({
+                'budget_gb': budget / 1024 ** 3,
+                'controlnets': models,
+                'seconds': seconds,
+                'controlnet_load_seconds': totals.get('controlnet_load', {}).get('seconds', 0),
+                'switch_seconds': totals.get('pipeline_switch', {}).get('seconds', 0),
+            })
+
+        worker.unload(clear_modules=True)
+
+    common.write_results(results, args.output)
+
+main()
@@ -0,0 +1,42 @@
+# Prompt encoding with the per-string embedding cache against encoding every run
+import os, sys, tempfile
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import common
+
+def main():
+    parser = common.argument_parser("Prompt embedding cache benchmark")
+    parser.add_argument('--steps', type=int, default=4)
+    args = common.parse_args(parser)
+
+    ud = common.load_module('ud_processor')
+    tracing = common.load_module('tracing')
+    worker = ud.UD_Processor()
+    manager = common.BenchManager()
+    filepath = os.path.join(tempfile.gettempdir(), 'ud_bench_prompt_cache.png')
+
+    worker.run(params=common.base_params(args.model, filepath, inference_steps=1), manager=manager)
+
+    results = {'model': args.model, 'steps': args.steps, 'runs': []}
+    for seed in args.seeds:
+        params = common.base_params(args.model, filepath, seed=seed, inference_steps=args.steps)
+
+        worker.prompt_embeds_cache = None
+        manager.tracer = tracing.Tracer('uncached')
+        _, cold_time = common.timed(worker.run, params=params, manager=manager)
+        cold_encode = manager.tracer.totals().get('prompt_encode', {}).get('seconds', 0)
+
+        manager.tracer = tracing.Tracer('cached')
+        _, warm_time = common.timed(worker.run, params=params, manager=manager)
+        warm_encode = manager.tracer.totals().get('prompt_encode', {}).get('seconds', 0)
+
+        results['runs'].append({
+            'seed': seed,
+            'uncached_seconds': cold_time,
+            'cached_seconds': warm_time,
+            'uncached_encode_seconds': cold_encode,
+            'cached_encode_seconds': warm_encode,
+        })
+
+    common.write_results(results, args.output)
+
+main()
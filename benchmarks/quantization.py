@@ -0,0 +1,38 @@
+# Latency and memory of the quantization modes against the CPU offload baseline
+import os, sys, tempfile
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import common
+
+def main():
+    parser = common.argument_parser("Quantization benchmark")
+    parser.set_defaults(model='black-forest-labs/FLUX.1-schnell', seeds=[1])
+    parser.add_argument('--modes', nargs='+', default=['NONE', 'int8', 'fp8', 'nf4'])
+    parser.add_argument('--steps', type=int, default=4)
+    args = common.parse_args(parser)
+
+    import torch
+    ud = common.load_module('ud_processor')
+    tracing = common.load_module('tracing')
+    filepath = os.path.join(tempfile.gettempdir(), 'ud_bench_quantization.png')
+
+    results = {'model': args.model, 'steps': args.steps, 'runs': []}
+    for mode in args.modes:
+        worker = ud.UD_Processor()
+        manager = common.BenchManager()
+        for phase, seed in [('cold', args.seeds[0])] + [('warm', seed) for seed in args.seeds]:
+            # The tracer resets the peak counter at every span, so the denoise peak is read from the pipeline span
+            manager.tracer = tracing.Tracer(f'{mode}-{phase}')
+            params = common.base_params(args.model, filepath, seed=seed, inference_steps=args.steps, quantization=mode)
+            image, seconds = common.timed(worker.run, params=params, manager=manager)
+            results['runs'].append({
+                'mode': mode,
+                'phase': phase,
+                'seconds': seconds,
+                'peak_vram_mb': manager.tracer.totals().get('pipeline', {}).get('peak_memory_mb') if torch.cuda.is_available() else None,
+                'ok': image is not None,
+            })
+        worker.unload()
+
+    common.write_results(results, args.output)
+
+main()
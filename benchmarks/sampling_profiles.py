@@ -0,0 +1,48 @@
+# Latency of every model with a sampling profile at its recommended settings, against the old 50 step / CFG 5 defaults
+import os, sys, tempfile
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import common
+
+def main():
+    parser = common.argument_parser("Sampling profile benchmark")
+    parser.add_argument('--models', nargs='+', help="Model ids, defaults to every model with a profile")
+    parser.add_argument('--baseline', action='store_true', help="Also time the legacy 50 step / CFG 5 settings")
+    args = common.parse_args(parser)
+
+    ud = common.load_module('ud_processor')
+    constants = common.load_module('constants')
+    models = [model for model in constants.DIFFUSION_MODELS if model.profile and (not args.models or model.id in args.models)]
+
+    worker = ud.UD_Processor()
+    manager = common.BenchManager()
+    filepath = os.path.join(tempfile.gettempdir(), 'ud_bench_sampling_profiles.png')
+
+    results = {'runs': []}
+    for model in models:
+        settings = [('profile', model.profile.steps, model.profile.cfg)]
+        if args.baseline:
+            settings.append(('legacy', 50, 5))
+
+        # Warm-up so model loading is not counted
+        worker.run(params=common.base_params(model.id, filepath, inference_steps=1), manager=manager)
+        scheduler = type(worker.pipe.scheduler).__name__
+
+        for name, steps, cfg in settings:
+            for seed in args.seeds:
+                params = common.base_params(model.id, filepath, seed=seed, inference_steps=steps, cfg_scale=cfg)
+                _, seconds = common.timed(worker.run, params=params, manager=manager)
+                results['runs'].append({
+                    'model': model.id,
+                    'settings': name,
+                    'scheduler': scheduler,
+                    'steps': steps,
+                    'cfg': cfg,
+                    'seed': seed,
+                    'seconds': seconds,
+                })
+
+        worker.unload()
+
+    common.write_results(results, args.output)
+
+main()
@@ -0,0 +1,38 @@
+# Speed/quality of step caching against the uncached baseline on fixed seeds
+import os, sys, tempfile
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import common
+
+def main():
+    parser = common.argument_parser("Step cache benchmark")
+    parser.add_argument('--intervals', type=int, nargs='+', default=[2, 3, 5])
+    parser.add_argument('--steps', type=int, default=50)
+    args = common.parse_args(parser)
+
+    ud = common.load_module('ud_processor')
+    worker = ud.UD_Processor()
+    manager = common.BenchManager()
+    filepath = os.path.join(tempfile.gettempdir(), 'ud_bench_step_cache.png')
+
+    # Warm-up so model loading is not counted
+    worker.run(params=common.base_params(args.model, filepath, inference_steps=2), manager=manager)
+
+    results = {'model': args.model, 'steps': args.steps, 'runs': []}
+    for seed in args.seeds:
+        baseline, baseline_time = common.timed(worker.run, params=common.base_params(args.model, filepath, seed=seed, inference_steps=args.steps), manager=manager)
+        results['runs'].append({'seed': seed, 'interval': 1, 'seconds': baseline_time, 'speedup': 1.0, 'psnr': None})
+
+        for interval in args.intervals:
+            params = common.base_params(args.model, filepath, seed=seed, inference_steps=args.steps, step_cache_interval=interval)
+            image, seconds = common.timed(worker.run, params=params, manager=manager)
+            results['runs'].append({
+                'seed': seed,
+                'interval': interval,
+                'seconds': seconds,
+                'speedup': baseline_time / seconds,
+                'psnr': common.psnr(image, baseline),
+            })
+
+    common.write_results(results, args.output)
+
+main()
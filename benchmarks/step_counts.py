@@ -0,0 +1,59 @@
+# Executed denoising steps per pipeline class: legacy steps / strength inflation against the step planner.
+# The real get_timesteps of each diffusers pipeline is run on its default scheduler, no weights are loaded.
+import os, sys, inspect
+from types import SimpleNamespace
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import common
+
+def real_executed_steps(pipeline_cls, scheduler, num_inference_steps, strength):
+    scheduler.set_timesteps(num_inference_steps)
+    if hasattr(scheduler, '_begin_index'):
+        scheduler._begin_index = None
+
+    kwargs = {'num_inference_steps': num_inference_steps, 'strength': strength}
+    if 'device' in inspect.signature(pipeline_cls.get_timesteps).parameters:
+        kwargs['device'] = 'cpu'
+    timesteps, _ = pipeline_cls.get_timesteps(SimpleNamespace(scheduler=scheduler), **kwargs)
+    return len(timesteps) // scheduler.order
+
+def main():
+    parser = common.argument_parser("Executed step count regression")
+    parser.add_argument('--steps', type=int, nargs='+', default=[4, 10, 30, 50])
+    parser.add_argument('--strengths', type=float, nargs='+', default=[0.2, 0.35, 0.4, 0.55, 0.7, 0.9])
+    args = common.parse_args(parser)
+
+    import diffusers
+    ud = common.load_module('ud_processor')
+    pipelines = common.load_module('pipelines')
+
+    results, failures = [], 0
+    for pipeline_type in pipelines.pipeline_settings:
+        pipeline_cls = getattr(diffusers, pipeline_type)
+        if not hasattr(pipeline_cls, 'get_timesteps') or 'strength' not in pipelines.pipeline_settings[pipeline_type]:
+            continue
+
+        scheduler = diffusers.FlowMatchEulerDiscreteScheduler() if 'Flux' in pipeline_type else diffusers.EulerDiscreteScheduler()
+
+        for steps in args.steps:
+            for strength in args.strengths:
+                legacy = ud.round_to_nearest(steps / strength)
+                planned = pipelines.plan_steps(pipeline_type, steps, strength)
+                executed = real_executed_steps(pipeline_cls, scheduler, planned, strength)
+                failures += executed != steps
+
+                results.append({
+                    'pipeline': pipeline_type,
+                    'requested': steps,
+                    'strength': strength,
+                    'legacy_scheduled': legacy,
+                    'legacy_executed': real_executed_steps(pipeline_cls, scheduler, legacy, strength),
+                    'planned_scheduled': planned,
+                    'planned_executed': executed,
+                    'predicted_executed': pipelines.executed_steps(pipeline_type, planned, strength),
+                })
+
+    common.write_results({'failures': failures, 'runs': results}, args.output)
+    if failures:
+        sys.exit(1)
+
+main()
@@ -0,0 +1,73 @@
+# Randomly initialized miniature diffusers models, shaped after the diffusers fast tests. Built once and cached on disk.
+import os, tempfile
+
+TINY_FOLDER = os.path.join(tempfile.gettempdir(), 'ud_bench_tiny_models')
+TOKENIZER = "hf-internal-testing/tiny-random-clip"
+
+def text_encoder_config(projection_dim):
+    from transformers import CLIPTextConfig
+    return CLIPTextConfig(
+        bos_token_id=0, eos_token_id=2, hidden_size=32, intermediate_size=37, layer_norm_eps=1e-05,
+        num_attention_heads=4, num_hidden_layers=5, pad_token_id=1, vocab_size=1000, hidden_act="gelu",
+        projection_dim=projection_dim,
+    )
+
+def build_sdxl(path):
+    import torch
+    from diffusers import UNet2DConditionModel, AutoencoderKL, EulerDiscreteScheduler, StableDiffusionXLPipeline, ControlNetModel
+    from transformers import CLIPTextModel, CLIPTextModelWithProjection, CLIPTokenizer
+
+    torch.manual_seed(0)
+    unet = UNet2DConditionModel(
+        block_out_channels=(32, 64), layers_per_block=2, sample_size=32, in_channels=4, out_channels=4,
+        down_block_types=("DownBlock2D", "CrossAttnDownBlock2D"), up_block_types=("CrossAttnUpBlock2D", "UpBlock2D"),
+        attention_head_dim=(2, 4), use_linear_projection=True, addition_embed_type="text_time",
+        addition_time_embed_dim=8, transformer_layers_per_block=(1, 2), projection_class_embeddings_input_dim=80,
+        cross_attention_dim=64,
+    )
+    scheduler = EulerDiscreteScheduler(beta_start=0.00085, beta_end=0.012, steps_offset=1, beta_schedule="scaled_linear", timestep_spacing="leading")
+    # Three downsamplings like the full-size SDXL VAE, so latents match the ControlNet conditioning embedding
+    vae = AutoencoderKL(
+        block_out_channels=[32, 32, 64, 64], in_channels=3, out_channels=3, latent_channels=4, sample_size=128,
+        down_block_types=["DownEncoderBlock2D"] * 4, up_block_types=["UpDecoderBlock2D"] * 4,
+    )
+    tokenizer = CLIPTokenizer.from_pretrained(TOKENIZER)
+
+    pipe = StableDiffusionXLPipeline(
+        unet=unet, scheduler=scheduler, vae=vae,
+        text_encoder=CLIPTextModel(text_encoder_config(32)), tokenizer=tokenizer,
+        text_encoder_2=CLIPTextModelWithProjection(text_encoder_config(32)), tokenizer_2=tokenizer,
+    )
+    pipe.save_pretrained(os.path.join(path, 'sdxl'))
+    ControlNetModel.from_unet(unet).save_pretrained(os.path.join(path, 'controlnet'))
+
+def build_upscaler(path):
+    import torch
+    from diffusers import UNet2DConditionModel, AutoencoderKL, DDPMScheduler, DDIMScheduler, StableDiffusionUpscalePipeline
+    from transformers import CLIPTextModel, CLIPTokenizer
+
+    torch.manual_seed(0)
+    unet = UNet2DConditionModel(
+        block_out_channels=(32, 32, 64), layers_per_block=2, sample_size=32, in_channels=7, out_channels=4,
+        down_block_types=("DownBlock2D", "CrossAttnDownBlock2D", "CrossAttnDownBlock2D"),
+        up_block_types=("CrossAttnUpBlock2D", "CrossAttnUpBlock2D", "UpBlock2D"),
+        cross_attention_dim=32, attention_head_dim=8, use_linear_projection=True,
+        only_cross_attention=(True, True, False), num_class_embeds=100,
+    )
+    vae = AutoencoderKL(
+        block_out_channels=[32, 32, 64], in_channels=3, out_channels=3, latent_channels=4,
+        down_block_types=["DownEncoderBlock2D"] * 3, up_block_types=["UpDecoderBlock2D"] * 3,
+    )
+    pipe = StableDiffusionUpscalePipeline(
+        unet=unet, vae=vae, low_res_scheduler=DDPMScheduler(), scheduler=DDIMScheduler(prediction_type="v_prediction"),
+        text_encoder=CLIPTextModel(text_encoder_config(512)), tokenizer=CLIPTokenizer.from_pretrained(TOKENIZER),
+        max_noise_level=350,
+    )
+    pipe.save_pretrained(os.path.join(path, 'upscaler'))
+
+def tiny_models(path=TINY_FOLDER, rebuild=False):
+    if rebuild or not os.path.exists(os.path.join(path, 'sdxl', 'model_index.json')):
+        build_sdxl(path)
+    if rebuild or not os.path.exists(os.path.join(path, 'upscaler', 'model_index.json')):
+        build_upscaler(path)
+    return {name: os.path.join(path, name) for name in ['sdxl', 'controlnet', 'upscaler']}
@@ -0,0 +1,50 @@
+import os, json, math, threading
+
+from .constants import RESOLUTION_BUCKETS, BUCKET_SCALES
+
+def scale_bucket(bucket, scale):
+    return tuple(round(dim * scale / 64) * 64 for dim in bucket)
+
+def snap_to_bucket(width, height, buckets=RESOLUTION_BUCKETS, scales=BUCKET_SCALES):
+    # Closest aspect ratio first, then the smallest size tier covering the requested area
+    aspect = width / height
+    base = min(buckets, key=lambda b: abs(math.log(b[0] / b[1] / aspect)))
+
+    tiers = sorted({scale_bucket(base, scale) for scale in scales}, key=lambda b: b[0] * b[1])
+    for bucket in tiers:
+        if bucket[0] * bucket[1] >= width * height:
+            return bucket
+    return tiers[-1]
+
+class BucketStats:
+    def __init__(self, filepath=None):
+        self.filepath = filepath
+        self.lock = threading.Lock()
+        self.stats = {}
+
+        if filepath and os.path.exists(filepath):
+            try:
+                with open(filepath) as f:
+                    self.stats = json.load(f)
+            except (OSError, ValueError):
+                self.stats = {}
+
+    def record(self, width, height, seconds):
+        key = f'{width}x{height}'
+        with self.lock:
+            entry = self.stats.setdefault(key, {'count': 0, 'total': 0.0, 'min': seconds, 'max': seconds})
+            entry['count'] += 1
+            entry['total'] += seconds
+            entry['min'] = min(entry['min'], seconds)
+            entry['max'] = max(entry['max'], seconds)
+
+            if self.filepath:
+                with open(self.filepath, 'w') as f:
+                    json.dump(self.stats, f, indent=2)
+
+        return key, entry['total'] / entry['count'], entry['count']
+
+    def summary(self):
+        with self.lock:
+            return {key: {'count': e['count'], 'mean': e['total'] / e['count'], 'min': e['min'], 'max': e['max']}
+                    for key, e in sorted(self.stats.items())}
@@ -0,0 +1,89 @@
+import os, time
+
+import torch
+
+CHECKPOINT_FOLDER = os.path.join(os.path.expanduser('~'), '.cache', 'unexpected_diffusion', 'checkpoints')
+MAX_AGE = 7 * 24 * 3600
+
+class Checkpointer:
+    """Periodically saves the denoising latents of the running job so an interrupted job can continue from them"""
+
+    def __init__(self, folder=CHECKPOINT_FOLDER, min_seconds=10):
+        self.folder = folder
+        self.min_seconds = min_seconds # bounds the overhead on fast steps
+        self.key = None
+        self.saves = 0
+        self.seconds = 0.0
+        self.last_step = 0
+
+    def path(self, key):
+        return os.path.join(self.folder, f'{key}.pt')
+
+    def load(self, key):
+        path = self.path(key)
+        if not os.path.exists(path):
+            return None
+        try:
+            return torch.load(path, map_location='cpu')
+        except Exception as e:
+            print(f"UD: ignoring unreadable checkpoint {path}:\n\n{e}")
+            return None
+
+    def clear(self, key):
+        if key and os.path.exists(self.path(key)):
+            os.remove(self.path(key))
+
+    def prune(self):
+        if not os.path.isdir(self.folder):
+            return
+        now = time.time()
+        for name in os.listdir(self.folder):
+            path = os.path.join(self.folder, name)
+            if now - os.path.getmtime(path) > MAX_AGE:
+                os.remove(path)
+
+    def start(self, key, interval, num_inference_steps, planned_steps, offset=0):
+        self.key = key
+        self.interval = interval
+        self.num_inference_steps = num_inference_steps
+        self.planned_steps = planned_steps
+        self.offset = offset
+        self.last_save = time.perf_counter()
+        self.saves = 0
+        self.seconds = 0.0
+        self.last_step = offset
+
+    def stop(self):
+        self.key = None
+
+    def due(self, step_index):
+        step = self.offset + step_index + 1
+        return self.key is not None and step % self.interval == 0 and step < self.planned_steps and time.perf_counter() - self.last_save >= self.min_seconds
+
+    def save(self, step_index, timestep, latents, scheduler):
+        # The next timestep locates the resume point in the same schedule, first order schedulers have no other state to carry
+        later = scheduler.timesteps[scheduler.timesteps < timestep]
+        if not len(later):
+            return
+
+        start = time.perf_counter()
+        state = {
+            'step': self.offset + step_index + 1,
+            'planned_steps': self.planned_steps,
+            'num_inference_steps': self.num_inference_steps,
+            'next_timestep': float(later[0]),
+            'num_train_timesteps': scheduler.config.num_train_timesteps,
+            'scheduler': type(scheduler).__name__,
+            'latents': latents.detach().to('cpu'),
+        }
+
+        # Written beside and renamed, so a crash never leaves a truncated checkpoint
+        os.makedirs(self.folder, exist_ok=True)
+        temp_path = self.path(self.key) + '.tmp'
+        torch.save(state, temp_path)
+        os.replace(temp_path, self.path(self.key))
+
+        self.last_save = time.perf_counter()
+        self.seconds += self.last_save - start
+        self.saves += 1
+        self.last_step = state['step']
@@ -1,6 +1,15 @@
 from collections import namedtuple
 
-DiffModel = namedtuple('SDModel', ['id', 'label', 'type'])
+# quantization: default weight quantization of the transformer and T5 encoder (see QUANTIZATION_MODES)
+# profile: recommended sampling settings, applied when the model is selected; leaving a profiled model restores the property defaults
+DiffModel = namedtuple('SDModel', ['id', 'label', 'type', 'quantization', 'profile'], defaults=[None, None])
+
+# scheduler: diffusers scheduler class name, built from the model's own scheduler config (None keeps it)
+SamplingProfile = namedtuple('SamplingProfile', ['scheduler', 'steps', 'cfg', 'timestep_spacing', 'scheduler_config'], defaults=[None, None])
+
+DPM_SDE_KARRAS = {'algorithm_type': 'sde-dpmsolver++', 'use_karras_sigmas': True}
+
+QUANTIZATION_MODES = ['int8', 'fp8', 'nf4']
 
 DIFFUSION_MODELS = [
     DiffModel('stablediffusionapi/NightVision_XL', 'NightVision_XL', 'SDXL'),
@@ -9,26 +18,34 @@ DIFFUSION_MODELS = [
     DiffModel('SG161222/RealVisXL_V4.0', 'RealVisXL V4.0', 'SDXL'),
 
     DiffModel('stabilityai/stable-diffusion-xl-base-1.0', 'SDXL Base', 'SDXL'),
-    DiffModel('stabilityai/sdxl-turbo', 'SDXL Turbo', 'SDXL'),
-    DiffModel('Vargol/sdxl-lightning-4-steps', 'SDXL-Lightning', 'SDXL'),
+    DiffModel('stabilityai/sdxl-turbo', 'SDXL Turbo', 'SDXL',
+              profile=SamplingProfile('EulerAncestralDiscreteScheduler', 4, 0.0, 'trailing')),
+    DiffModel('Vargol/sdxl-lightning-4-steps', 'SDXL-Lightning', 'SDXL',
+              profile=SamplingProfile('EulerDiscreteScheduler', 4, 0.0, 'trailing')),
 
     DiffModel('segmind/SSD-1B', 'SSD-1B', 'SDXL'),
 
     DiffModel('Lykon/dreamshaper-xl-1-0', 'Dreamshaper XL 1.0', 'SDXL'),
-    DiffModel('Lykon/dreamshaper-xl-turbo', 'Dreamshaper XL Turbo', 'SDXL'),
+    DiffModel('Lykon/dreamshaper-xl-turbo', 'Dreamshaper XL Turbo', 'SDXL',
+              profile=SamplingProfile('DPMSolverMultistepScheduler', 6, 2.0, scheduler_config=DPM_SDE_KARRAS)),
 
     DiffModel('stablediffusionapi/juggernaut-xl-v7', 'Juggernaut XL v7', 'SDXL'),
-    DiffModel('RunDiffusion/Juggernaut-X-Hyper', 'Juggernaut-X-Hyper', 'SDXL'),
+    DiffModel('RunDiffusion/Juggernaut-X-Hyper', 'Juggernaut-X-Hyper', 'SDXL',
+              profile=SamplingProfile('DPMSolverMultistepScheduler', 6, 1.5, scheduler_config=DPM_SDE_KARRAS)),
 
     DiffModel('playgroundai/playground-v2-1024px-aesthetic', 'Playground V2 Aesthetic', 'SDXL'),
-    DiffModel('playgroundai/playground-v2.5-1024px-aesthetic', 'Playground V2.5 Aesthetic', 'SDXL'),
+    DiffModel('playgroundai/playground-v2.5-1024px-aesthetic', 'Playground V2.5 Aesthetic', 'SDXL',
+              profile=SamplingProfile('EDMDPMSolverMultistepScheduler', 50, 3.0)),
 
-    DiffModel('black-forest-labs/FLUX.1-schnell', 'FLUX.1-schnell', 'FLUX'),
+    DiffModel('black-forest-labs/FLUX.1-schnell', 'FLUX.1-schnell', 'FLUX', quantization='nf4',
+              profile=SamplingProfile(None, 4, 0.0)),
 
     DiffModel('stabilityai/stable-diffusion-3.5-medium', 'Stable Diffusion 3.5 Medium', 'SD3'),
-    DiffModel('stabilityai/stable-diffusion-3.5-large', 'Stable Diffusion 3.5 Large', 'SD3'),
+    DiffModel('stabilityai/stable-diffusion-3.5-large', 'Stable Diffusion 3.5 Large', 'SD3', quantization='nf4'),
 ]
 
+MODELS_BY_ID = {model.id: model for model in DIFFUSION_MODELS}
+
 CONTROLNET_MODELS = {
     'diffusers/controlnet-depth-sdxl-1.0': {'name': 'controlnet-depth-sdxl-1.0', 'model_type': 'diffusers'},
     'diffusers/controlnet-depth-sdxl-1.0-small': {'name': 'controlnet-depth-sdxl-1.0-small', 'model_type': 'diffusers'},
@@ -54,4 +71,15 @@ T2I_MODELS = {
     'TencentARC/t2i-adapter-depth-midas-sdxl-1.0': {'name': 't2i-adapter-depth-midas-sdxl-1.0', 'model_type': 'diffusers'},
     'TencentARC/t2i-adapter-depth-zoe-sdxl-1.0': {'name': 't2i-adapter-depth-zoe-sdxl-1.0', 'model_type': 'diffusers'},
     'TencentARC/t2i-adapter-openpose-sdxl-1.0': {'name': 't2i-adapter-openpose-sdxl-1.0', 'model_type': 'diffusers'},
-}
\ No newline at end of file
+}
+
+# Native SDXL training resolutions (~1 megapixel). Each bucket is also offered at the BUCKET_SCALES size tiers.
+RESOLUTION_BUCKETS = [
+    (1024, 1024),
+    (1152, 896), (896, 1152),
+    (1216, 832), (832, 1216),
+    (1344, 768), (768, 1344),
+    (1536, 640), (640, 1536),
+]
+
+BUCKET_SCALES = [0.5, 0.75, 1, 1.5, 2, 3]
@@ -0,0 +1,94 @@
+import threading, queue
+
+class Job:
+    def __init__(self, fn, model=None):
+        self.fn = fn
+        self.model = model
+        self.result = None
+        self.error = None
+        self.device = None
+        self.done = threading.Event()
+
+    def wait(self, timeout=None):
+        self.done.wait(timeout)
+        if self.error:
+            raise self.error
+        return self.result
+
+class DeviceWorker:
+    """Owns one resident processor and runs its jobs one at a time on a dedicated thread"""
+
+    def __init__(self, device, processor_factory, lock):
+        self.device = device
+        self.lock = lock
+        self.processor_factory = processor_factory
+        self.processor = None
+        self.jobs = queue.Queue()
+        self.load = 0
+        self.model = None # Model resident once the queue has drained
+        self.thread = threading.Thread(target=self.loop, daemon=True)
+        self.thread.start()
+
+    def loop(self):
+        while True:
+            job = self.jobs.get()
+            if job is None:
+                break
+
+            try:
+                if self.processor is None:
+                    self.processor = self.processor_factory(self.device)
+                job.device = self.device
+                job.result = job.fn(self.processor)
+            except Exception as e:
+                job.error = e
+            finally:
+                with self.lock:
+                    self.load -= 1
+                    if self.load == 0 and self.processor is not None:
+                        self.model = self.processor.loaded_model
+                job.done.set()
+
+    def stop(self):
+        self.jobs.put(None)
+
+class DevicePool:
+    # How many extra queued jobs a worker that already holds the model may have before another device loads it too
+    affinity_slack = 1
+
+    def __init__(self, devices, processor_factory):
+        self.lock = threading.Lock()
+        self.workers = [DeviceWorker(device, processor_factory, self.lock) for device in devices]
+
+    def pick(self, model):
+        least_loaded = min(self.workers, key=lambda w: w.load)
+        resident = [w for w in self.workers if model is not None and w.model == model]
+        if resident:
+            best = min(resident, key=lambda w: w.load)
+            if best.load <= least_loaded.load + self.affinity_slack:
+                return best
+        return least_loaded
+
+    def submit(self, fn, model=None):
+        job = Job(fn, model)
+        with self.lock:
+            worker = self.pick(model)
+            worker.load += 1
+            if model is not None:
+                worker.model = model
+            worker.jobs.put(job)
+        return job
+
+    def broadcast(self, fn):
+        jobs = []
+        with self.lock:
+            for worker in self.workers:
+                job = Job(fn)
+                worker.load += 1
+                worker.jobs.put(job)
+                jobs.append(job)
+        return jobs
+
+    def shutdown(self):
+        for worker in self.workers:
+            worker.stop()
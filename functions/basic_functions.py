@@ -1,7 +1,8 @@
-from ..constants import DIFFUSION_MODELS
+from ..constants import MODELS_BY_ID
 
 def get_model_type(model_id):
-    for model in DIFFUSION_MODELS:
-        if model.id == model_id:
-            return model.type
-    return None  # Return None if the ID is not found
\ No newline at end of file
+    model = MODELS_BY_ID.get(model_id)
+    return model.type if model else None  # Return None if the ID is not found
+
+def get_model(model_id):
+    return MODELS_BY_ID.get(model_id)
@@ -1,24 +1,70 @@
+import bpy, queue, threading
+from ..tracing import Tracer
+
 class ProcessManager:
-    def __init__(self, ws, pg):
+    # The worker thread only queues updates, a timer on the main thread applies them to the property group
+    interval = 0.1
+
+    def __init__(self, ws, pg, tracer=None):
         self.ws = ws
         self.pg = pg
+        self.tracer = tracer or Tracer('job')
+        self.updates = queue.SimpleQueue()
+        self.stop_event = threading.Event()
+
+    def start(self):
+        bpy.app.timers.register(self.flush, first_interval=0)
 
     def set_running(self, value):
-        self.pg.running = value
+        self.updates.put(('running', value))
 
     def set_progress(self, value):
-        self.pg.progress = value
+        self.updates.put(('progress', value))
 
     def set_progress_text(self, value):
-        self.pg.progress_text = value
+        self.updates.put(('progress_text', value))
+
+    def set_trace_summary(self, value):
+        self.updates.put(('trace_summary', value))
+
+    def set_telemetry_summary(self, value):
+        self.updates.put(('telemetry_summary', value))
 
     def set_stop_process(self, value):
-        self.pg.stop_process = value
+        if value:
+            self.stop_event.set()
+        else:
+            self.stop_event.clear()
 
     def stop_process(self):
-        return self.pg.stop_process
+        return self.stop_event.is_set()
+
+    def flush(self):
+        if self.pg.stop_process:
+            self.pg.stop_process = 0
+            self.stop_event.set()
+
+        latest = {}
+        while True:
+            try:
+                name, value = self.updates.get_nowait()
+            except queue.Empty:
+                break
+            latest[name] = value
+
+        for name, value in latest.items():
+            if getattr(self.pg, name) != value:
+                setattr(self.pg, name, value)
+
+        if latest:
+            self.redraw()
+
+        if latest.get('running', 1) == 0:
+            return None
+        return self.interval
 
     def redraw(self):
-        for screen in self.ws.screens:
-            for area in screen.areas:
-                area.tag_redraw()
\ No newline at end of file
+        for window in bpy.context.window_manager.windows:
+            for area in window.screen.areas:
+                if area.type == 'IMAGE_EDITOR':
+                    area.tag_redraw()
@@ -0,0 +1,244 @@
+# Optional inference server kept alive across Blender sessions and addon reloads.
+# Jobs arrive over a local socket, images travel as raw arrays in shared memory.
+
+import os, sys, time, secrets, subprocess, tempfile, traceback
+from multiprocessing import shared_memory
+from multiprocessing.connection import Client, Listener
+
+import numpy as np
+
+ADDON_FOLDER = os.path.dirname(os.path.abspath(__file__))
+KEY_FILEPATH = os.path.join(tempfile.gettempdir(), 'ud_server.key')
+IMAGE_SLOTS = ['init_image_slot', 'init_mask_slot', 'controlnet_image_slot', 't2i_image_slot', 'source_image']
+CONNECT_TIMEOUT = 60
+
+def authkey():
+    if not os.path.exists(KEY_FILEPATH):
+        fd = os.open(KEY_FILEPATH, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+        with os.fdopen(fd, 'w') as f:
+            f.write(secrets.token_hex(32))
+    with open(KEY_FILEPATH) as f:
+        return f.read().strip().encode()
+
+def share_array(array):
+    shm = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+    np.ndarray(array.shape, dtype=array.dtype, buffer=shm.buf)[:] = array
+    return shm, {'name': shm.name, 'shape': array.shape, 'dtype': str(array.dtype)}
+
+def read_array(descriptor):
+    shm = shared_memory.SharedMemory(name=descriptor['name'])
+    # Before Python 3.13 attaching also registers the segment for cleanup, but the creator owns it
+    if sys.version_info < (3, 13):
+        from multiprocessing import resource_tracker
+        resource_tracker.unregister(shm._name, 'shared_memory')
+    try:
+        return np.ndarray(descriptor['shape'], dtype=descriptor['dtype'], buffer=shm.buf).copy()
+    finally:
+        shm.close()
+
+def release(segments):
+    for shm in segments:
+        shm.close()
+        shm.unlink()
+
+def blender_image_to_array(blender_image):
+    width, height = blender_image.size
+    pixels = np.empty(width * height * 4, dtype=np.float32)
+    blender_image.pixels.foreach_get(pixels)
+    pixels = np.flip(pixels.reshape(height, width, 4), axis=0)
+    return (pixels * 255).astype(np.uint8)
+
+def array_to_blender_image(array, name):
+    import bpy
+    height, width = array.shape[:2]
+    if array.shape[2] == 3:
+        array = np.concatenate([array, np.full((height, width, 1), 255, dtype=np.uint8)], axis=2)
+
+    image = bpy.data.images.new(name, width, height, alpha=True)
+    image.pixels.foreach_set((np.flip(array, axis=0).astype(np.float32) / 255).ravel())
+    return image
+
+### Server
+
+class RemoteManager:
+    def __init__(self, conn):
+        from .tracing import Tracer
+        self.conn = conn
+        self.tracer = Tracer('server')
+        self.stop = False
+
+    def set_running(self, value):
+        pass
+
+    def set_progress(self, value):
+        self.conn.send(('progress', value))
+
+    def set_progress_text(self, value):
+        self.conn.send(('progress_text', value))
+
+    def set_trace_summary(self, value):
+        self.conn.send(('trace_summary', value))
+
+    def set_stop_process(self, value):
+        self.stop = bool(value)
+
+    def stop_process(self):
+        while not self.stop and self.conn.poll():
+            if self.conn.recv()[0] == 'stop':
+                self.stop = True
+        return self.stop
+
+def decode_params(params):
+    from PIL import Image
+    for slot in IMAGE_SLOTS:
+        value = params.get(slot)
+        if isinstance(value, list):
+            params[slot] = [Image.fromarray(read_array(d)) for d in value]
+        elif value:
+            params[slot] = Image.fromarray(read_array(value))
+    return params
+
+def handle_job(processor, conn, params):
+    manager = RemoteManager(conn)
+    params = decode_params(params)
+    params['temp_image_filepath'] = None
+
+    with manager.tracer.span('job', mode=params['mode']):
+        # Latent upscales find their latents here, kept by the generation that ran in this process under the same image name
+        if params['mode'] in ['upscale_sd', 'upscale_re', 'upscale_latent']:
+            image = processor.upscale(params=params, manager=manager)
+        else:
+            image = processor.run(params=params, manager=manager)
+    manager.set_trace_summary(manager.tracer.summary())
+
+    if image is None:
+        conn.send(('result', None))
+        return
+
+    shm, descriptor = share_array(np.asarray(image))
+    try:
+        conn.send(('result', descriptor))
+        conn.recv() # The client acknowledges once it copied the result
+    finally:
+        release([shm])
+
+def serve(port):
+    from .ud_processor import UD_Processor
+    processor = UD_Processor()
+
+    with Listener(('localhost', port), authkey=authkey()) as listener:
+        print(f"UD: inference server listening on localhost:{port}")
+        while True:
+            with listener.accept() as conn:
+                try:
+                    command, payload = conn.recv()
+                    if command == 'run':
+                        handle_job(processor, conn, payload)
+                    elif command == 'unload':
+                        processor.unload(clear_modules=True)
+                        conn.send(('done', None))
+                    elif command == 'ping':
+                        conn.send(('pong', os.getpid()))
+                    elif command == 'shutdown':
+                        conn.send(('done', None))
+                        return
+                except (EOFError, ConnectionError):
+                    print("UD: client disconnected")
+                except Exception as e:
+                    traceback.print_exc()
+                    try:
+                        conn.send(('error', str(e)))
+                    except (EOFError, ConnectionError):
+                        pass
+
+### Client
+
+class InferenceClient:
+    def __init__(self, port):
+        self.port = port
+        self.server_summary = ''
+
+    def connect(self, launch=True):
+        try:
+            return Client(('localhost', self.port), authkey=authkey())
+        except ConnectionRefusedError:
+            if not launch:
+                raise
+
+        self.launch()
+        deadline = time.monotonic() + CONNECT_TIMEOUT
+        while True:
+            try:
+                return Client(('localhost', self.port), authkey=authkey())
+            except ConnectionRefusedError:
+                if time.monotonic() > deadline:
+                    raise
+                time.sleep(0.5)
+
+    def launch(self):
+        import bpy
+        # A background Blender provides the same Python and dependencies, detached so it outlives this session
+        subprocess.Popen(
+            [bpy.app.binary_path, '--background', '--factory-startup', '--python', os.path.abspath(__file__), '--', str(self.port)],
+            start_new_session=True,
+        )
+
+    def command(self, command, payload=None):
+        with self.connect(launch=False) as conn:
+            conn.send((command, payload))
+            return conn.recv()
+
+    def encode_params(self, params, segments):
+        encoded = {}
+        for key, value in params.items():
+            if key in IMAGE_SLOTS:
+                if isinstance(value, (list, tuple)):
+                    shared = [share_array(blender_image_to_array(image)) for image in value]
+                    segments.extend(shm for shm, _ in shared)
+                    encoded[key] = [descriptor for _, descriptor in shared]
+                elif value is not None:
+                    array = value if isinstance(value, np.ndarray) else blender_image_to_array(value)
+                    shm, encoded[key] = share_array(array)
+                    segments.append(shm)
+                else:
+                    encoded[key] = None
+            elif isinstance(value, (str, int, float, bool, type(None))) or (isinstance(value, list) and all(isinstance(v, (str, int, float)) for v in value)):
+                encoded[key] = value
+        return encoded
+
+    def run(self, params, manager):
+        segments = []
+        try:
+            with self.connect() as conn:
+                conn.send(('run', self.encode_params(params, segments)))
+                stop_sent = False
+
+                while True:
+                    kind, value = conn.recv()
+                    if kind == 'progress':
+                        manager.set_progress(value)
+                    elif kind == 'progress_text':
+                        manager.set_progress_text(value)
+                    elif kind == 'trace_summary':
+                        self.server_summary = value
+                    elif kind == 'error':
+                        raise RuntimeError(value)
+                    elif kind == 'result':
+                        if value is None:
+                            return None
+                        array = read_array(value)
+                        conn.send(('ack', None))
+                        return array
+
+                    if not stop_sent and manager.stop_process():
+                        conn.send(('stop', None))
+                        stop_sent = True
+        finally:
+            release(segments)
+
+if __name__ == '__main__':
+    # Started by InferenceClient.launch inside a background Blender: import the addon as a package
+    import importlib
+    sys.path.insert(0, os.path.dirname(ADDON_FOLDER))
+    server = importlib.import_module(f'{os.path.basename(ADDON_FOLDER)}.inference_server')
+    server.serve(int(sys.argv[sys.argv.index('--') + 1]))
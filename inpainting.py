@@ -0,0 +1,61 @@
+from PIL import Image, ImageFilter
+
+from . import buckets
+from .constants import BUCKET_SCALES
+
+# Pipelines that only change the masked area, so the rest of the image can stay out of the diffusion
+CROP_PIPELINES = ['StableDiffusionXLInpaintPipeline', 'StableDiffusionXLControlNetInpaintPipeline']
+
+# Working resolutions at or above the model's native size, smaller crops are upsampled for detail
+WORK_SCALES = [scale for scale in BUCKET_SCALES if scale >= 1]
+
+class MaskCrop:
+    def __init__(self, box, work_size, feather):
+        self.box = box
+        self.work_size = work_size
+        self.feather = feather
+
+    @property
+    def size(self):
+        return self.box[2] - self.box[0], self.box[3] - self.box[1]
+
+    def extract(self, image):
+        return image.crop(self.box).resize(self.work_size, Image.Resampling.LANCZOS)
+
+    def composite(self, result, image, mask):
+        # Grow the mask before blurring so the whole masked area is taken from the result and the seam falls in the padding
+        size = self.feather * 2 + 1
+        blend = mask.convert('L').crop(self.box).filter(ImageFilter.MaxFilter(size)).filter(ImageFilter.GaussianBlur(self.feather))
+
+        output = image.convert('RGB')
+        output.paste(result.convert('RGB').resize(self.size, Image.Resampling.LANCZOS), self.box[:2], blend)
+        return output
+
+def fit_aspect(box, aspect, size):
+    # Grow the shorter side of the box around its center to the working aspect ratio, staying inside the image
+    left, top, right, bottom = box
+    width, height = right - left, bottom - top
+    if width / height < aspect:
+        width = min(round(height * aspect), size[0])
+    else:
+        height = min(round(width / aspect), size[1])
+
+    left = int(min(max((box[0] + box[2] - width) / 2, 0), size[0] - width))
+    top = int(min(max((box[1] + box[3] - height) / 2, 0), size[1] - height))
+    return left, top, left + width, top + height
+
+def plan_crop(mask, padding=64, max_fraction=0.5):
+    box, size = mask.bbox, mask.size
+    if box is None:
+        return None
+
+    box = max(box[0] - padding, 0), max(box[1] - padding, 0), min(box[2] + padding, size[0]), min(box[3] + padding, size[1])
+
+    work_size = buckets.snap_to_bucket(box[2] - box[0], box[3] - box[1], scales=WORK_SCALES)
+    box = fit_aspect(box, work_size[0] / work_size[1], size)
+
+    # A crop covering most of the image saves little and loses the surrounding context
+    if (box[2] - box[0]) * (box[3] - box[1]) > max_fraction * size[0] * size[1]:
+        return None
+
+    return MaskCrop(box, work_size, max(padding // 4, 1))
@@ -0,0 +1,50 @@
+import numpy as np
+from PIL import Image
+
+# Coverage above which the whole image is repainted
+FULL_COVERAGE = 0.999
+
+class Mask:
+    """Single channel uint8 mask, white is repainted. Statistics are computed once when the mask is built."""
+
+    def __init__(self, values):
+        self.values = np.ascontiguousarray(values, dtype=np.uint8)
+        self.height, self.width = self.values.shape
+
+        # Per-row counts give the coverage and the vertical extent, a column reduction gives the horizontal one
+        binary = self.values > 127
+        row_counts = np.count_nonzero(binary, axis=1)
+        rows = np.flatnonzero(row_counts)
+        cols = np.flatnonzero(binary.any(axis=0)) if rows.size else rows
+
+        self.mean = float(self.values.mean())
+        self.coverage = float(row_counts.sum()) / self.values.size
+        self.bbox = (int(cols[0]), int(rows[0]), int(cols[-1]) + 1, int(rows[-1]) + 1) if rows.size else None
+
+    @property
+    def size(self):
+        return self.width, self.height
+
+    @property
+    def empty(self):
+        # Any repainted pixel counts, small touch-ups are what crop-to-mask inpainting is for
+        return self.bbox is None
+
+    @property
+    def full(self):
+        return self.coverage >= FULL_COVERAGE
+
+    def image(self):
+        return Image.fromarray(self.values, 'L')
+
+def from_alpha(rgba):
+    # Transparent pixels are repainted
+    return Mask(255 - np.asarray(rgba)[..., 3])
+
+def from_luminance(image):
+    pixels = np.asarray(image)
+    if pixels.ndim == 2:
+        return Mask(pixels)
+    # ITU-R 601-2 luma, matching PIL's convert('L')
+    luma = pixels[..., :3].astype(np.uint32) @ np.array([299, 587, 114], dtype=np.uint32)
+    return Mask((luma + 500) // 1000)
@@ -0,0 +1,309 @@
+import os, re, json, time, hashlib, threading
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor, wait
+
+MODELS_FOLDER = os.path.join(os.path.expanduser('~'), '.cache', 'unexpected_diffusion', 'models')
+COMPLETE_MARKER = '.complete'
+CHUNK_SIZE = 1024 * 1024
+POLL_INTERVAL = 0.02 # seconds between checks for a cancel while files download
+
+# Configs and tokenizer files are always fetched, of the weights only the format from_pretrained picks first
+CONFIG_EXTENSIONS = ('.json', '.txt', '.model')
+WEIGHT_PREFERENCE = [('.safetensors', 'fp16'), ('.safetensors', None), ('.bin', 'fp16'), ('.bin', None)]
+VARIANT = re.compile(r'\.(fp16|fp32|bf16|ema|non_ema)[.-]')
+WEIGHT_NAME = re.compile(r'^(diffusion_pytorch_model|model|pytorch_model)[.-]') # alternative weights like *_promax stay out
+
+# sha256 is known for LFS files, small files carry their git blob id
+RemoteFile = namedtuple('RemoteFile', ['path', 'size', 'sha256', 'blob_id'])
+
+class FetchCancelled(Exception):
+    pass
+
+def weight_key(path):
+    name = os.path.basename(path)
+    if not WEIGHT_NAME.match(name):
+        return None, None
+    extension = next((ext for ext, _ in WEIGHT_PREFERENCE if name.endswith(ext)), None)
+    match = VARIANT.search(name)
+    return extension, match.group(1) if match else None
+
+def select_files(files, components=None):
+    # Pipeline repos also ship single-file checkpoints and unused folders, only the components of model_index.json are loaded
+    folders = {}
+    for entry in files:
+        folder = os.path.dirname(entry.path)
+        if components is not None and folder.split('/')[0] not in components:
+            continue
+        folders.setdefault(folder, []).append(entry)
+
+    selected = []
+    for entries in folders.values():
+        selected += [entry for entry in entries if entry.path.endswith(CONFIG_EXTENSIONS)]
+        for preference in WEIGHT_PREFERENCE:
+            weights = [entry for entry in entries if weight_key(entry.path) == preference]
+            if weights:
+                selected += weights
+                break
+    return selected
+
+def file_hasher(entry):
+    if entry.sha256:
+        return hashlib.sha256()
+    if entry.blob_id:
+        hasher = hashlib.sha1()
+        hasher.update(f'blob {entry.size}\0'.encode())
+        return hasher
+    return None
+
+def hash_file(path, hasher):
+    with open(path, 'rb') as f:
+        while True:
+            chunk = f.read(CHUNK_SIZE)
+            if not chunk:
+                break
+            hasher.update(chunk)
+    return hasher
+
+class HubSource:
+    """Hugging Face Hub files, pinned to the revision listed first so a download never mixes commits"""
+
+    def __init__(self):
+        self.revisions = {}
+
+    def cached(self, model_id):
+        # Models already loaded by from_pretrained before keep being read from the hub cache
+        from huggingface_hub import try_to_load_from_cache
+        return any(isinstance(try_to_load_from_cache(model_id, name), str) for name in ['model_index.json', 'config.json'])
+
+    def files(self, model_id):
+        from huggingface_hub import HfApi
+        info = HfApi().model_info(model_id, files_metadata=True)
+        self.revisions[model_id] = info.sha
+        return [RemoteFile(f.rfilename, f.lfs.size if f.lfs else f.size, f.lfs.sha256 if f.lfs else None, None if f.lfs else f.blob_id)
+                for f in info.siblings]
+
+    def chunks(self, model_id, path, offset=0):
+        import requests
+        from huggingface_hub import hf_hub_url, get_token
+
+        headers = {'Range': f'bytes={offset}-'} if offset else {}
+        token = get_token()
+        if token:
+            headers['Authorization'] = f'Bearer {token}'
+
+        url = hf_hub_url(model_id, path, revision=self.revisions.get(model_id))
+        with requests.get(url, headers=headers, stream=True, timeout=60) as response:
+            response.raise_for_status()
+            skip = offset if response.status_code != 206 else 0 # the range was ignored
+            for chunk in response.iter_content(CHUNK_SIZE):
+                if skip:
+                    chunk, skip = chunk[skip:], max(skip - len(chunk), 0)
+                if chunk:
+                    yield chunk
+
+class LocalSource:
+    """Stand-in for the hub serving <folder>/<org>/<name>/..., checksums are computed from the files"""
+
+    def __init__(self, folder, chunk_delay=0):
+        self.folder = folder
+        self.chunk_delay = chunk_delay # seconds per chunk, to exercise progress and interruption
+
+    def cached(self, model_id):
+        return False
+
+    def files(self, model_id):
+        root = os.path.join(self.folder, model_id)
+        files = []
+        for folder, _, names in os.walk(root):
+            for name in names:
+                path = os.path.join(folder, name)
+                digest = hash_file(path, hashlib.sha256()).hexdigest()
+                files.append(RemoteFile(os.path.relpath(path, root).replace(os.sep, '/'), os.path.getsize(path), digest, None))
+        return files
+
+    def chunks(self, model_id, path, offset=0):
+        with open(os.path.join(self.folder, model_id, path), 'rb') as f:
+            f.seek(offset)
+            while True:
+                chunk = f.read(CHUNK_SIZE)
+                if not chunk:
+                    break
+                time.sleep(self.chunk_delay)
+                yield chunk
+
+class ModelFetcher:
+    """Downloads model repositories in parallel into local folders that from_pretrained loads directly.
+    Partial files are resumed and every file is checked against the hub's checksum before it is moved in place."""
+
+    def __init__(self, source=None, folder=MODELS_FOLDER, workers=4, report_interval=0.25):
+        self.source = source or HubSource()
+        self.folder = folder
+        self.workers = workers
+        self.report_interval = report_interval
+        self.lock = threading.Lock()
+        self.model_locks = {} # model id -> lock held by the fetch writing its files
+
+    def local_path(self, model_id):
+        return os.path.join(self.folder, model_id.replace('/', '--'))
+
+    def complete(self, model_id):
+        return os.path.exists(os.path.join(self.local_path(model_id), COMPLETE_MARKER))
+
+    def resolve(self, model_id):
+        return self.local_path(model_id) if self.complete(model_id) else model_id
+
+    def needed(self, model_id):
+        return not (os.path.isdir(model_id) or self.complete(model_id) or self.source.cached(model_id))
+
+    def plan(self, model_id):
+        files = self.source.files(model_id)
+        components = None
+        if any(entry.path == 'model_index.json' for entry in files):
+            index = json.loads(b''.join(self.source.chunks(model_id, 'model_index.json')))
+            components = {name for name in index if not name.startswith('_')} | {''}
+        return select_files(files, components)
+
+    def model_lock(self, model_id):
+        with self.lock:
+            return self.model_locks.setdefault(model_id, threading.Lock())
+
+    def fetch(self, model_ids, progress=None, cancel=None):
+        # Returns the models that could not be fetched, they are left to from_pretrained.
+        # Workers of several devices may start the same model, the later fetch waits and then finds it complete.
+        model_ids = list(dict.fromkeys(model_ids))
+        held = []
+        try:
+            for lock in [self.model_lock(model_id) for model_id in sorted(model_ids)]:
+                while not lock.acquire(timeout=POLL_INTERVAL):
+                    if cancel and cancel():
+                        raise FetchCancelled()
+                held.append(lock)
+            return self.fetch_locked(model_ids, progress, cancel)
+        finally:
+            for lock in held:
+                lock.release()
+
+    def fetch_locked(self, model_ids, progress, cancel):
+        plans, failed = {}, []
+        for model_id in model_ids:
+            try:
+                if self.needed(model_id):
+                    plans[model_id] = self.plan(model_id)
+            except Exception as e:
+                print(f"UD: could not list the files of {model_id}:\n\n{e}")
+                failed.append(model_id)
+
+        if not plans:
+            return failed
+
+        state = {'done': 0, 'total': 0, 'fetched': 0, 'reported': 0}
+        for model_id, files in plans.items():
+            for entry in files:
+                state['total'] += entry.size
+                state['done'] += self.present_bytes(model_id, entry)
+
+        stop = threading.Event()
+        def advance(count):
+            with self.lock:
+                state['done'] += count
+                state['fetched'] += count
+            if stop.is_set():
+                raise FetchCancelled()
+
+        with ThreadPoolExecutor(self.workers) as executor:
+            futures = {model_id: [executor.submit(self.download, model_id, entry, advance) for entry in files] for model_id, files in plans.items()}
+
+            # Progress and cancel callbacks may use the inference server connection, so they only run on this thread
+            pending = [future for model_futures in futures.values() for future in model_futures]
+            while pending:
+                pending = wait(pending, timeout=POLL_INTERVAL).not_done
+                if cancel and not stop.is_set() and cancel():
+                    stop.set()
+                now = time.perf_counter()
+                if progress and pending and now - state['reported'] >= self.report_interval:
+                    state['reported'] = now
+                    with self.lock:
+                        done, fetched = state['done'], state['fetched']
+                    progress(done, state['total'], fetched)
+
+            cancelled = False
+            for model_id, model_futures in futures.items():
+                errors = []
+                for future in model_futures:
+                    try:
+                        future.result()
+                    except FetchCancelled:
+                        cancelled = True
+                    except Exception as e:
+                        errors.append(e)
+
+                if errors:
+                    print(f"UD: could not fetch {model_id}:\n\n{errors[0]}")
+                    failed.append(model_id)
+                elif not cancelled:
+                    os.makedirs(self.local_path(model_id), exist_ok=True)
+                    with open(os.path.join(self.local_path(model_id), COMPLETE_MARKER), 'w') as f:
+                        json.dump({'revision': getattr(self.source, 'revisions', {}).get(model_id), 'files': [entry.path for entry in plans[model_id]]}, f, indent=2)
+
+        if cancelled:
+            raise FetchCancelled()
+        if progress:
+            progress(state['done'], state['total'], state['fetched'])
+        return failed
+
+    def present_bytes(self, model_id, entry):
+        target = os.path.join(self.local_path(model_id), entry.path)
+        for path in [target, target + '.part']:
+            if os.path.exists(path):
+                return min(os.path.getsize(path), entry.size)
+        return 0
+
+    def download(self, model_id, entry, advance):
+        target = os.path.join(self.local_path(model_id), entry.path)
+        if os.path.exists(target) and os.path.getsize(target) == entry.size:
+            return
+        advance(0) # queued files stop here once the fetch is cancelled
+
+        part = target + '.part'
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        offset = os.path.getsize(part) if os.path.exists(part) else 0
+        if offset > entry.size:
+            os.remove(part)
+            advance(-entry.size)
+            offset = 0
+
+        # The checksum is built while the file streams in, a resumed file rehashes its existing part first
+        hasher = file_hasher(entry)
+        if hasher and offset:
+            hash_file(part, hasher)
+
+        if offset < entry.size:
+            with open(part, 'ab') as f:
+                for chunk in self.source.chunks(model_id, entry.path, offset):
+                    f.write(chunk)
+                    if hasher:
+                        hasher.update(chunk)
+                    advance(len(chunk))
+
+        expected = entry.sha256 or entry.blob_id
+        if os.path.getsize(part) != entry.size or (hasher and hasher.hexdigest() != expected):
+            advance(-min(os.path.getsize(part), entry.size))
+            os.remove(part)
+            raise ValueError(f"{entry.path} does not match its checksum, it will be downloaded again")
+        os.replace(part, target)
+
+fetcher = ModelFetcher()
+
+def format_bytes(count):
+    return f'{count / 1024 ** 3:.2f} GB' if count >= 1024 ** 3 else f'{count / 1024 ** 2:.0f} MB'
+
+def progress_reporter(manager, label='Downloading'):
+    start = time.perf_counter()
+    def report(done, total, fetched):
+        rate = fetched / max(time.perf_counter() - start, 1e-6)
+        text = f'{label} {format_bytes(done)} / {format_bytes(total)}'
+        if rate > 0:
+            text += f' - {format_bytes(rate)}/s'
+        manager.set_progress(int(done / total * 100) if total else 100)
+        manager.set_progress_text(text)
+    return report
@@ -0,0 +1,61 @@
+import time
+from collections import OrderedDict
+
+from .quantization import module_bytes
+
+class ModuleCache:
+    """ControlNets and adapters shared by the pipelines of one device, by model id.
+    Modules used by the loaded pipeline stay on the device, released ones are parked in host memory
+    and the least recently used are dropped once the parked ones exceed the budget."""
+
+    def __init__(self, device, budget):
+        self.device = device
+        self.budget = budget
+        self.entries = OrderedDict() # model id -> {'module', 'refs', 'bytes', 'used'}
+
+    def acquire(self, key, load):
+        entry = self.entries.get(key)
+        if entry is None:
+            module = load()
+            if module is None:
+                return None
+            entry = self.entries[key] = {'module': module, 'refs': 0, 'bytes': module_bytes(module), 'used': time.time()}
+        elif entry['refs'] == 0:
+            entry['module'].to(self.device)
+            print(f"UD: reusing {key}")
+
+        entry['refs'] += 1
+        entry['used'] = time.time()
+        self.entries.move_to_end(key)
+        return entry['module']
+
+    def release(self, key):
+        entry = self.entries.get(key)
+        if entry is None or entry['refs'] == 0:
+            return
+        entry['refs'] -= 1
+        entry['used'] = time.time()
+        self.entries.move_to_end(key)
+        if entry['refs'] == 0 and self.device.type != 'cpu':
+            entry['module'].to('cpu')
+        self.evict(self.budget)
+
+    def parked_bytes(self):
+        return sum(entry['bytes'] for entry in self.entries.values() if entry['refs'] == 0)
+
+    def evict(self, budget):
+        parked = self.parked_bytes()
+        for key, entry in list(self.entries.items()):
+            if parked <= budget:
+                break
+            if entry['refs'] == 0:
+                del self.entries[key]
+                parked -= entry['bytes']
+
+    def drop(self, key):
+        entry = self.entries.get(key)
+        if entry is not None and entry['refs'] == 0:
+            del self.entries[key]
+
+    def clear(self):
+        self.evict(0)
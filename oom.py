@@ -0,0 +1,61 @@
+import os, gc, json, threading
+
+import torch
+
+# Memory saving levels for a loaded pipeline, cheapest first; each level includes the ones before it and none reloads weights
+RUNGS = ['none', 'vae_tiling', 'attention_slicing', 'model_offload', 'sequential_offload']
+
+def is_oom(error):
+    return isinstance(error, torch.cuda.OutOfMemoryError) or 'out of memory' in str(error).lower()
+
+def release_memory():
+    gc.collect()
+    if torch.cuda.is_available():
+        torch.cuda.empty_cache()
+
+def job_resolution(pipe_params):
+    if 'width' in pipe_params:
+        return pipe_params['width'], pipe_params['height']
+    image = pipe_params.get('image')
+    if isinstance(image, list):
+        image = image[0]
+    if isinstance(getattr(image, 'size', None), tuple): # PIL image
+        return image.size
+    if hasattr(image, 'shape'): # latents
+        return image.shape[-1] * 8, image.shape[-2] * 8
+    return None
+
+class MemoryRungs:
+    """Lowest rung that completed for each model and resolution, so later jobs skip the attempts that ran out of memory"""
+
+    def __init__(self, filepath=None):
+        self.filepath = filepath
+        self.lock = threading.Lock()
+        self.rungs = {}
+
+        if filepath and os.path.exists(filepath):
+            try:
+                with open(filepath) as f:
+                    self.rungs = json.load(f)
+            except (OSError, ValueError):
+                self.rungs = {}
+
+    def key(self, model, size):
+        return f'{model}@{size[0]}x{size[1]}'
+
+    def get(self, model, size):
+        if size is None:
+            return 0
+        with self.lock:
+            return RUNGS.index(self.rungs.get(self.key(model, size), 'none'))
+
+    def record(self, model, size, rung):
+        if size is None:
+            return
+        with self.lock:
+            if rung <= RUNGS.index(self.rungs.get(self.key(model, size), 'none')):
+                return
+            self.rungs[self.key(model, size)] = RUNGS[rung]
+            if self.filepath:
+                with open(self.filepath, 'w') as f:
+                    json.dump(self.rungs, f, indent=2)
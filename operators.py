@@ -1,11 +1,14 @@
-import bpy, os, tempfile, threading, random, math
+import bpy, os, tempfile, threading, random, math, shutil
+from functools import partial
 from bpy.types import Operator
 from . import PG_NAME_LC, blender_globals
 from . import property_groups as pg
+from . import tracing, telemetry
 from .functions import ud_classes as udcl
 from .functions import basic_functions as bf
 
-worker = None
+pool = None
+pool_lock = threading.Lock()
 
 # Create a temporary file path that works on both Windows and Unix-like systems
 temp_image_file = "temp.png"
@@ -13,6 +16,79 @@ temp_folder = tempfile.gettempdir()
 
 temp_image_filepath = os.path.join(temp_folder, temp_image_file)
 
+def finish_trace(manager, server_summary=''):
+    try:
+        print(f"UD: trace written to {manager.tracer.export(temp_folder)}")
+    except OSError as e:
+        print(f"UD: could not write trace: {e}")
+    summary = manager.tracer.summary()
+    if server_summary:
+        summary += '\nServer:\n' + server_summary
+    manager.set_trace_summary(summary)
+    try:
+        snapshots = snapshot_devices()
+        for job in snapshots:
+            job.wait()
+        manager.set_telemetry_summary(telemetry_report(snapshots))
+    except Exception as e:
+        print(f"UD: could not sample telemetry: {e}")
+
+def snapshot_devices():
+    # Each worker describes its own processor once its queued jobs have run, never while one changes it
+    if pool is None:
+        return []
+    return pool.broadcast(telemetry.sample_device)
+
+def telemetry_report(snapshots):
+    entry = telemetry.sample(job.result for job in snapshots if job.result is not None)
+    telemetry.log(entry)
+    return telemetry.summary(entry)
+
+def refresh_telemetry(pg):
+    # Summarized on the main thread once every worker has taken its snapshot
+    snapshots = snapshot_devices()
+    def refresh():
+        if not all(job.done.is_set() for job in snapshots):
+            return 0.2
+        pg.telemetry_summary = telemetry_report(snapshots)
+        for window in bpy.context.window_manager.windows:
+            for area in window.screen.areas:
+                if area.type == 'IMAGE_EDITOR':
+                    area.tag_redraw()
+        return None
+    bpy.app.timers.register(refresh, first_interval=0)
+
+def get_pool():
+    # One resident processor per device, created on first use from a worker thread to keep heavy imports off the UI
+    from . import ud_processor as ud
+    from . import device_pool
+    global pool
+    with pool_lock:
+        if pool is None:
+            pool = device_pool.DevicePool(ud.get_devices(), ud.UD_Processor)
+    return pool
+
+# Image slots whose depth and canny maps follow the animation in a sequence
+SEQUENCE_MAP_SLOTS = ['controlnet_image_slot', 't2i_image_slot']
+
+def shutdown_pool():
+    # Workers are daemon threads holding their pipelines, a disabled or reloaded add-on must not leave them resident
+    global pool
+    with pool_lock:
+        if pool is None:
+            return
+        # Queued behind any running job, each worker unloads and then exits
+        pool.broadcast(lambda processor: processor.unload(clear_modules=True))
+        pool.shutdown()
+        pool = None
+
+def image_name(params):
+    return params['prompt'][:57] + "-" + str(params['seed'])
+
+def run_job(params, manager, processor):
+    if manager.stop_process():
+        return None
+    return processor.run(params=params, manager=manager)
 
 
 class Run_UD(Operator):
@@ -22,58 +98,233 @@ class Run_UD(Operator):
     mode: bpy.props.StringProperty() # type: ignore
 
     def ud_task(self, params, image_area, manager):
-        from . import ud_processor as ud
-        global worker
-        worker = ud.UD_Processor()
-
         try:
-            result = worker.run(params=params, manager=manager)
-            if result:
-                image = bpy.data.images.load(params['temp_image_filepath'])
-                image.name = params['prompt'][:57] + "-" + str(params['seed'])
-                image_area.spaces.active.image = image
+            with manager.tracer.span('job', mode=params['mode']):
+                jobs = []
+                for index in range(params.get('batch_count', 1)):
+                    job_params = dict(params)
+                    if index:
+                        job_params['seed'] = params['seed'] + index
+                        job_params['temp_image_filepath'] = os.path.join(temp_folder, f"temp_{index}.png")
+                    job_params['image_name'] = image_name(job_params)
+                    jobs.append((job_params, get_pool().submit(partial(run_job, job_params, manager), model=params['model'])))
+
+                for job_params, job in jobs:
+                    try:
+                        result = job.wait()
+                    except Exception as e:
+                        print(f"Error occurred: {e}")
+                        continue
+
+                    if result:
+                        with manager.tracer.span('blender_reload'):
+                            image = bpy.data.images.load(job_params['temp_image_filepath'])
+                            image.name = job_params['image_name']
+                            image_area.spaces.active.image = image
 
         except Exception as e:
             print(f"Error occurred: {e}")
         finally:
+            finish_trace(manager)
             manager.set_running(0)
 
     def ud_upscale_task(self, params, image_area, manager):
-        from . import ud_processor as ud
-        global worker
-        worker = ud.UD_Processor()
-
         try:
             space = image_area.spaces.active
 
             if space.image:
                 params['width'] = space.image.size[0]
                 params['height'] = space.image.size[1]
+                params['image_name'] = space.image.name
             
-                original_view_transform = bpy.context.scene.view_settings.view_transform
-                bpy.context.scene.view_settings.view_transform = 'Raw'
-                bpy.data.images[space.image.name].save_render(params['temp_image_filepath'])
-                bpy.context.scene.view_settings.view_transform = original_view_transform
+                with manager.tracer.span('job', mode=params['mode']):
+                    # Latent upscaling starts from the kept latents, the pixels are not needed
+                    if params['mode'] != 'upscale_latent':
+                        with manager.tracer.span('blender_save'):
+                            original_view_transform = bpy.context.scene.view_settings.view_transform
+                            bpy.context.scene.view_settings.view_transform = 'Raw'
+                            bpy.data.images[space.image.name].save_render(params['temp_image_filepath'])
+                            bpy.context.scene.view_settings.view_transform = original_view_transform
+
+                    upscale = lambda processor: processor.upscale(params=params, manager=manager)
+                    result = get_pool().submit(upscale, model=params['model']).wait()
+
+                    if result is not None:
+                        with manager.tracer.span('blender_reload'):
+                            image = bpy.data.images.load(params['temp_image_filepath'])
+                            image.name = image_name(params)
+                            image_area.spaces.active.image = image
+                
+        except Exception as e:
+            print(f"Error occurred: {e}")
+        finally:
+            finish_trace(manager)
+            manager.set_running(0)
 
-                worker.upscale(params=params, manager=manager)
+    def prepare_sequence(self, context, pg, params, manager, on_ready):
+        # Maps are rendered on the main thread through Generate_Map, the worker only reads files. One frame is
+        # prepared per timer tick, so Blender stays responsive and Stop is honoured between frames.
+        # Frames whose output exists are skipped, so an interrupted sequence resumes where it stopped.
+        scene = context.scene
+        window, screen = context.window, context.screen
+        folder = bpy.path.abspath(pg.sequence_output)
+        os.makedirs(os.path.join(folder, 'maps'), exist_ok=True)
+
+        pending = list(range(scene.frame_start, scene.frame_end + 1, scene.frame_step))
+        total = len(pending)
+        frames = []
+        original_frame = scene.frame_current
+        state = {'previous_output': None}
+
+        def prepare_frame(frame):
+            # Generated maps of the ControlNet or T2I-Adapter slots are rendered again for every frame, other images stay
+            scene.frame_set(frame)
+            maps = {}
+            for key in SEQUENCE_MAP_SLOTS:
+                if key not in params:
+                    continue
+                maps[key] = []
+                for slot in params[key]:
+                    if slot.name in ['depth', 'canny']:
+                        map_path = os.path.join(folder, 'maps', f'{slot.name}_{frame:04d}.png')
+                        if not os.path.exists(map_path):
+                            with manager.tracer.span('sequence_map', frame=frame, map=slot.name):
+                                with bpy.context.temp_override(window=window, screen=screen):
+                                    getattr(bpy.ops, PG_NAME_LC).generate_map(mode=slot.name, target='3d', scene_camera=True)
+                            shutil.copy(temp_image_filepath, map_path)
+                        maps[key].append(map_path)
+                    else:
+                        maps[key].append(slot)
+            return maps
+
+        def step():
+            try:
+                if manager.stop_process():
+                    print("UD: sequence stopped while rendering maps")
+                    scene.frame_set(original_frame)
+                    manager.set_running(0)
+                    return None
+
+                # Frames already generated cost nothing, they are skipped within the same tick
+                while pending:
+                    frame = pending.pop(0)
+                    output = os.path.join(folder, f'frame_{frame:04d}.png')
+                    if os.path.exists(output):
+                        state['previous_output'] = output
+                        continue
+
+                    render = scene.render.frame_path(frame=frame)
+                    frames.append({
+                        'frame': frame,
+                        'output': output,
+                        'previous_output': state['previous_output'],
+                        'render': render if os.path.exists(render) else None,
+                        'maps': prepare_frame(frame),
+                    })
+                    state['previous_output'] = output
+                    manager.set_progress(int((total - len(pending)) / total * 100))
+                    manager.set_progress_text(f'Preparing frame {frame} ({total - len(pending)} / {total})')
+                    break
+
+                if pending:
+                    return 0.01
+
+                scene.frame_set(original_frame)
+                manager.set_progress(0)
+                manager.set_progress_text('')
+                on_ready(frames)
+            except Exception as e:
+                print(f"Error occurred: {e}")
+                scene.frame_set(original_frame)
+                manager.set_running(0)
+            return None
+
+        bpy.app.timers.register(step, first_interval=0)
+
+    def ud_sequence_task(self, params, frames, image_area, manager):
+        from PIL import Image
+
+        try:
+            with manager.tracer.span('job', mode=params['mode'], frames=len(frames)):
+                previous = None
+                for frame in frames:
+                    if manager.stop_process():
+                        break
+
+                    # Same seed on every frame, so the initial noise is shared across the sequence
+                    job_params = dict(params, temp_image_filepath=frame['output'], image_name=f"frame_{frame['frame']:04d}")
+                    for key, slots in frame['maps'].items():
+                        job_params[key] = [Image.open(slot) if isinstance(slot, str) else slot for slot in slots]
+
+                    if previous is None and frame['previous_output'] and os.path.exists(frame['previous_output']):
+                        previous = Image.open(frame['previous_output'])
+
+                    # Rendered frames are stylized with img2img, optionally mixed with the previous result for temporal stability
+                    if frame['render']:
+                        init_image = Image.open(frame['render']).convert('RGBA')
+                        if previous is not None and params['sequence_feedback'] > 0:
+                            init_image = Image.blend(init_image, previous.convert('RGBA').resize(init_image.size), params['sequence_feedback'])
+                        job_params['init_image_slot'] = init_image
+
+                    previous = get_pool().submit(partial(run_job, job_params, manager), model=params['model']).wait()
+
+                if previous is not None:
+                    with manager.tracer.span('blender_reload'):
+                        image = bpy.data.images.load(frame['output'])
+                        image_area.spaces.active.image = image
+
+        except Exception as e:
+            print(f"Error occurred: {e}")
+        finally:
+            finish_trace(manager)
+            manager.set_running(0)
+
+    def ud_remote_task(self, params, image_area, manager, port):
+        from . import inference_server as srv
+        client = srv.InferenceClient(port)
+
+        try:
+            with manager.tracer.span('job', mode=params['mode']):
+                space = image_area.spaces.active
+                if params['mode'] in ['upscale_sd', 'upscale_re', 'upscale_latent']:
+                    if not space.image:
+                        return
+                    params['width'], params['height'] = space.image.size
+                    params['image_name'] = space.image.name
+                    if params['mode'] != 'upscale_latent':
+                        params['source_image'] = space.image
+                    batch = [params]
+                else:
+                    batch = [dict(params, seed=params['seed'] + index) for index in range(params.get('batch_count', 1))]
+                    for job_params in batch:
+                        job_params['image_name'] = image_name(job_params)
+
+                for job_params in batch:
+                    if manager.stop_process():
+                        break
+
+                    array = client.run(job_params, manager)
+                    if array is not None:
+                        with manager.tracer.span('blender_reload'):
+                            image = srv.array_to_blender_image(array, job_params['image_name'])
+                            image_area.spaces.active.image = image
 
-                image = bpy.data.images.load(params['temp_image_filepath'])
-                image.name = params['prompt'][:57] + "-" + str(params['seed'])
-                image_area.spaces.active.image = image
-                
         except Exception as e:
             print(f"Error occurred: {e}")
         finally:
+            finish_trace(manager, client.server_summary)
             manager.set_running(0)
 
     def execute(self, context):
         areas = bpy.context.screen.areas
+        preferences = context.preferences.addons[__package__].preferences
         ws = context.workspace
         pg = getattr(ws, PG_NAME_LC)
 
         pg.running = 1
         pg.progress = 0
         pg.progress_text = ""
+        pg.trace_summary = ""
 
         # Prepare params
         params = {prop.identifier: getattr(pg, prop.identifier) 
@@ -81,7 +332,7 @@ class Run_UD(Operator):
                    if not prop.is_readonly}
 
         # Prepare manager
-        manager = udcl.ProcessManager(ws, pg)
+        manager = udcl.ProcessManager(ws, pg, tracer=tracing.Tracer(self.mode))
 
         # Programmatic params
         params['temp_image_filepath'] = temp_image_filepath
@@ -98,18 +349,33 @@ class Run_UD(Operator):
                         params[entry]=[]
                     params[entry].append(getattr(item, entry))
 
+        for item in pg.lora_list:
+            if item.lora_path and item.lora_weight != 0:
+                params.setdefault('lora_path', []).append(bpy.path.abspath(item.lora_path))
+                params.setdefault('lora_weight', []).append(item.lora_weight)
+
         params['mode'] = self.mode
+        params['result_cache_size'] = preferences.result_cache_size
         print(params)
         
         for area in areas:
             if area.type == 'IMAGE_EDITOR':
                 image_area = area
 
-        if self.mode in ['generate']: 
+        if self.mode == 'sequence':
+            # The worker thread starts once the maps of every frame are rendered
+            start = lambda frames: threading.Thread(target=self.ud_sequence_task, args=[params, frames, image_area, manager]).start()
+            manager.start()
+            self.prepare_sequence(context, pg, params, manager, start)
+            return {'FINISHED'}
+        elif preferences.use_inference_server:
+            thread = threading.Thread(target=self.ud_remote_task, args=[params, image_area, manager, preferences.server_port])
+        elif self.mode in ['generate']: 
             thread = threading.Thread(target=self.ud_task, args=[params, image_area, manager])
-        elif self.mode in ['upscale_sd','upscale_re']:
+        elif self.mode in ['upscale_sd','upscale_re','upscale_latent']:
             thread = threading.Thread(target=self.ud_upscale_task, args=[params, image_area, manager])
         
+        manager.start()
         thread.start()
 
         return {'FINISHED'}
@@ -119,11 +385,103 @@ class Unload_UD(Operator):
     bl_label = "Release memory"
 
     def execute(self, context):
-        global worker
-        if worker:
-            worker.unload()
+        if pool:
+            pool.broadcast(lambda processor: processor.unload(clear_modules=True))
+            refresh_telemetry(getattr(context.workspace, PG_NAME_LC))
+
+        preferences = context.preferences.addons[__package__].preferences
+        if preferences.use_inference_server:
+            threading.Thread(target=self.unload_server, args=[preferences.server_port], daemon=True).start()
         return {'FINISHED'}
+
+    def unload_server(self, port):
+        from . import inference_server as srv
+        try:
+            srv.InferenceClient(port).command('unload')
+        except ConnectionRefusedError:
+            pass
     
+class Evict_UD(Operator):
+    bl_idname = f"{PG_NAME_LC}.evict_ud"
+    bl_label = "Evict least recently used"
+    bl_description = "Release the model unused the longest: a parked controlnet or adapter, otherwise the pipeline idle the longest"
+
+    def execute(self, context):
+        if pool is None:
+            self.report({'INFO'}, "No resident models")
+            return {'CANCELLED'}
+
+        pg = getattr(context.workspace, PG_NAME_LC)
+        snapshots = snapshot_devices()
+        workers = list(pool.workers)
+
+        def evict():
+            if not all(job.done.is_set() for job in snapshots):
+                return 0.2
+            resident = [(worker, job.result) for worker, job in zip(workers, snapshots) if job.result is not None]
+            candidate = telemetry.least_recently_used(telemetry.sample(device for _, device in resident))
+            if candidate is None:
+                print("UD: no resident models to evict")
+                return None
+
+            _, index, key = candidate
+            target = resident[index][0].processor
+            print(f"UD: evicting {key or target.loaded_model} from {target.device}")
+            pool.broadcast(lambda processor: processor.evict(key) if processor is target else None)
+            refresh_telemetry(pg)
+            return None
+        bpy.app.timers.register(evict, first_interval=0)
+        return {'FINISHED'}
+
+class Refresh_Telemetry(Operator):
+    bl_idname = f"{PG_NAME_LC}.refresh_telemetry"
+    bl_label = "Refresh"
+    bl_description = "Sample memory use, resident models and throughput"
+
+    def execute(self, context):
+        refresh_telemetry(getattr(context.workspace, PG_NAME_LC))
+        return {'FINISHED'}
+
+class Fetch_Models(Operator):
+    bl_idname = f"{PG_NAME_LC}.fetch_models"
+    bl_label = "Download models"
+    bl_description = "Download and verify the weights of the selected model and control models, so the first run does not wait for them"
+
+    def fetch_task(self, model_ids, manager):
+        from . import model_fetch
+        from .ud_processor import UD_Processor
+        try:
+            with manager.tracer.span('job', mode='fetch'):
+                if bf.get_model_type(model_ids[0]) == 'SDXL':
+                    model_ids = model_ids + [UD_Processor.vae_model]
+                failed = model_fetch.fetcher.fetch(model_ids, progress=model_fetch.progress_reporter(manager), cancel=manager.stop_process)
+            if failed:
+                print(f"UD: could not download {', '.join(failed)}, they will be loaded from the hub on first use")
+        except model_fetch.FetchCancelled:
+            print("UD: download cancelled, it resumes where it stopped")
+        except Exception as e:
+            print(f"Error occurred: {e}")
+        finally:
+            finish_trace(manager)
+            manager.set_running(0)
+
+    def execute(self, context):
+        ws = context.workspace
+        pg = getattr(ws, PG_NAME_LC)
+
+        cm = pg.control_mode
+        model_ids = [pg.model] + [getattr(item, f'{cm}_model') for item in getattr(pg, f'{cm}_list')]
+
+        pg.running = 1
+        pg.progress = 0
+        pg.progress_text = "Resolving files..."
+        pg.trace_summary = ""
+
+        manager = udcl.ProcessManager(ws, pg, tracer=tracing.Tracer('fetch'))
+        manager.start()
+        threading.Thread(target=self.fetch_task, args=[model_ids, manager]).start()
+        return {'FINISHED'}
+
 class Stop_UD(Operator):
     bl_idname = f"{PG_NAME_LC}.stop_ud"
     bl_label = "Stop generation"
@@ -170,6 +528,28 @@ class Control_RemoveItem(Operator):
         control_list.remove(self.item_index)
         return {'FINISHED'}
     
+class Lora_AddItem(Operator):
+    bl_idname = f"{PG_NAME_LC}.lora_add_item"
+    bl_label = "Add LoRA"
+
+    def execute(self, context):
+        ws = context.workspace
+        pg = getattr(ws, PG_NAME_LC)
+        pg.lora_list.add()
+        return {'FINISHED'}
+
+class Lora_RemoveItem(Operator):
+    bl_idname = f"{PG_NAME_LC}.lora_remove_item"
+    bl_label = "Remove LoRA"
+
+    item_index: bpy.props.IntProperty() # type: ignore
+
+    def execute(self, context):
+        ws = context.workspace
+        pg = getattr(ws, PG_NAME_LC)
+        pg.lora_list.remove(self.item_index)
+        return {'FINISHED'}
+    
 class Project_UVs(bpy.types.Operator):
     bl_idname = f"{PG_NAME_LC}.generate_projected_uvs"
     bl_label = "Project UVs from View"
@@ -207,6 +587,7 @@ class Generate_Map(Operator):
 
     mode: bpy.props.StringProperty() # type: ignore
     target: bpy.props.StringProperty() # type: ignore
+    scene_camera: bpy.props.BoolProperty(default=False) # type: ignore
 
     def execute(self, context):
         ws = context.workspace
@@ -241,29 +622,32 @@ class Generate_Map(Operator):
             for (obj_path, attr) in settings_to_save:
                 saved_settings[obj_path+'.'+attr] = getattr(eval(f"bpy.{obj_path}"), attr)
 
-            # Create a new camera
-            bpy.ops.object.camera_add()
-            temp_camera = bpy.context.object
-
-            # Align the new camera to the current view
-            for area in bpy.context.screen.areas:
-                if area.type == 'VIEW_3D':
-                    rv3d = area.spaces[0].region_3d
-
-                    vmat_inv = rv3d.view_matrix.inverted()
-                    pmat = rv3d.perspective_matrix @ vmat_inv
-                    fov = 2.0*math.atan(1.0/pmat[1][1])
-
-                    temp_camera.location = rv3d.view_matrix.inverted().translation
-                    temp_camera.rotation_euler = rv3d.view_rotation.to_euler()
-                    temp_camera.data.angle = fov
-                    context.scene.render.resolution_x = pg.width
-                    context.scene.render.resolution_y = pg.height
-                    context.scene.render.resolution_percentage = pg.scale
-                    break
+            context.scene.render.resolution_x = pg.width
+            context.scene.render.resolution_y = pg.height
+            context.scene.render.resolution_percentage = pg.scale
+
+            # Create a new camera aligned to the current view, unless rendering through the (animated) scene camera
+            temp_camera = None
+            if not (self.scene_camera and context.scene.camera):
+                bpy.ops.object.camera_add()
+                temp_camera = bpy.context.object
+
+                for area in bpy.context.screen.areas:
+                    if area.type == 'VIEW_3D':
+                        rv3d = area.spaces[0].region_3d
+
+                        vmat_inv = rv3d.view_matrix.inverted()
+                        pmat = rv3d.perspective_matrix @ vmat_inv
+                        fov = 2.0*math.atan(1.0/pmat[1][1])
+
+                        temp_camera.location = rv3d.view_matrix.inverted().translation
+                        temp_camera.rotation_euler = rv3d.view_rotation.to_euler()
+                        temp_camera.data.angle = fov
+                        break
 
             # Set the new settings
-            context.scene.camera = temp_camera
+            if temp_camera:
+                context.scene.camera = temp_camera
             context.scene.render.engine = 'BLENDER_EEVEE'
             context.view_layer.use_pass_z = True
             context.view_layer.use_pass_normal = True
@@ -377,7 +761,8 @@ class Generate_Map(Operator):
 
         # # Clean up
         if self.target == '3d':
-            bpy.data.objects.remove(temp_camera)
+            if temp_camera:
+                bpy.data.objects.remove(temp_camera)
             for key, node in node_setup.items():
                 tree.nodes.remove(node)
 
@@ -21,6 +21,19 @@ class MY_UL_ControlList(bpy.types.UIList):
         col.scale_x = 0.6
         col.prop(item, f"{mode}_factor")
 
+class MY_UL_LoraList(bpy.types.UIList):
+    def draw_item(self, context, layout, data, item, icon, active_data, active_propname, index):
+        row = layout.row()
+
+        delete_op = row.operator(f"{PG_NAME_LC}.lora_remove_item", text="", icon='X')
+        delete_op.item_index = index
+
+        row.prop(item, "lora_path")
+
+        col = row.column()
+        col.scale_x = 0.6
+        col.prop(item, "lora_weight")
+
 class UDPanel(bpy.types.Panel):
     """Creates a Panel in the Image Editor"""
     bl_idname = f"SCENE_PT_{PG_NAME_LC}"
@@ -47,22 +60,34 @@ class UDPanel(bpy.types.Panel):
         row = layout.row()
         for item_list in [
             ['model'],
+            ['quantization'],
             ['prompt'],
             ['negative_prompt'],
             ['scale','width','height'],
-            ['seed'],
+            ['use_buckets'],
+            ['hires_fix', 'hires_denoise'],
+            ['seed', 'batch_count'],
             ['inference_steps','cfg_scale'],
+            ['cfg_cutoff', 'adaptive_cfg'],
+            ['step_cache_interval', 'keep_latents'],
+            ['checkpoint_interval'],
             ['init_image_slot'],
             ['denoise_strength'],
-            ['init_mask_slot']]:
+            ['init_mask_slot'],
+            ['inpaint_crop', 'inpaint_padding']]:
             
             has_item = False
             for item in item_list:
                 if (
-                    item in ['denoise_strength', 'init_mask_slot'] and not pg.init_image_slot  # Check for 'denoise_strength' or 'init_mask_slot' without an init image
-                    or item in ['init_image_slot', 'denoise_strength', 'init_mask_slot'] and pg.control_mode == 't2i'
-                    or item in ['init_mask_slot'] and model_type not in 'SDXL'
+                    item in ['denoise_strength', 'init_mask_slot', 'inpaint_crop', 'inpaint_padding'] and not pg.init_image_slot  # Check for 'denoise_strength' or 'init_mask_slot' without an init image
+                    or item in ['init_image_slot', 'denoise_strength', 'init_mask_slot', 'inpaint_crop', 'inpaint_padding'] and pg.control_mode == 't2i'
+                    or item in ['init_mask_slot', 'inpaint_crop', 'inpaint_padding'] and model_type not in 'SDXL'
+                    or item in ['inpaint_padding'] and not pg.inpaint_crop
                     or item in ['cfg_scale'] and model_type in 'FLUX'
+                    or item in ['cfg_cutoff', 'adaptive_cfg', 'keep_latents', 'checkpoint_interval'] and model_type not in ['SDXL']
+                    or item in ['hires_fix', 'hires_denoise'] and (pg.init_image_slot or model_type not in ['SDXL', 'FLUX'])
+                    or item in ['hires_denoise'] and not pg.hires_fix
+                    or item in ['quantization'] and model_type not in ['FLUX', 'SD3']
                 ):
                     continue
 
@@ -96,17 +121,41 @@ class UDPanel(bpy.types.Panel):
             row.operator(f"{PG_NAME_LC}.control_mode", text=f'Switch to {switch_to_xlat}', icon='ARROW_LEFTRIGHT').switch_mode=switch_to
             row = layout.row()
 
+        if len(pg.lora_list) > 0:
+            row = layout.row()
+            row.template_list("MY_UL_LoraList", "LoRAs",
+                pg, "lora_list",
+                pg, "lora_list_index"
+                )
+
+        row = layout.row()
+        row.operator(f"{PG_NAME_LC}.lora_add_item", icon='ADD', text='Add LoRA')
+        if len(pg.lora_list) > 0:
+            row.prop(pg, "fuse_loras")
+        row = layout.row()
+
         row = row.separator(factor = 2)
         
         if pg.running == 0:
             row = layout.row()
             row.operator(f"{PG_NAME_LC}.run_ud", text="Run Unexpected Diffusion", icon='IMAGE').mode='generate'
             row.operator(f"{PG_NAME_LC}.unload_ud", text="Release Memory", icon='UNLINKED')
+            row.operator(f"{PG_NAME_LC}.evict_ud", text="", icon='REMOVE')
+            row.operator(f"{PG_NAME_LC}.fetch_models", text="", icon='IMPORT')
 
             if model_type in 'SDXL':
                 row = layout.row()
                 row.operator(f"{PG_NAME_LC}.run_ud", text="Run Light 2x Upscaler", icon='ZOOM_IN').mode='upscale_re'
                 row.operator(f"{PG_NAME_LC}.run_ud", text="Run Heavy 2x Upscaler", icon='ZOOM_IN').mode='upscale_sd'
+                if pg.keep_latents:
+                    row = layout.row()
+                    row.operator(f"{PG_NAME_LC}.run_ud", text="Run Latent 2x Upscaler", icon='ZOOM_IN').mode='upscale_latent'
+
+            box = layout.box()
+            box.prop(pg, "sequence_output")
+            row = box.row()
+            row.prop(pg, "sequence_feedback")
+            row.operator(f"{PG_NAME_LC}.run_ud", text="Run Sequence", icon='SEQUENCE').mode='sequence'
 
         if pg.running == 1:
             row = layout.row()
@@ -115,6 +164,22 @@ class UDPanel(bpy.types.Panel):
             row = layout.row()
             row.operator(f"{PG_NAME_LC}.stop_ud", text="Stop Generation", icon='QUIT')
 
+        if pg.running == 0 and pg.trace_summary:
+            row = layout.row()
+            row.prop(pg, "show_trace_summary", icon='TRIA_DOWN' if pg.show_trace_summary else 'TRIA_RIGHT', emboss=False)
+            if pg.show_trace_summary:
+                col = layout.box().column(align=True)
+                for line in pg.trace_summary.split('\n'):
+                    col.label(text=line)
+
+        row = layout.row()
+        row.prop(pg, "show_telemetry", icon='TRIA_DOWN' if pg.show_telemetry else 'TRIA_RIGHT', emboss=False)
+        row.operator(f"{PG_NAME_LC}.refresh_telemetry", text="", icon='FILE_REFRESH')
+        if pg.show_telemetry and pg.telemetry_summary:
+            col = layout.box().column(align=True)
+            for line in pg.telemetry_summary.split('\n'):
+                col.label(text=line)
+
         row = layout.row()
         row = row.separator(factor = 2)
         row = layout.row()
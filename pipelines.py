@@ -1,7 +1,9 @@
+import importlib
+
 pipeline_settings = {
-    "StableDiffusionXLPipeline": ['negative_prompt'],
+    "StableDiffusionXLPipeline": ['negative_prompt', "callback_on_step_end_tensor_inputs"],
 
-    "StableDiffusionXLImg2ImgPipeline": ['negative_prompt', "image", "strength"],
+    "StableDiffusionXLImg2ImgPipeline": ['negative_prompt', "image", "strength", "callback_on_step_end_tensor_inputs"],
     "StableDiffusionXLInpaintPipeline": ['negative_prompt', "image", "mask_image", "strength"],
 
     "StableDiffusionXLControlNetInpaintPipeline": ['negative_prompt', "image", "mask_image", "strength", "controlnet_model", "controlnet_conditioning_scale", "control_image"],
@@ -17,4 +19,62 @@ pipeline_settings = {
 }
 
 for key in pipeline_settings:
-    pipeline_settings[key] = ["prompt"] + ["width"] + ["height"] + ["generator"] + ["num_inference_steps"] + ["guidance_scale"] + pipeline_settings[key]
\ No newline at end of file
+    pipeline_settings[key] = ["prompt"] + ["width"] + ["height"] + ["generator"] + ["num_inference_steps"] + ["guidance_scale"] + pipeline_settings[key]
+
+# Pipelines whose latents can be returned undecoded and passed back as an img2img image
+latent_pipelines = [key for key in pipeline_settings if key.startswith('StableDiffusionXL')]
+
+# Second pass of the two-pass hires mode, built from the first pass pipeline's components
+hires_pipelines = {
+    "StableDiffusionXLPipeline": "StableDiffusionXLImg2ImgPipeline",
+    "FluxPipeline": "FluxImg2ImgPipeline",
+}
+
+# Pipelines that can continue from checkpointed latents: SDXL img2img takes them as its image and starts mid-schedule with denoising_start
+resumable_pipelines = ["StableDiffusionXLPipeline", "StableDiffusionXLImg2ImgPipeline"]
+resume_pipeline = "StableDiffusionXLImg2ImgPipeline"
+
+# Pipeline classes are resolved on first use, each one pulls in its own diffusers and transformers modules
+pipeline_classes = {}
+
+def pipeline_class(pipeline_type):
+    if pipeline_type not in pipeline_classes:
+        pipeline_classes[pipeline_type] = getattr(importlib.import_module('diffusers'), pipeline_type)
+    return pipeline_classes[pipeline_type]
+
+# Conditioning tensors that carry both CFG branches, halved in the step callback to drop the unconditional one.
+# Other pipelines keep guidance-dependent tensors (masks, pooled projections) that the callback cannot reach.
+cfg_truncation_inputs = {
+    "StableDiffusionXLPipeline": ['prompt_embeds', 'add_text_embeds', 'add_time_ids'],
+    "StableDiffusionXLImg2ImgPipeline": ['prompt_embeds', 'add_text_embeds', 'add_time_ids'],
+}
+
+# How each img2img-style pipeline truncates its schedule for a given strength (mirrors their get_timesteps)
+def truncate_floor(num_inference_steps, strength):
+    return min(int(num_inference_steps * strength), num_inference_steps)
+
+def truncate_ceil(num_inference_steps, strength):
+    return num_inference_steps - int(max(num_inference_steps - num_inference_steps * strength, 0))
+
+strength_truncation = {
+    "StableDiffusionXLImg2ImgPipeline": truncate_floor,
+    "StableDiffusionXLInpaintPipeline": truncate_floor,
+    "StableDiffusionXLControlNetInpaintPipeline": truncate_floor,
+    "StableDiffusionXLControlNetImg2ImgPipeline": truncate_floor,
+    "FluxImg2ImgPipeline": truncate_ceil,
+}
+
+def executed_steps(pipeline_type, num_inference_steps, strength=None):
+    if pipeline_type not in strength_truncation or strength is None:
+        return num_inference_steps
+    return strength_truncation[pipeline_type](num_inference_steps, strength)
+
+def plan_steps(pipeline_type, steps, strength=None):
+    # Schedule of about steps / strength that executes exactly `steps` denoising steps; truncation grows by at most one step per scheduled step
+    if pipeline_type not in strength_truncation or not strength:
+        return steps
+
+    num_inference_steps = max(int(steps / strength) - 2, steps) # margin for float rounding
+    while executed_steps(pipeline_type, num_inference_steps, strength) < steps:
+        num_inference_steps += 1
+    return num_inference_steps
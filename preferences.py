@@ -1,7 +1,8 @@
 import bpy, os
 import subprocess
 from .functions import modules as mod
-from . import PG_NAME_LC, DEPENDENCIES, DEPENDENCIES_FOLDER
+import importlib.util
+from . import PG_NAME_LC, DEPENDENCIES, OPTIONAL_DEPENDENCIES, DEPENDENCIES_FOLDER
 from . import register, unregister, dependencies_installed, blender_globals  # Import the unregister and register functions
 
 class EXAMPLE_OT_install_dependencies(bpy.types.Operator):
@@ -26,12 +27,60 @@ class EXAMPLE_OT_install_dependencies(bpy.types.Operator):
         register()
         return {"FINISHED"}
 
+class EXAMPLE_OT_install_optional_dependencies(bpy.types.Operator):
+    bl_idname = f"{PG_NAME_LC}.install_optional_dependencies"
+    bl_label = "Install optional packages"
+    bl_description = ("Downloads and installs DeepCache, bitsandbytes and torchao, needed only for step caching and quantized model loading")
+    bl_options = {"REGISTER", "INTERNAL"}
+
+    def execute(self, context):
+        try:
+            mod.install_pip()
+            for dependency in OPTIONAL_DEPENDENCIES:
+                mod.install_and_import_module(module_name=dependency.module,
+                                          package_name=dependency.package,
+                                          global_name=dependency.name,
+                                          path=DEPENDENCIES_FOLDER)
+        except (subprocess.CalledProcessError, ImportError) as err:
+            self.report({"ERROR"}, str(err))
+            return {"CANCELLED"}
+        return {"FINISHED"}
+
 class UnexpectedDiffusionPreferences(bpy.types.AddonPreferences):
     bl_idname = __package__
 
+    use_inference_server: bpy.props.BoolProperty(
+        name="Use inference server",
+        description="Run diffusion in a separate background process that keeps models loaded across Blender sessions",
+        default=False,
+    ) # type: ignore
+    server_port: bpy.props.IntProperty(
+        name="Port",
+        min=1024,
+        max=65535,
+        default=7861,
+    ) # type: ignore
+
+    result_cache_size: bpy.props.FloatProperty(
+        name="Result cache (GB)",
+        description="Disk space for generated images reused when a job is repeated with identical inputs, least recently used results are removed first (0 disables)",
+        min=0,
+        soft_max=50,
+        default=2,
+    ) # type: ignore
+
     def draw(self, context):
         layout = self.layout
         if dependencies_installed:
             layout.label(icon='CHECKMARK', text="Dependencies installed")
         else:
             layout.operator(f"{PG_NAME_LC}.install_dependencies", icon="CONSOLE")
+
+        if any(importlib.util.find_spec(dependency.module) is None for dependency in OPTIONAL_DEPENDENCIES):
+            layout.operator(f"{PG_NAME_LC}.install_optional_dependencies", icon="CONSOLE")
+
+        row = layout.row()
+        row.prop(self, "use_inference_server")
+        row.prop(self, "server_port")
+
+        layout.prop(self, "result_cache_size")
@@ -1,9 +1,23 @@
 import bpy
-from .constants import DIFFUSION_MODELS, CONTROLNET_MODELS, T2I_MODELS
+from .constants import DIFFUSION_MODELS, CONTROLNET_MODELS, T2I_MODELS, QUANTIZATION_MODES
+from .functions import basic_functions as bf
 
 def parse_sd_models(models):
     return [(model.id, model.label, '') for model in models]
 
+def apply_sampling_profile(self, context):
+    model = bf.get_model(self.model)
+    if model and model.profile:
+        self.inference_steps = model.profile.steps
+        self.cfg_scale = model.profile.cfg
+        self.profile_applied = True
+    elif self.profile_applied:
+        # Back from a profiled model, its few-step settings would ruin this one; values the user set are kept otherwise
+        self.profile_applied = False
+        properties = self.bl_rna.properties
+        self.inference_steps = properties['inference_steps'].default
+        self.cfg_scale = properties['cfg_scale'].default
+
 class ControlNetListItem(bpy.types.PropertyGroup):
     def from_controlnet_models(self, context):
         return [(id, model_info['name'], '') for id, model_info in CONTROLNET_MODELS.items()]
@@ -20,8 +34,19 @@ class T2iListItem(bpy.types.PropertyGroup):
     t2i_image_slot: bpy.props.PointerProperty(name='', type=bpy.types.Image) # type: ignore
     t2i_factor: bpy.props.FloatProperty(name='', min=0.0, max=5.0, step=0.05, default=0.5) # type: ignore
 
+class LoraListItem(bpy.types.PropertyGroup):
+    lora_path: bpy.props.StringProperty(name='', subtype='FILE_PATH') # type: ignore
+    lora_weight: bpy.props.FloatProperty(name='', min=-2.0, max=2.0, step=0.05, default=0.8) # type: ignore
+
 class UDPropertyGroup(bpy.types.PropertyGroup):
-    model: bpy.props.EnumProperty(items=parse_sd_models(DIFFUSION_MODELS), name="Model") # type: ignore
+    model: bpy.props.EnumProperty(items=parse_sd_models(DIFFUSION_MODELS), name="Model", update=apply_sampling_profile) # type: ignore
+    profile_applied: bpy.props.BoolProperty(default=False, options={'HIDDEN'}) # type: ignore
+    quantization: bpy.props.EnumProperty(
+        name="Quantization",
+        description="Weight quantization of the transformer and T5 encoder. Quantized weights are cached on disk after the first conversion",
+        items=[('DEFAULT', 'Model default', ''), ('NONE', 'None (CPU offload)', '')] + [(mode, mode, '') for mode in QUANTIZATION_MODES],
+        default='DEFAULT',
+    ) # type: ignore
     prompt: bpy.props.StringProperty(name="Prompt", default="A close up of a cat with sunglasses driving a ferrari, golden hour") # type: ignore
     negative_prompt: bpy.props.StringProperty(name="Negative Prompt") # type: ignore
     scale: bpy.props.IntProperty(
@@ -42,18 +67,38 @@ class UDPropertyGroup(bpy.types.PropertyGroup):
         default=1080,
         min=0,
     ) # type: ignore
+    use_buckets: bpy.props.BoolProperty(
+        name='Resolution Buckets',
+        description="Generate at the nearest resolution bucket and resize the result back to the requested size",
+        default=False,
+    ) # type: ignore
     seed: bpy.props.IntProperty(
         name='Seed',
         soft_max=99999,
         default=0,
         soft_min=0,
     ) # type: ignore
+    batch_count: bpy.props.IntProperty(
+        name='Batch',
+        description="Number of images to generate with consecutive seeds, spread over the available GPUs",
+        soft_max=16,
+        default=1,
+        min=1,
+    ) # type: ignore
     inference_steps: bpy.props.IntProperty(
         name='Inference steps',
         soft_max=100,
         default=50,
         min=1,
     ) # type: ignore
+    step_cache_interval: bpy.props.IntProperty(
+        name='Step Cache Interval',
+        description="Recompute deep blocks only every N steps and reuse them in between (1 disables caching)",
+        soft_max=5,
+        max=10,
+        default=1,
+        min=1,
+    ) # type: ignore
     cfg_scale: bpy.props.FloatProperty(
         name='CFG scale',
         soft_max=100,
@@ -61,11 +106,76 @@ class UDPropertyGroup(bpy.types.PropertyGroup):
         min=0,
         precision=1,
     ) # type: ignore
+    sequence_output: bpy.props.StringProperty(
+        name="Sequence Output",
+        description="Folder for the generated frames and their maps, existing frames are skipped when the sequence is run again",
+        subtype='DIR_PATH',
+        default="//ud_sequence/",
+    ) # type: ignore
+    sequence_feedback: bpy.props.FloatProperty(
+        name="Frame Feedback",
+        description="How much of the previous generated frame is mixed into the next rendered frame before img2img",
+        default=0,
+        min=0,
+        max=1,
+    ) # type: ignore
+    hires_fix: bpy.props.BoolProperty(
+        name="Hires Fix",
+        description="Above the model's native resolution, generate at the native size first and refine the upscaled result with a short img2img pass",
+        default=False,
+    ) # type: ignore
+    hires_denoise: bpy.props.FloatProperty(
+        name="Hires Denoise",
+        description="Denoising strength of the refinement pass",
+        default=0.45,
+        min=0.05,
+        max=1,
+    ) # type: ignore
+    checkpoint_interval: bpy.props.IntProperty(
+        name="Checkpoint Every",
+        description="Save the denoising state every N steps so an interrupted generation continues where it stopped when run again (0 disables)",
+        default=0,
+        min=0,
+        soft_max=20,
+    ) # type: ignore
+    keep_latents: bpy.props.BoolProperty(
+        name="Keep Latents",
+        description="Keep the undecoded result of each generation so the latent upscaler can refine it without re-encoding the image",
+        default=False,
+    ) # type: ignore
+    cfg_cutoff: bpy.props.FloatProperty(
+        name='CFG Cutoff',
+        description="Fraction of the steps that run classifier-free guidance, later steps only run the conditional branch (1 keeps guidance on every step)",
+        default=1,
+        min=0.1,
+        max=1,
+        precision=2,
+    ) # type: ignore
+    adaptive_cfg: bpy.props.FloatProperty(
+        name='Adaptive CFG',
+        description="Drop guidance once the conditional and unconditional predictions reach this cosine similarity (0 disables)",
+        default=0,
+        min=0,
+        max=1,
+        precision=3,
+    ) # type: ignore
     init_image_slot: bpy.props.PointerProperty(
         name="Init Image",
         description="Enter the slot for an init image to condition the generation",
         type=bpy.types.Image
     ) # type: ignore
+    inpaint_crop: bpy.props.BoolProperty(
+        name="Crop to Mask",
+        description="Inpaint only the masked region plus padding at the model's working resolution and blend it back into the image",
+        default=False,
+    ) # type: ignore
+    inpaint_padding: bpy.props.IntProperty(
+        name="Padding",
+        description="Context in pixels kept around the masked region, the outer quarter is used to feather the seam",
+        default=64,
+        min=8,
+        soft_max=256,
+    ) # type: ignore
     init_mask_slot: bpy.props.PointerProperty(
         name="Mask Image",
         description="Enter the slot for a masking image for the inpainting generation",
@@ -90,10 +200,25 @@ class UDPropertyGroup(bpy.types.PropertyGroup):
         update=lambda self, context: setattr(self, 'control_list_index', -1)
     ) # type: ignore
 
+    lora_list : bpy.props.CollectionProperty(type=LoraListItem) # type: ignore
+    lora_list_index : bpy.props.IntProperty(
+        default=-1,
+        update=lambda self, context: setattr(self, 'lora_list_index', -1)
+    ) # type: ignore
+    fuse_loras: bpy.props.BoolProperty(
+        name="Fuse LoRAs",
+        description="Merge the LoRA weights into the model when the same set is reused, removing their per-step cost",
+        default=False,
+    ) # type: ignore
+
     running: bpy.props.BoolProperty(name="is running", default=0) # type: ignore
     progress: bpy.props.IntProperty(name="", min=0, max=100, default=0) # type: ignore
     progress_text: bpy.props.StringProperty(name="") # type: ignore
     stop_process: bpy.props.BoolProperty(name="stop", default=0) # type: ignore
+    trace_summary: bpy.props.StringProperty(name="") # type: ignore
+    show_trace_summary: bpy.props.BoolProperty(name="Timings of last job", default=False) # type: ignore
+    telemetry_summary: bpy.props.StringProperty(name="") # type: ignore
+    show_telemetry: bpy.props.BoolProperty(name="Memory and throughput", default=False) # type: ignore
 
     ## Utilities
     canny_strength: bpy.props.FloatProperty(
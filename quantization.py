@@ -0,0 +1,63 @@
+import os, importlib, importlib.util
+
+QUANTIZED_FOLDER = os.path.join(os.path.expanduser('~'), '.cache', 'unexpected_diffusion', 'quantized')
+
+# Components that dominate memory for each model type: (pipeline component, library, class)
+QUANTIZED_COMPONENTS = {
+    'FLUX': [('transformer', 'diffusers', 'FluxTransformer2DModel'), ('text_encoder_2', 'transformers', 'T5EncoderModel')],
+    'SD3': [('transformer', 'diffusers', 'SD3Transformer2DModel'), ('text_encoder_3', 'transformers', 'T5EncoderModel')],
+}
+
+# Optional package behind each mode, and whether it only runs on CUDA
+QUANTIZATION_BACKENDS = {'nf4': ('bitsandbytes', True), 'int8': ('bitsandbytes', True), 'fp8': ('torchao', False)}
+
+def unavailable_reason(mode, device):
+    package, cuda_only = QUANTIZATION_BACKENDS[mode]
+    if cuda_only and device.type != 'cuda':
+        return f"{mode} quantization needs a CUDA device"
+    if importlib.util.find_spec(package) is None:
+        return f"{mode} quantization needs {package}, install it from the addon preferences"
+    return None
+
+def quantization_config(library, mode, dtype):
+    module = importlib.import_module(library)
+    if mode == 'nf4':
+        return module.BitsAndBytesConfig(load_in_4bit=True, bnb_4bit_quant_type='nf4', bnb_4bit_compute_dtype=dtype)
+    elif mode == 'int8':
+        return module.BitsAndBytesConfig(load_in_8bit=True)
+    elif mode == 'fp8':
+        from torchao.quantization import Float8WeightOnlyConfig
+        return module.TorchAoConfig(Float8WeightOnlyConfig())
+    raise ValueError(f"Unknown quantization mode {mode}")
+
+def cache_path(model_id, mode, component):
+    return os.path.join(QUANTIZED_FOLDER, model_id.replace('/', '--'), mode, component)
+
+def load_quantized_components(model_id, model_type, mode, dtype, source=None):
+    components = {}
+
+    for name, library, class_name in QUANTIZED_COMPONENTS.get(model_type, []):
+        cls = getattr(importlib.import_module(library), class_name)
+        path = cache_path(model_id, mode, name)
+        # torchao tensors are not safetensors-serializable
+        safe_serialization = mode != 'fp8'
+
+        if os.path.exists(os.path.join(path, 'config.json')):
+            components[name] = cls.from_pretrained(path, torch_dtype=dtype, use_safetensors=safe_serialization)
+            print(f"UD: loaded cached {mode} {name}")
+            continue
+
+        components[name] = cls.from_pretrained(source or model_id, subfolder=name, torch_dtype=dtype, quantization_config=quantization_config(library, mode, dtype))
+        try:
+            components[name].save_pretrained(path, safe_serialization=safe_serialization)
+            print(f"UD: cached {mode} {name} in {path}")
+        except Exception as e:
+            print(f"UD: could not cache quantized {name}: {e}")
+
+    return components
+
+def module_bytes(module):
+    return sum(p.numel() * p.element_size() for p in module.parameters()) + sum(b.numel() * b.element_size() for b in module.buffers())
+
+def pipeline_bytes(pipe):
+    return sum(module_bytes(c) for c in pipe.components.values() if hasattr(c, 'parameters'))
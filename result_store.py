@@ -0,0 +1,84 @@
+import os, json, time, hashlib, threading
+
+from PIL import Image
+
+RESULTS_FOLDER = os.path.join(os.path.expanduser('~'), '.cache', 'unexpected_diffusion', 'results')
+
+# Pipeline arguments that do not change the output
+IGNORED_PARAMS = ['generator', 'callback_on_step_end', 'callback_on_step_end_tensor_inputs']
+
+def image_digest(image):
+    h = hashlib.sha256(f'{image.mode}{image.size}'.encode())
+    h.update(image.tobytes())
+    return h.hexdigest()
+
+def describe(value):
+    # JSON-friendly form of a pipeline argument, images are replaced by their content hash
+    if isinstance(value, Image.Image):
+        return {'image': image_digest(value)}
+    if hasattr(value, 'detach'): # tensors, e.g. latents passed as an img2img image
+        array = value.detach().float().cpu().numpy()
+        return {'tensor': hashlib.sha256(array.tobytes()).hexdigest(), 'shape': list(array.shape)}
+    if isinstance(value, (list, tuple)):
+        return [describe(item) for item in value]
+    if isinstance(value, dict):
+        return {str(key): describe(item) for key, item in value.items()}
+    if value is None or isinstance(value, (bool, int, float, str)):
+        return value
+    return repr(value)
+
+class ResultStore:
+    """Generated images keyed by a hash of everything that determines them, with a JSON sidecar each"""
+
+    def __init__(self, folder=RESULTS_FOLDER, quota=2 * 1024 ** 3):
+        self.folder = folder
+        self.quota = quota
+        self.lock = threading.Lock()
+
+    def describe(self, identity, pipe_params):
+        params = {key: describe(value) for key, value in pipe_params.items() if key not in IGNORED_PARAMS}
+        return {'identity': describe(identity), 'params': params}
+
+    def key(self, description):
+        return hashlib.sha256(json.dumps(description, sort_keys=True).encode()).hexdigest()
+
+    def paths(self, key):
+        return os.path.join(self.folder, f'{key}.png'), os.path.join(self.folder, f'{key}.json')
+
+    def get(self, key):
+        image_path, _ = self.paths(key)
+        with self.lock:
+            if not os.path.exists(image_path):
+                return None
+            try:
+                image = Image.open(image_path)
+                image.load()
+            except OSError:
+                return None
+            os.utime(image_path) # the modification time orders eviction
+        return image
+
+    def put(self, key, image, description, **metadata):
+        image_path, sidecar_path = self.paths(key)
+        with self.lock:
+            os.makedirs(self.folder, exist_ok=True)
+            image.save(image_path)
+            with open(sidecar_path, 'w') as f:
+                json.dump(dict(description, key=key, created=time.time(), **metadata), f, indent=2)
+            self.evict()
+
+    def evict(self):
+        entries = []
+        for name in os.listdir(self.folder):
+            if name.endswith('.png'):
+                stat = os.stat(os.path.join(self.folder, name))
+                entries.append((stat.st_mtime, stat.st_size, name[:-4]))
+
+        used = sum(size for _, size, _ in entries)
+        for _, size, key in sorted(entries):
+            if used <= self.quota:
+                break
+            for path in self.paths(key):
+                if os.path.exists(path):
+                    os.remove(path)
+            used -= size
@@ -0,0 +1,46 @@
+import importlib.util
+
+class StepCache:
+    """Reuses deep-block features across adjacent timesteps (DeepCache for UNets, attention broadcast for transformers)"""
+
+    def __init__(self, pipe, interval):
+        self.pipe = pipe
+        self.interval = interval
+        self.helper = None
+        self.reason = None # why caching is off, when it is
+
+        if 'controlnet' in pipe.components or 'adapter' in pipe.components:
+            # Cached skip features would miss the per-step control residuals
+            self.reason = "step caching is not supported with ControlNets or T2I-Adapters"
+            return
+
+        if getattr(pipe, 'unet', None) is not None:
+            if importlib.util.find_spec('DeepCache') is None:
+                self.reason = "step caching of UNet models needs DeepCache, install it from the addon preferences"
+                return
+            from DeepCache import DeepCacheSDHelper
+            self.helper = DeepCacheSDHelper(pipe=pipe)
+            self.helper.set_params(cache_interval=interval, cache_branch_id=0)
+            self.helper.enable()
+
+        elif hasattr(getattr(pipe, 'transformer', None), 'enable_cache'):
+            from diffusers import PyramidAttentionBroadcastConfig
+            pipe.transformer.enable_cache(PyramidAttentionBroadcastConfig(
+                spatial_attention_block_skip_range=interval,
+                spatial_attention_timestep_skip_range=(100, 800),
+                current_timestep_callback=lambda: pipe.current_timestep,
+            ))
+            self.helper = pipe.transformer
+
+    @property
+    def active(self):
+        return self.helper is not None
+
+    def disable(self):
+        if self.helper is None:
+            return
+        if hasattr(self.helper, 'disable_cache'):
+            self.helper.disable_cache()
+        else:
+            self.helper.disable()
+        self.helper = None
@@ -0,0 +1,114 @@
+import os, sys, json, time, threading
+from collections import deque
+
+from .quantization import module_bytes
+
+TELEMETRY_LOG = os.path.join(os.path.expanduser('~'), '.cache', 'unexpected_diffusion', 'telemetry.jsonl')
+LOG_SIZE = 5 * 1024 ** 2 # the log moves to .1 above this size, so two files at most are kept
+WINDOW = 3600 # seconds of pipeline runs behind the throughput figures
+
+# Control modules are reported by the module cache, not as part of the pipeline
+CONTROL_COMPONENTS = ['controlnet', 'adapter']
+
+def rss_bytes():
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, AttributeError):
+        import resource
+        rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss # peak, the closest portable figure
+        return rss if sys.platform == 'darwin' else rss * 1024
+
+def format_gb(count):
+    return f'{count / 1024 ** 3:.2f} GB'
+
+class Throughput:
+    """Steps and images of the recent pipeline runs of this process"""
+
+    def __init__(self, window=WINDOW):
+        self.window = window
+        self.runs = deque() # (end time, steps, images, seconds)
+        self.lock = threading.Lock()
+
+    def record(self, steps, images, seconds):
+        with self.lock:
+            self.runs.append((time.time(), steps, images, seconds))
+
+    def rates(self):
+        with self.lock:
+            while self.runs and time.time() - self.runs[0][0] > self.window:
+                self.runs.popleft()
+            busy = sum(run[3] for run in self.runs)
+            if not busy:
+                return None
+            # Measured over the time spent generating, so idle time does not lower the capacity figure
+            return {
+                'steps_per_second': sum(run[1] for run in self.runs) / busy,
+                'images_per_hour': sum(run[2] for run in self.runs) * 3600 / busy,
+                'runs': len(self.runs),
+            }
+
+throughput = Throughput()
+
+def pipeline_bytes(pipe):
+    return sum(module_bytes(component) for name, component in pipe.components.items()
+               if hasattr(component, 'parameters') and name not in CONTROL_COMPONENTS)
+
+def sample_device(processor):
+    # Runs as a job on the device's worker thread, so the pipeline and module cache are not changed while they are read
+    torch = sys.modules.get('torch')
+    device = {'device': str(processor.device), 'pipeline': None, 'modules': []}
+
+    pipe = getattr(processor, 'pipe', None)
+    if pipe is not None:
+        device['pipeline'] = {'model': processor.loaded_model, 'type': processor.loaded_model_type, 'bytes': pipeline_bytes(pipe), 'used': processor.last_used}
+
+    for key, module in processor.module_cache.entries.items():
+        device['modules'].append({'model': key, 'bytes': module['bytes'], 'in_use': module['refs'] > 0, 'used': module['used']})
+
+    if torch is not None and processor.device.type == 'cuda':
+        device['allocated'] = torch.cuda.memory_allocated(processor.device)
+        device['reserved'] = torch.cuda.memory_reserved(processor.device)
+    return device
+
+def sample(devices):
+    # devices: the sample_device results of each worker
+    return {'time': time.time(), 'host_rss': rss_bytes(), 'throughput': throughput.rates(), 'devices': list(devices)}
+
+def least_recently_used(entry):
+    # Parked control modules and loaded pipelines, the one unused the longest; modules in use go with their pipeline
+    candidates = []
+    for index, device in enumerate(entry['devices']):
+        if device['pipeline']:
+            candidates.append((device['pipeline']['used'] or 0, index, None))
+        candidates += [(module['used'], index, module['model']) for module in device['modules'] if not module['in_use']]
+    return min(candidates, key=lambda candidate: candidate[0]) if candidates else None
+
+def log(entry, filepath=TELEMETRY_LOG):
+    try:
+        os.makedirs(os.path.dirname(filepath), exist_ok=True)
+        if os.path.exists(filepath) and os.path.getsize(filepath) > LOG_SIZE:
+            os.replace(filepath, filepath + '.1')
+        with open(filepath, 'a') as f:
+            f.write(json.dumps(entry) + '\n')
+    except OSError as e:
+        print(f"UD: could not write telemetry: {e}")
+
+def summary(entry):
+    lines = [f"Host RAM {format_gb(entry['host_rss'])}"]
+
+    for device in entry['devices']:
+        line = device['device']
+        if 'allocated' in device:
+            line += f": {format_gb(device['allocated'])} allocated, {format_gb(device['reserved'])} reserved"
+        lines.append(line)
+        if device['pipeline']:
+            pipeline = device['pipeline']
+            lines.append(f"  {pipeline['model']} ({pipeline['type']}) {format_gb(pipeline['bytes'])}")
+        for module in device['modules']:
+            lines.append(f"  {module['model']} {format_gb(module['bytes'])} {'in use' if module['in_use'] else 'parked'}")
+
+    rates = entry['throughput']
+    if rates:
+        lines.append(f"{rates['steps_per_second']:.2f} steps/s, {rates['images_per_hour']:.0f} images/hour ({rates['runs']} runs)")
+    return '\n'.join(lines)
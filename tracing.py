@@ -0,0 +1,96 @@
+import os, sys, json, time, threading
+from contextlib import contextmanager
+
+def cuda():
+    # Only touch torch if a job already imported it, tracing must stay cheap on the UI thread
+    torch = sys.modules.get('torch')
+    if torch is not None and torch.cuda.is_available():
+        return torch.cuda
+    return None
+
+class Tracer:
+    def __init__(self, job_name):
+        self.job_name = job_name
+        self.origin = time.perf_counter()
+        self.events = []
+        self.lock = threading.Lock()
+        self.local = threading.local()
+
+    def open_spans(self):
+        if not hasattr(self.local, 'stack'):
+            self.local.stack = []
+        return self.local.stack
+
+    def bind(self, device):
+        # Spans of this thread sample the device its processor runs on, unbound threads sample the current CUDA device
+        self.local.device = device
+
+    def sample_peak(self):
+        cuda_module = cuda()
+        device = getattr(self.local, 'device', None)
+        if cuda_module is None or (device is not None and device.type != 'cuda'):
+            return 0
+        cuda_module.synchronize(device)
+        peak = cuda_module.max_memory_allocated(device)
+        cuda_module.reset_peak_memory_stats(device)
+        # The counter is shared, fold it into every open span before resetting
+        for span in self.open_spans():
+            span['peak'] = max(span['peak'], peak)
+        return peak
+
+    @contextmanager
+    def span(self, name, **args):
+        self.sample_peak()
+        span = {'name': name, 'start': time.perf_counter(), 'peak': 0}
+        self.open_spans().append(span)
+        try:
+            yield span
+        finally:
+            self.sample_peak()
+            self.open_spans().remove(span)
+            self.add_span(name, span['start'], time.perf_counter(), peak=span['peak'], **args)
+            for parent in self.open_spans():
+                parent['peak'] = max(parent['peak'], span['peak'])
+
+    def add_span(self, name, start, end, peak=0, **args):
+        if peak:
+            args['peak_memory_mb'] = round(peak / 2**20, 1)
+        event = {
+            'name': name,
+            'cat': self.job_name,
+            'ph': 'X',
+            'ts': (start - self.origin) * 1e6,
+            'dur': (end - start) * 1e6,
+            'pid': os.getpid(),
+            'tid': threading.get_ident(),
+            'args': args,
+        }
+        with self.lock:
+            self.events.append(event)
+
+    def export(self, folder):
+        filepath = os.path.join(folder, f'ud_trace_{self.job_name}_{time.strftime("%Y%m%d-%H%M%S")}.json')
+        with self.lock, open(filepath, 'w') as f:
+            json.dump({'traceEvents': self.events, 'displayTimeUnit': 'ms'}, f)
+        return filepath
+
+    def totals(self):
+        totals = {}
+        with self.lock:
+            for event in self.events:
+                entry = totals.setdefault(event['name'], {'count': 0, 'seconds': 0.0, 'peak_memory_mb': 0})
+                entry['count'] += 1
+                entry['seconds'] += event['dur'] / 1e6
+                entry['peak_memory_mb'] = max(entry['peak_memory_mb'], event['args'].get('peak_memory_mb', 0))
+        return totals
+
+    def summary(self):
+        lines = []
+        for name, entry in self.totals().items():
+            line = f"{name}: {entry['seconds']:.2f}s"
+            if entry['count'] > 1:
+                line += f" ({entry['count']}x, {entry['seconds'] / entry['count']:.2f}s avg)"
+            if entry['peak_memory_mb']:
+                line += f", peak {entry['peak_memory_mb']:.0f} MB"
+            lines.append(line)
+        return '\n'.join(lines)
@@ -1,18 +1,56 @@
 
-import os, platform
+import os, platform, tempfile, threading, time
+from collections import OrderedDict
 
-from diffusers import StableDiffusion3Pipeline, FluxPipeline, FluxImg2ImgPipeline, T2IAdapter, MultiAdapter, EDMDPMSolverMultistepScheduler, DPMSolverMultistepScheduler, StableDiffusionXLControlNetPipeline, DiffusionPipeline, StableDiffusionXLPipeline, StableDiffusionXLAdapterPipeline, StableDiffusionUpscalePipeline, StableDiffusionXLImg2ImgPipeline, StableDiffusionXLInpaintPipeline, StableDiffusionXLControlNetInpaintPipeline, StableDiffusionXLControlNetImg2ImgPipeline, ControlNetModel, AutoencoderKL
-import numpy as np
+import diffusers
 import torch
 from PIL import Image, ImageEnhance
-from realesrgan_ncnn_py import Realesrgan
 
-from . import gpudetector
+from . import gpudetector, buckets, tracing, inpainting, masks, oom, model_fetch, telemetry
+from .inference_server import blender_image_to_array
+from .step_cache import StepCache
+from .result_store import ResultStore
+from .checkpoints import Checkpointer
+from .module_cache import ModuleCache
+from .quantization import load_quantized_components, pipeline_bytes, unavailable_reason
+from .functions import basic_functions as bf
 from .constants import CONTROLNET_MODELS
-from .pipelines import pipeline_settings
+from .pipelines import pipeline_settings, pipeline_class, plan_steps, executed_steps, cfg_truncation_inputs, latent_pipelines, hires_pipelines, resumable_pipelines, resume_pipeline
 
 current_dir = os.path.dirname(os.path.realpath(__file__))
 
+bucket_stats = buckets.BucketStats(os.path.join(tempfile.gettempdir(), 'ud_bucket_stats.json'))
+result_store = ResultStore()
+memory_rungs = oom.MemoryRungs(os.path.join(tempfile.gettempdir(), 'ud_memory_rungs.json'))
+
+# Undecoded SDXL latents of recent results by image name, shared by the processors of all devices
+latent_cache = OrderedDict()
+latent_lock = threading.Lock()
+LATENT_CACHE_SIZE = 16
+
+def keep_latents(name, latents):
+    if name is None:
+        return
+    latents = latents.detach().to('cpu')
+    with latent_lock:
+        latent_cache[name] = latents
+        latent_cache.move_to_end(name)
+        while len(latent_cache) > LATENT_CACHE_SIZE:
+            latent_cache.popitem(last=False)
+
+def kept_latents(name):
+    with latent_lock:
+        return latent_cache.get(name)
+
+def drop_latents(name):
+    with latent_lock:
+        latent_cache.pop(name, None)
+
+# CLIP token counts of full prompt strings, a prompt is only checked against the encoder window once
+token_counts = {}
+token_lock = threading.Lock()
+PROMPT_CACHE_SIZE = 32
+
 # Install opencv-python-headless instead of regular opencv-python! Or you'll run into xcb conflicts
 
 def round_to_nearest(n):
@@ -20,39 +58,19 @@ def round_to_nearest(n):
         return int(n)
     else:
         return int(n) + 1
+
+def format_eta(seconds):
+    minutes, seconds = divmod(int(seconds), 60)
+    return f'{minutes}m {seconds:02d}s' if minutes else f'{seconds}s'
     
 def blender_image_to_pil(blender_image):
     if blender_image is None:
         raise ValueError("No Blender image provided")
 
-    pixels = np.array(blender_image.pixels[:]) 
-    size = blender_image.size[0], blender_image.size[1]
-
-    pixels = np.reshape(pixels, (size[1], size[0], 4))
-    pixels = np.flip(pixels, axis=0)
-    pixels = (pixels * 255).astype(np.uint8)
-
-    return Image.fromarray(pixels, 'RGBA')
-
-def create_alpha_mask(image):
-    if image.mode != 'RGBA':
-        raise ValueError("Image does not have an alpha channel")
-
-    alpha = image.split()[-1]
-    inverted_alpha = Image.eval(alpha, lambda a: 255 - a)
+    if isinstance(blender_image, Image.Image): # Already decoded, e.g. received by the inference server
+        return blender_image.convert('RGBA')
 
-    mask = inverted_alpha.convert('L')
-
-    return mask
-
-def is_mask_almost_black(mask, tolerance=5):
-    if mask.mode != 'L':
-        mask = mask.convert('L')
-
-    mask_array = np.array(mask)
-    avg_pixel = np.mean(mask_array)
-
-    return avg_pixel < tolerance
+    return Image.fromarray(blender_image_to_array(blender_image), 'RGBA')
 
 def get_device():
     if torch.cuda.is_available():
@@ -64,57 +82,123 @@ def get_device():
     else:
         return torch.device('cpu')
 
+def get_devices():
+    if torch.cuda.is_available() and torch.cuda.device_count() > 1:
+        return [torch.device('cuda', index) for index in range(torch.cuda.device_count())]
+    return [get_device()]
+
 class UD_Processor():
     prompt_adds = ", highly detailed, beautiful, 4K, photorealistic, high resolution"
     negative_prompt_adds = ", text, watermark, low-quality, signature, moiré pattern, downsampling, aliasing, distorted, blurry, glossy, blur, jpeg artifacts, compression artifacts, poorly drawn, bad, distortion, twisted, grainy, duplicate, error, pixelated, fake, glitch, overexposed, bad-contrast"
     vae_model = "madebyollin/sdxl-vae-fp16-fix"
+    upscaler_model = "stabilityai/stable-diffusion-x4-upscaler"
 
     upscale_strength = 0.35
+    latent_upscale_strength = 0.55 # interpolated latents are blurrier than resampled pixels
     upscaling_rate = 2
     upscaling_steps = 10
+    module_cache_budget = 6 * 1024 ** 3 # host memory for released controlnets and adapters
 
     loaded_model = None
     loaded_model_type = None
     loaded_vae = None
     loaded_controlnets = None
     loaded_t2i = None
-
-    device = get_device()
+    loaded_quantization = None
+    held_modules = () # module cache keys used by the loaded pipeline
+    last_used = None
+    offload = None # 'model' or 'sequential' when accelerate hooks manage the placement
+    memory_rung = 0 # index in oom.RUNGS applied to the loaded pipeline
+    loaded_loras = None # lora path -> adapter name, lives as long as the pipeline
+    lora_state = None
+    fused_loras = None
+    prompt_embeds_cache = None # prompt string -> (embeddings, pooled embeddings), valid for the loaded text encoders
+    step_cache = None
+    checkpointer = None
+
+    cfg_cutoff_step = None
+    cfg_threshold = 0
+    cfg_similarity = None
+    cfg_hook = None
+
+    planned_steps = None
+    first_step_time = None
+    last_step_end = None
+
+    device = None # resolved on first use, querying the backends initializes them
 
     manager = None
 
+    def __init__(self, device=None):
+        if device is not None:
+            self.device = torch.device(device)
+        elif self.device is None:
+            self.device = get_device()
+        self.module_cache = ModuleCache(self.device, self.module_cache_budget)
+
     def run(self, params, manager):
         self.manager = manager
+        tracer = manager.tracer
+        tracer.bind(self.device)
 
         target_width, target_height = (round((params[dim] * params['scale'] / 100) / 16) * 16 for dim in ['width', 'height'])
 
-        init_image = blender_image_to_pil(params['init_image_slot']).resize((target_width, target_height)) if params.get('init_image_slot') else None
-
-        if params['init_mask_slot']:
-            mask_image = blender_image_to_pil(params['init_mask_slot']).resize((target_width, target_height)).convert("RGB")
+        # Generate at a fixed set of shapes to keep tensor sizes stable across runs
+        if params.get('use_buckets'):
+            gen_width, gen_height = buckets.snap_to_bucket(target_width, target_height)
         else:
-            if init_image:
-                mask_image = create_alpha_mask(init_image)
-                if is_mask_almost_black(mask_image):
-                    mask_image = None
+            gen_width, gen_height = target_width, target_height
+
+        with tracer.span('image_ingest'):
+            init_image = blender_image_to_pil(params['init_image_slot']).resize((gen_width, gen_height)) if params.get('init_image_slot') else None
+
+            if params['init_mask_slot']:
+                mask = masks.from_luminance(blender_image_to_pil(params['init_mask_slot']).resize((gen_width, gen_height)))
+            elif init_image:
+                mask = masks.from_alpha(init_image)
+                if mask.empty:
+                    mask = None
             else:
-                mask_image = None
+                mask = None
+
+            mask_image = mask.image() if mask else None
 
-        if init_image:
-            init_image = init_image.convert('RGB')
+            if init_image:
+                init_image = init_image.convert('RGB')
 
-        controlnet_image = [blender_image_to_pil(slot).resize((target_width, target_height)).convert("RGB") for slot in params['controlnet_image_slot']] if 'controlnet_image_slot' in params else None
-        t2i_image = [blender_image_to_pil(slot).resize((target_width, target_height)).convert("RGB") for slot in params['t2i_image_slot']] if 't2i_image_slot' in params else None
+            controlnet_image = [blender_image_to_pil(slot).resize((gen_width, gen_height)).convert("RGB") for slot in params['controlnet_image_slot']] if 'controlnet_image_slot' in params else None
+            t2i_image = [blender_image_to_pil(slot).resize((gen_width, gen_height)).convert("RGB") for slot in params['t2i_image_slot']] if 't2i_image_slot' in params else None
             
-        pipeline_type = self.determine_pipeline_type(params, init_image, mask_image)
+        pipeline_type = self.determine_pipeline_type(params, init_image, mask)
+
+        # Inpaint only the masked region at the working resolution and paste it back
+        crop = None
+        if params.get('inpaint_crop') and pipeline_type in inpainting.CROP_PIPELINES:
+            with tracer.span('inpaint_crop'):
+                crop = inpainting.plan_crop(mask, params.get('inpaint_padding', 64))
+                if crop:
+                    full_image, full_mask = init_image, mask_image
+                    init_image, mask_image = crop.extract(init_image), crop.extract(mask_image)
+                    controlnet_image = [crop.extract(img) for img in controlnet_image] if controlnet_image else controlnet_image
+                    gen_width, gen_height = crop.work_size
+                    print(f"UD: inpainting a {crop.size[0]}x{crop.size[1]} crop at {gen_width}x{gen_height}")
+
+        # Compose at the model's native size, then refine at the requested size
+        hires_size = None
+        if params.get('hires_fix') and pipeline_type in hires_pipelines:
+            native = buckets.snap_to_bucket(gen_width, gen_height, scales=[1])
+            if native[0] * native[1] < gen_width * gen_height:
+                hires_size = gen_width, gen_height
+                gen_width, gen_height = native
+                print(f"UD: hires fix from {gen_width}x{gen_height} to {hires_size[0]}x{hires_size[1]}")
 
         # Define a dictionary of potential parameter assignments with lambdas for conditional logic
         param_mapping = {
             'prompt': lambda: params['prompt'] + self.prompt_adds,
-            'width': lambda: target_width,
-            'height': lambda: target_height,
-            'generator': lambda: torch.manual_seed(params["seed"]),
-            'num_inference_steps': lambda: round_to_nearest(params['inference_steps'] / (params['denoise_strength'] if init_image else 1)),
+            'width': lambda: gen_width,
+            'height': lambda: gen_height,
+            'generator': lambda: torch.Generator('cpu').manual_seed(params['seed']),
+            'num_inference_steps': lambda: plan_steps(pipeline_type, params['inference_steps'], params['denoise_strength'] if init_image else None),
             'guidance_scale': lambda: params['cfg_scale'],
             'negative_prompt': lambda: params['negative_prompt'] + self.negative_prompt_adds,
             'image': lambda: next(
@@ -126,6 +210,7 @@ class UD_Processor():
             'control_image': lambda: params.get('controlnet_image'),
             'controlnet_conditioning_scale': lambda: params['controlnet_factor'],
             'adapter_conditioning_scale': lambda: params['t2i_factor'] if len(params['t2i_model']) > 1 else params['t2i_factor'][0],
+            'callback_on_step_end_tensor_inputs': lambda: cfg_truncation_inputs[pipeline_type] if params['cfg_scale'] > 1 and (params.get('cfg_cutoff', 1) < 1 or params.get('adaptive_cfg', 0) > 0) else None,
         }
 
         pipe_params = {}
@@ -135,23 +220,56 @@ class UD_Processor():
                 if value is not None:  
                     pipe_params[key] = value
 
-        image = self.run_pipeline(
-            params=params,
-            pipeline_type=pipeline_type,
-            pipeline_model=params['model'],
-            vae_model=self.vae_model,
-            controlnet_models=params.get('controlnet_model', []),
-            t2i_models=params.get('t2i_model', []),
-            pipe_params=pipe_params,
-        )
+        # A hires result is stored under the whole request, so repeating it skips the first pass too
+        image = request_key = None
+        if hires_size and params.get('result_cache_size', 0) > 0:
+            request_key = self.hires_request_key(params, pipeline_type, pipe_params, hires_size)
+            with tracer.span('result_lookup'):
+                image = self.stored_result(params, request_key[0])
+
+        if image is None:
+            image = self.run_pipeline(
+                params=dict(params, temp_image_filepath=None) if hires_size else params,
+                pipeline_type=pipeline_type,
+                pipeline_model=params['model'],
+                vae_model=self.vae_model,
+                controlnet_models=params.get('controlnet_model', []),
+                t2i_models=params.get('t2i_model', []),
+                pipe_params=pipe_params,
+                latents_only=bool(hires_size),
+                final=not hires_size,
+            )
+
+            if image is not None and hires_size:
+                image = self.hires_pass(params, pipeline_type, pipe_params, image, hires_size, request_key)
 
         if image is not None:
+            if crop or image.size != (target_width, target_height):
+                drop_latents(params.get('image_name'))
+
+            if crop:
+                with tracer.span('inpaint_composite'):
+                    image = crop.composite(image, full_image, full_mask)
+                    if params['temp_image_filepath']:
+                        image.save(params['temp_image_filepath'])
+
+            # The inputs were stretched to the bucket, stretching back keeps the result aligned with them
+            if image.size != (target_width, target_height):
+                with tracer.span('bucket_fit'):
+                    image = image.resize((target_width, target_height), Image.Resampling.LANCZOS)
+                    if params['temp_image_filepath']:
+                        image.save(params['temp_image_filepath'])
             return image
         
     def upscale(self, params, manager): 
         self.manager = manager
+        tracer = manager.tracer
+        tracer.bind(self.device)
+
+        if params['mode'] == 'upscale_latent':
+            return self.upscale_latent(params)
 
-        image = Image.open(params['temp_image_filepath'])
+        image = params['source_image'] if params.get('source_image') is not None else Image.open(params['temp_image_filepath'])
 
         current_width = round_to_nearest(params['width']/16)*16
         current_height = round_to_nearest(params['height']/16)*16
@@ -162,25 +280,33 @@ class UD_Processor():
             self.manager.set_progress_text('Resizing with Realesrgan ...')
 
             # Resize to 4x using realesrgan
-            realesrgan = Realesrgan(gpuid = gpudetector.get_dedicated_gpu(), model = 4)
-            image = realesrgan.process_pil(image)
-            realesrgan = None
-            upscaled_image = image.resize((current_width * 2, current_height * 2), Image.Resampling.LANCZOS)
+            with tracer.span('realesrgan'):
+                from realesrgan_ncnn_py import Realesrgan
+                realesrgan = Realesrgan(gpuid = gpudetector.get_dedicated_gpu(), model = 4)
+                image = realesrgan.process_pil(image)
+                realesrgan = None
+                upscaled_image = image.resize((current_width * 2, current_height * 2), Image.Resampling.LANCZOS)
             contrast=1.1
 
         elif params['mode'] == 'upscale_sd':
             # Resize to 4x using stable-diffusion-x4-upscaler
             self.unload()   
-            model_id = "stabilityai/stable-diffusion-x4-upscaler"
-            self.pipe = StableDiffusionUpscalePipeline.from_pretrained(model_id, torch_dtype=torch.float16)
-            self.pipe = self.pipe.to(self.device)
-            self.pipe.enable_attention_slicing()
-            upscaled_image = self.pipe(
-                    prompt=params['prompt'],
-                    image=image.convert("RGB"),
-                    noise_level=5,
-                    num_inference_steps=25,
-                ).images[0]
+            model_id = self.upscaler_model
+            try:
+                self.fetch_models([model_id])
+            except model_fetch.FetchCancelled:
+                return None
+            with tracer.span('model_load', model=model_id):
+                self.pipe = pipeline_class('StableDiffusionUpscalePipeline').from_pretrained(model_fetch.fetcher.resolve(model_id), torch_dtype=self.torch_dtype())
+                self.pipe = self.pipe.to(self.device)
+                self.pipe.enable_attention_slicing()
+            with tracer.span('sd_upscale'):
+                upscaled_image = self.pipe(
+                        prompt=params['prompt'],
+                        image=image.convert("RGB"),
+                        noise_level=5,
+                        num_inference_steps=25,
+                    ).images[0]
             upscaled_image = upscaled_image.resize((current_width * 2, current_height * 2), Image.Resampling.LANCZOS)
             contrast=1.1
 
@@ -188,7 +314,9 @@ class UD_Processor():
         enhancer = ImageEnhance.Contrast(upscaled_image)
         upscaled_image = enhancer.enhance(contrast)
 
-        upscaled_image.save(params['temp_image_filepath'])
+        if params['temp_image_filepath']:
+            with tracer.span('png_save'):
+                upscaled_image.save(params['temp_image_filepath'])
 
         # Refine upscaled image
         overrides = {
@@ -196,7 +324,7 @@ class UD_Processor():
                 'negative_prompt': params['negative_prompt'] + ' hdr ' + self.negative_prompt_adds,
                 'image': upscaled_image.convert('RGB'),
                 'strength': self.upscale_strength,
-                'num_inference_steps': round_to_nearest(self.upscaling_steps / self.upscale_strength),
+                'num_inference_steps': plan_steps('StableDiffusionXLImg2ImgPipeline', self.upscaling_steps, self.upscale_strength),
                 'guidance_scale': 5,
             }
 
@@ -210,6 +338,91 @@ class UD_Processor():
             )
         return decoded_image
 
+    def hires_request_key(self, params, pipeline_type, pipe_params, size):
+        # Identity of the first pass plus the settings of the second, known before either runs
+        vae_model = self.vae_model if params['model'] in ['stabilityai/stable-diffusion-xl-base-1.0'] else None
+        identity = self.result_identity(params, pipeline_type, params['model'], vae_model, params.get('controlnet_model', []),
+                                        params.get('t2i_model', []), self.resolve_quantization(params))
+        identity['hires'] = {
+            'pipeline_type': hires_pipelines[pipeline_type],
+            'size': list(size),
+            'denoise': params.get('hires_denoise', 0.45),
+            'inference_steps': params['inference_steps'],
+        }
+        description = result_store.describe(identity, pipe_params)
+        return result_store.key(description), description
+
+    def stored_result(self, params, store_key):
+        result_store.quota = params['result_cache_size'] * 1024 ** 3
+        cached = result_store.get(store_key)
+        if cached is not None:
+            print(f"UD: reusing stored result {store_key[:12]}")
+            drop_latents(params.get('image_name'))
+            self.manager.set_progress(100)
+            self.manager.set_progress_text('Loaded stored result')
+            if params['temp_image_filepath']:
+                cached.save(params['temp_image_filepath'])
+        return cached
+
+    def hires_pass(self, params, pipeline_type, pipe_params, first_pass, size, request_key=None):
+        width, height = size
+        with self.manager.tracer.span('hires_upscale'):
+            if isinstance(first_pass, Image.Image):
+                image = first_pass.resize(size, Image.Resampling.LANCZOS)
+            else:
+                image = torch.nn.functional.interpolate(first_pass.float(), size=(height // 8, width // 8), mode='bicubic')
+
+        # As many steps as the requested schedule would spend at this denoising strength
+        hires_type = hires_pipelines[pipeline_type]
+        strength = params.get('hires_denoise', 0.45)
+        steps = max(int(params['inference_steps'] * strength), 1)
+
+        hires_params = {key: value for key, value in pipe_params.items() if key in pipeline_settings[hires_type]}
+        hires_params.update({
+            'width': width,
+            'height': height,
+            'generator': torch.Generator('cpu').manual_seed(params['seed']),
+            'image': image,
+            'strength': strength,
+            'num_inference_steps': plan_steps(hires_type, steps, strength),
+        })
+
+        return self.run_pipeline(
+            params=params,
+            pipeline_type=hires_type,
+            pipeline_model=params['model'],
+            vae_model=self.vae_model,
+            pipe_params=hires_params,
+            result_key=request_key,
+        )
+
+    def upscale_latent(self, params):
+        latents = kept_latents(params.get('image_name'))
+        if latents is None:
+            print(f"UD: no latents kept for {params.get('image_name')}, generate it with Keep Latents enabled or use a pixel upscaler")
+            return None
+
+        # Interpolate in latent space and refine, the only VAE pass is the final decode
+        with self.manager.tracer.span('latent_upscale'):
+            upscaled = torch.nn.functional.interpolate(latents.float(), scale_factor=self.upscaling_rate, mode='bicubic')
+
+        overrides = {
+                'prompt': params['prompt'] + self.prompt_adds,
+                'negative_prompt': params['negative_prompt'] + ' hdr ' + self.negative_prompt_adds,
+                'image': upscaled,
+                'strength': self.latent_upscale_strength,
+                'num_inference_steps': plan_steps('StableDiffusionXLImg2ImgPipeline', self.upscaling_steps, self.latent_upscale_strength),
+                'guidance_scale': 5,
+            }
+
+        return self.run_pipeline(
+            params=params,
+            pipeline_type='StableDiffusionXLImg2ImgPipeline',
+            pipeline_model=params['model'],
+            vae_model=self.vae_model,
+            pipe_params=overrides,
+        )
+
     def run_pipeline(
             self,
             params,
@@ -219,62 +432,124 @@ class UD_Processor():
             controlnet_models = [],
             t2i_models = [],
             pipe_params = {},
+            latents_only = False,
+            final = True, # counted as a finished image, a hires first pass is not one even when it returns pixels
+            result_key = None, # (key, description) the result is stored under instead of this pass's inputs
         ):
 
         self.manager.set_progress(0)
+        self.last_used = time.time()
+        tracer = self.manager.tracer
 
         with torch.no_grad(): 
             # CHANGES FOR SPECIFIC MODELS
             if pipeline_model not in ['stabilityai/stable-diffusion-xl-base-1.0']:
                 vae_model = None
 
-            # INITIALIZE PIPE IF NEEDED
-            if self.loaded_model != pipeline_model or self.loaded_model_type != pipeline_type or self.loaded_vae != vae_model or self.loaded_controlnets != controlnet_models or self.loaded_t2i != t2i_models:
+            quantization = self.resolve_quantization(params)
+
+            # Stored results and checkpoints are both keyed by everything that determines the output
+            use_store = params.get('result_cache_size', 0) > 0 and not latents_only
+            use_checkpoints = params.get('checkpoint_interval', 0) > 0
+            if use_store or use_checkpoints:
+                identity = self.result_identity(params, pipeline_type, pipeline_model, vae_model, controlnet_models, t2i_models, quantization)
+                description = result_store.describe(identity, pipe_params)
+                key = result_store.key(description)
+
+            # RETURN A STORED RESULT FOR IDENTICAL INPUTS
+            store_key = None
+            if use_store:
+                store_key, store_description = result_key or (key, description)
+                if result_key is None: # a request key was already looked up by the caller
+                    with tracer.span('result_lookup'):
+                        cached = self.stored_result(params, store_key)
+                    if cached is not None:
+                        return cached
+
+            # CONTINUE AN INTERRUPTED JOB FROM ITS LAST CHECKPOINT
+            checkpoint_key = checkpoint = None
+            if use_checkpoints:
+                if self.checkpointer is None:
+                    self.checkpointer = Checkpointer()
+                    self.checkpointer.prune()
+                checkpoint_key = key
+                if pipeline_type in resumable_pipelines:
+                    checkpoint = self.checkpointer.load(checkpoint_key)
+                if checkpoint:
+                    print(f"UD: resuming from step {checkpoint['step']} / {checkpoint['planned_steps']}")
+                    pipeline_type = resume_pipeline
+                    pipe_params = self.resume_params(pipe_params, checkpoint)
+
+            # SWITCH TASK ON THE LOADED COMPONENTS, OR INITIALIZE PIPE IF NEEDED
+            same_base = self.loaded_model == pipeline_model and self.loaded_vae == vae_model and self.loaded_quantization == quantization
+            same_components = same_base and self.loaded_controlnets == controlnet_models and self.loaded_t2i == t2i_models
+            if same_base and not same_components:
+                # Only the control modules change, the base model stays loaded
+                with tracer.span('pipeline_switch', pipeline=pipeline_type):
+                    self.switch_pipeline(pipeline_type, **self.control_components(controlnet_models, t2i_models))
+                self.loaded_controlnets = controlnet_models
+                self.loaded_t2i = t2i_models
+            elif same_components and self.loaded_model_type != pipeline_type:
+                with tracer.span('pipeline_switch', pipeline=pipeline_type):
+                    self.switch_pipeline(pipeline_type)
+
+            if not same_base:
                 
                 self.unload()
+
+                try:
+                    self.fetch_models([pipeline_model, vae_model] + controlnet_models + t2i_models)
+                except model_fetch.FetchCancelled:
+                    return None
                 self.manager.set_progress_text('Loading pipeline...')
 
                 model_params = {
-                    'torch_dtype': torch.bfloat16 if params['pipeline_type'] == 'SD3' else torch.float16,
+                    'torch_dtype': self.torch_dtype(params['pipeline_type']),
                 }
 
                 if params['pipeline_type'] == 'SDXL':
                     model_params['add_watermarker'] = False
 
-                # LOAD CONTROLNET
-                if controlnet_models:
-                    model_params['controlnet'] = [self.create_controlnet(model) for model in controlnet_models]
-
-                # LOAD T2I_ADAPTER
-                if t2i_models:
-                    if len(t2i_models) == 1:
-                        model_params['adapter'] = self.create_t2i(t2i_models[0])
-                    else:
-                        model_params['adapter'] = MultiAdapter([self.create_t2i(model) for model in t2i_models])
+                # LOAD CONTROLNET / T2I_ADAPTER
+                model_params.update(self.control_components(controlnet_models, t2i_models))
 
                 # LOAD VAE
                 if vae_model:
-                    model_params['vae'] = AutoencoderKL.from_pretrained( vae_model, torch_dtype=torch.float16 ).to(self.device)
+                    with tracer.span('vae_load', model=vae_model):
+                        model_params['vae'] = diffusers.AutoencoderKL.from_pretrained( model_fetch.fetcher.resolve(vae_model), torch_dtype=self.torch_dtype() ).to(self.device)
                 
                 try:
-                    try:
-                        self.pipe = globals()[pipeline_type].from_pretrained(pipeline_model, **model_params, variant='fp16')
-                        print("Loaded fp16 weights")
-                    except Exception as e2:
-                        print(f"fp16 variant not available. Using fp32.")
-                        self.pipe = globals()[pipeline_type].from_pretrained(pipeline_model, **model_params)
-
-                    if params['pipeline_type'] == 'SDXL':
-                        self.pipe.to(self.device)
-                        self.pipe.enable_vae_tiling()
-                    elif params['pipeline_type'] == 'FLUX':
-                        self.pipe.enable_sequential_cpu_offload()
-                        self.pipe.vae.enable_slicing()
-                        self.pipe.vae.enable_tiling()
-                    elif params['pipeline_type'] == 'SD3':
-                        self.pipe.enable_model_cpu_offload()
-                        self.pipe.vae.enable_slicing()
-                        self.pipe.vae.enable_tiling()
+                    # LOAD QUANTIZED TRANSFORMER / T5, converted once and cached on disk
+                    if quantization:
+                        with tracer.span('quantized_load', mode=quantization):
+                            model_params.update(load_quantized_components(pipeline_model, params['pipeline_type'], quantization, model_params['torch_dtype'], source=model_fetch.fetcher.resolve(pipeline_model)))
+
+                    with tracer.span('model_load', model=pipeline_model, pipeline=pipeline_type):
+                        source = model_fetch.fetcher.resolve(pipeline_model)
+                        try:
+                            self.pipe = pipeline_class(pipeline_type).from_pretrained(source, **model_params, variant='fp16')
+                            print("Loaded fp16 weights")
+                        except Exception as e2:
+                            print(f"fp16 variant not available. Using fp32.")
+                            self.pipe = pipeline_class(pipeline_type).from_pretrained(source, **model_params)
+
+                        if params['pipeline_type'] == 'SDXL':
+                            self.pipe.to(self.device)
+                            self.pipe.enable_vae_tiling()
+                        elif params['pipeline_type'] in ['FLUX', 'SD3']:
+                            if quantization and self.fits_on_device():
+                                self.pipe.to(self.device)
+                            elif params['pipeline_type'] == 'FLUX' and not quantization:
+                                self.offload = 'sequential'
+                            else:
+                                self.offload = 'model'
+                            self.enable_offload()
+                            self.pipe.vae.enable_slicing()
+                            self.pipe.vae.enable_tiling()
+
+                    self.apply_sampling_profile(pipeline_model)
+                    self.trace_pipe_stages()
+                    self.precompute_negative_prompts(pipeline_type)
 
                 except Exception as e:
                     print(f"UD: Error occurred in loading the pipeline:\n\n{e}")
@@ -286,6 +561,7 @@ class UD_Processor():
                 self.loaded_model_type = pipeline_type
                 self.loaded_controlnets = controlnet_models
                 self.loaded_t2i = t2i_models
+                self.loaded_quantization = quantization
                 del model_params
 
             print(self.loaded_model + ' ' + self.loaded_model_type)
@@ -293,46 +569,486 @@ class UD_Processor():
             if pipeline_type not in ['StableDiffusionXLAdapterPipeline']:
                 pipe_params['callback_on_step_end'] = self.pipe_callback
 
-            if pipeline_model in ['playgroundai/playground-v2.5-1024px-aesthetic']:
-                self.pipe.scheduler = EDMDPMSolverMultistepScheduler()
+            self.apply_loras(params.get('lora_path', []), params.get('lora_weight', []), params.get('fuse_loras', False))
+            self.set_step_cache(params.get('step_cache_interval', 1))
+
+            pipe_params = self.with_cached_prompt_embeds(pipe_params)
+
+            self.planned_steps = executed_steps(pipeline_type, pipe_params['num_inference_steps'], pipe_params.get('strength'))
+            if checkpoint:
+                self.planned_steps = checkpoint['planned_steps'] - checkpoint['step']
+            self.first_step_time = None
+            self.set_cfg_truncation(params, pipe_params)
+
+            if checkpoint_key and pipeline_type in resumable_pipelines and 'callback_on_step_end' in pipe_params:
+                inputs = pipe_params.get('callback_on_step_end_tensor_inputs', ['latents'])
+                pipe_params['callback_on_step_end_tensor_inputs'] = inputs if 'latents' in inputs else inputs + ['latents']
+                total = checkpoint['planned_steps'] if checkpoint else self.planned_steps
+                self.checkpointer.start(checkpoint_key, params['checkpoint_interval'], pipe_params['num_inference_steps'], total, offset=checkpoint['step'] if checkpoint else 0)
+
+            output_type = 'latent' if (latents_only or params.get('keep_latents')) and pipeline_type in latent_pipelines else 'pil'
+
+            size = oom.job_resolution(pipe_params)
+            self.apply_memory_rung(memory_rungs.get(pipeline_model, size))
+            first_rung = self.memory_rung
 
             # RUN DIFFUSION
             try:
-                decoded_image = self.pipe(
-                    **pipe_params,
-                    output_type='pil',
-                ).images[0]
+                start = self.last_step_end = time.perf_counter()
+                while True:
+                    try:
+                        with tracer.span('pipeline', pipeline=pipeline_type, steps=self.planned_steps, memory=oom.RUNGS[self.memory_rung]):
+                            output = self.pipe(
+                                **pipe_params,
+                                output_type=output_type,
+                            ).images
+                        break
+                    except Exception as e:
+                        if not oom.is_oom(e) or self.memory_rung == len(oom.RUNGS) - 1:
+                            raise
+                        print(f"UD: out of memory at {oom.RUNGS[self.memory_rung]}, retrying with {oom.RUNGS[self.memory_rung + 1]}")
+
+                    # Retried outside the except block so the failed attempt's tensors can be freed
+                    oom.release_memory()
+                    self.apply_memory_rung(self.memory_rung + 1)
+                    if 'generator' in pipe_params:
+                        pipe_params['generator'] = torch.Generator('cpu').manual_seed(params['seed'])
+                    self.first_step_time = None
+                    self.set_cfg_truncation(params, pipe_params)
+                    self.manager.set_progress(0)
+
+                # Only rungs reached by this job, the loaded pipeline may already be degraded by an earlier larger one
+                if self.memory_rung > first_rung:
+                    memory_rungs.record(pipeline_model, size, self.memory_rung)
+                telemetry.throughput.record(self.planned_steps, 1 if final else 0, time.perf_counter() - start)
+
+                if checkpoint_key:
+                    self.report_checkpoints(time.perf_counter() - start)
+                    self.checkpointer.clear(checkpoint_key)
+
+                if output_type == 'latent' and latents_only:
+                    return output
+                elif output_type == 'latent':
+                    keep_latents(params.get('image_name'), output)
+                    decoded_image = self.decode_latents(output)
+                else:
+                    decoded_image = output[0]
+
+                elapsed = time.perf_counter() - start
+
+                if 'width' in pipe_params:
+                    bucket, mean, count = bucket_stats.record(pipe_params['width'], pipe_params['height'], elapsed)
+                    print(f"UD: {bucket} took {elapsed:.2f}s ({mean:.2f}s avg over {count} runs)")
+
+                if store_key:
+                    with tracer.span('result_store'):
+                        result_store.put(store_key, decoded_image, store_description, seconds=elapsed)
             except Exception as e:
                 print(f"UD: Error occurred while running the pipeline:\n\n{e}")
+                if checkpoint_key and self.checkpointer.saves:
+                    print(f"UD: the job can be resumed from step {self.checkpointer.last_step} by running it again")
+                if self.checkpointer:
+                    self.checkpointer.stop()
                 self.unload()
                 return None
             
-            decoded_image.save(params['temp_image_filepath'])
+            if params['temp_image_filepath']:
+                with tracer.span('png_save'):
+                    decoded_image.save(params['temp_image_filepath'])
 
             return decoded_image
+
+    def resume_params(self, pipe_params, checkpoint):
+        # The full schedule is rebuilt and cut just above the next timestep, the saved latents are used without adding noise
+        resume = {key: value for key, value in pipe_params.items() if key in pipeline_settings[resume_pipeline]}
+        train_timesteps = checkpoint['num_train_timesteps']
+        resume.update({
+            'image': checkpoint['latents'],
+            'num_inference_steps': checkpoint['num_inference_steps'],
+            'denoising_start': (train_timesteps - 1 - checkpoint['next_timestep']) / train_timesteps,
+        })
+        return resume
+
+    def report_checkpoints(self, elapsed):
+        checkpointer = self.checkpointer
+        checkpointer.stop()
+        if checkpointer.saves:
+            print(f"UD: {checkpointer.saves} checkpoints took {checkpointer.seconds * 1000:.0f} ms ({checkpointer.seconds / elapsed * 100:.1f}% of the run)")
+
+    def fetch_models(self, model_ids):
+        # Missing weights are downloaded with byte progress up front, from_pretrained then reads the local folders
+        with self.manager.tracer.span('model_fetch'):
+            model_fetch.fetcher.fetch([model_id for model_id in model_ids if model_id],
+                                      progress=model_fetch.progress_reporter(self.manager), cancel=self.manager.stop_process)
+
+    def apply_memory_rung(self, rung):
+        # Levels only go up while the pipeline stays loaded, undoing offload would cost as much as the reload it avoids
+        for level in range(self.memory_rung + 1, rung + 1):
+            name = oom.RUNGS[level]
+            if name == 'vae_tiling':
+                self.pipe.vae.enable_slicing()
+                self.pipe.vae.enable_tiling()
+            elif name == 'attention_slicing':
+                self.pipe.enable_attention_slicing()
+            elif name == 'model_offload' and self.device.type == 'cuda' and not self.offload:
+                self.offload = 'model'
+                self.enable_offload()
+            elif name == 'sequential_offload' and self.device.type == 'cuda' and self.offload != 'sequential':
+                if self.offload:
+                    self.pipe.remove_all_hooks()
+                self.offload = 'sequential'
+                self.enable_offload()
+            self.memory_rung = level
+
+    def enable_offload(self):
+        if self.offload == 'sequential':
+            self.pipe.enable_sequential_cpu_offload(device=self.device)
+        elif self.offload == 'model':
+            self.pipe.enable_model_cpu_offload(device=self.device)
+
+    def control_components(self, controlnet_models, t2i_models):
+        # The new modules are acquired before the old ones are released, so the ones in both stay on the device
+        previous, self.held_modules = self.held_modules, []
+        components = {}
+
+        if controlnet_models:
+            with self.manager.tracer.span('controlnet_load', models=controlnet_models):
+                components['controlnet'] = [self.acquire_module(model, self.create_controlnet) for model in controlnet_models]
+
+        if t2i_models:
+            with self.manager.tracer.span('t2i_load', models=t2i_models):
+                adapters = [self.acquire_module(model, self.create_t2i) for model in t2i_models]
+                components['adapter'] = adapters[0] if len(adapters) == 1 else diffusers.MultiAdapter(adapters)
+
+        for key in previous:
+            self.module_cache.release(key)
+        return components
+
+    def acquire_module(self, model, create):
+        module = self.module_cache.acquire(model, lambda: create(model))
+        if module is not None:
+            self.held_modules.append(model)
+        return module
+
+    def switch_pipeline(self, pipeline_type, **components):
+        # from_pipe shares the loaded modules, offload hooks and the step cache are bound to the old pipeline
+        if self.offload:
+            self.pipe.remove_all_hooks()
+        if self.step_cache:
+            self.step_cache.disable()
+            self.step_cache = None
+
+        self.pipe = pipeline_class(pipeline_type).from_pipe(self.pipe, **components)
+        self.enable_offload()
+        self.trace_pipe_stages()
+        self.loaded_model_type = pipeline_type
+
+    def decode_latents(self, latents):
+        # Mirrors the SDXL pipelines' own decode, including the fp16 VAE upcast and latent normalization
+        vae = self.pipe.vae
+        needs_upcasting = vae.dtype == torch.float16 and vae.config.force_upcast
+        if needs_upcasting:
+            self.pipe.upcast_vae()
+        latents = latents.to(next(iter(vae.post_quant_conv.parameters())).dtype)
+
+        if getattr(vae.config, 'latents_mean', None) is not None and getattr(vae.config, 'latents_std', None) is not None:
+            mean = torch.tensor(vae.config.latents_mean).view(1, -1, 1, 1).to(latents.device, latents.dtype)
+            std = torch.tensor(vae.config.latents_std).view(1, -1, 1, 1).to(latents.device, latents.dtype)
+            latents = latents * std / vae.config.scaling_factor + mean
+        else:
+            latents = latents / vae.config.scaling_factor
+
+        image = vae.decode(latents, return_dict=False)[0]
+        if needs_upcasting:
+            vae.to(dtype=torch.float16)
+
+        if getattr(self.pipe, 'watermark', None) is not None:
+            image = self.pipe.watermark.apply_watermark(image)
+        return self.pipe.image_processor.postprocess(image, output_type='pil')[0]
+
+    def apply_sampling_profile(self, pipeline_model):
+        model = bf.get_model(pipeline_model)
+        profile = model.profile if model else None
+        if not profile or not profile.scheduler:
+            return
+
+        config = dict(profile.scheduler_config or {})
+        if profile.timestep_spacing:
+            config['timestep_spacing'] = profile.timestep_spacing
+        self.pipe.scheduler = getattr(diffusers, profile.scheduler).from_config(self.pipe.scheduler.config, **config)
+        print(f"UD: using {profile.scheduler} for {pipeline_model}")
+
+    def trace_pipe_stages(self):
+        # Stages that run inside the diffusers call, the wrappers look up the tracer of the current job
+        stages = [(self.pipe, 'encode_prompt', 'prompt_encode'), (self.pipe.vae, 'decode', 'vae_decode')]
+        for owner, attr, name in stages:
+            if hasattr(owner, attr) and not hasattr(getattr(owner, attr), 'stage'): # components shared by a switched pipeline are already wrapped
+                setattr(owner, attr, self.traced(name, getattr(owner, attr)))
+
+    def traced(self, name, fn):
+        def wrapper(*args, **kwargs):
+            with self.manager.tracer.span(name):
+                result = fn(*args, **kwargs)
+            self.last_step_end = time.perf_counter()
+            return result
+        wrapper.stage = name
+        return wrapper
             
+    def result_identity(self, params, pipeline_type, pipeline_model, vae_model, controlnet_models, t2i_models, quantization):
+        # Everything outside pipe_params that changes the output; LoRA files are identified by path and modification time
+        loras = [(path, os.path.getmtime(path) if os.path.exists(path) else None, weight)
+                 for path, weight in zip(params.get('lora_path', []), params.get('lora_weight', []))]
+        return {
+            'model': pipeline_model,
+            'pipeline_type': pipeline_type,
+            'vae': vae_model,
+            'controlnets': controlnet_models,
+            't2i': t2i_models,
+            'quantization': quantization,
+            'seed': params['seed'],
+            'loras': loras,
+            'fuse_loras': bool(loras) and params.get('fuse_loras', False),
+            'step_cache_interval': params.get('step_cache_interval', 1),
+            'cfg_cutoff': params.get('cfg_cutoff', 1),
+            'adaptive_cfg': params.get('adaptive_cfg', 0),
+            'device': self.device.type,
+        }
+
+    def apply_loras(self, paths, weights, fuse):
+        if not paths and not self.loaded_loras:
+            return
+
+        with self.manager.tracer.span('lora_apply', loras=len(paths)):
+            if self.loaded_loras is None:
+                self.loaded_loras = {}
+
+            for path in paths:
+                if path not in self.loaded_loras:
+                    adapter_name = f'lora_{len(self.loaded_loras)}'
+                    try:
+                        self.pipe.load_lora_weights(path, adapter_name=adapter_name)
+                        self.loaded_loras[path] = adapter_name
+                    except Exception as e:
+                        print(f"UD: Failed to load LoRA {path}:\n\n{e}")
+
+            active = [(self.loaded_loras[path], weight) for path, weight in zip(paths, weights) if path in self.loaded_loras]
+            state = tuple(active)
+            if state == self.fused_loras:
+                return
+
+            if self.fused_loras is not None:
+                self.pipe.unfuse_lora()
+                self.fused_loras = None
+
+            if not active:
+                self.pipe.disable_lora()
+            else:
+                self.pipe.enable_lora()
+                self.pipe.set_adapters([name for name, _ in active], adapter_weights=[weight for _, weight in active])
+                # Fuse only once the same set comes back, so switching styles stays a cheap weight change
+                if fuse and state == self.lora_state:
+                    self.pipe.fuse_lora(adapter_names=[name for name, _ in active])
+                    self.fused_loras = state
+
+            if state != self.lora_state:
+                self.prompt_embeds_cache = None # LoRAs may patch the text encoders
+            self.lora_state = state
+
+    def embed_prompt(self, text):
+        # SDXL encodes the negative prompt exactly like a positive one, so both sides share the cache
+        if self.prompt_embeds_cache is None:
+            self.prompt_embeds_cache = OrderedDict()
+
+        if text not in self.prompt_embeds_cache:
+            self.check_prompt_length(text)
+            embeds, _, pooled, _ = self.pipe.encode_prompt(
+                prompt=text,
+                device=self.device,
+                num_images_per_prompt=1,
+                do_classifier_free_guidance=False,
+            )
+            self.prompt_embeds_cache[text] = embeds, pooled
+            while len(self.prompt_embeds_cache) > PROMPT_CACHE_SIZE:
+                self.prompt_embeds_cache.popitem(last=False)
+
+        self.prompt_embeds_cache.move_to_end(text)
+        return self.prompt_embeds_cache[text]
+
+    def check_prompt_length(self, text):
+        with token_lock:
+            if text in token_counts:
+                return
+        tokenizer = self.pipe.tokenizer
+        count = len(tokenizer(text).input_ids)
+        with token_lock:
+            token_counts[text] = count
+        if count > tokenizer.model_max_length:
+            print(f"UD: prompt is {count} tokens with the added keywords, the text encoders ignore everything after {tokenizer.model_max_length}: \"{text[:60]}...\"")
+
+    def precompute_negative_prompts(self, pipeline_type):
+        # The keywords alone are the negative prompt of every run without one, and of the upscaler refines
+        if not pipeline_type.startswith('StableDiffusionXL'):
+            return
+        with self.manager.tracer.span('prompt_precompute'):
+            for text in [self.negative_prompt_adds, ' hdr ' + self.negative_prompt_adds]:
+                self.embed_prompt(text)
+
+    def with_cached_prompt_embeds(self, pipe_params):
+        # Replaces the prompt strings with embeddings computed once per string
+        if not self.loaded_model_type.startswith('StableDiffusionXL') or 'prompt' not in pipe_params:
+            return pipe_params
+
+        embeds = {}
+        embeds['prompt_embeds'], embeds['pooled_prompt_embeds'] = self.embed_prompt(pipe_params['prompt'])
+        if pipe_params.get('guidance_scale', 0) > 1:
+            negative = pipe_params.get('negative_prompt') or ''
+            if not negative and self.pipe.config.get('force_zeros_for_empty_prompt'):
+                embeds['negative_prompt_embeds'] = torch.zeros_like(embeds['prompt_embeds'])
+                embeds['negative_pooled_prompt_embeds'] = torch.zeros_like(embeds['pooled_prompt_embeds'])
+            else:
+                embeds['negative_prompt_embeds'], embeds['negative_pooled_prompt_embeds'] = self.embed_prompt(negative)
+
+        pipe_params = {name: value for name, value in pipe_params.items() if name not in ['prompt', 'negative_prompt']}
+        pipe_params.update(embeds)
+        return pipe_params
+
+    def set_step_cache(self, interval):
+        if self.step_cache and self.step_cache.interval == interval:
+            return
+
+        if self.step_cache:
+            self.step_cache.disable()
+            self.step_cache = None
+
+        if interval > 1:
+            self.step_cache = StepCache(self.pipe, interval)
+            if not self.step_cache.active:
+                print(f"UD: {self.step_cache.reason or f'step caching is not supported for {self.loaded_model_type}'}, running without it")
+
+    def set_cfg_truncation(self, params, pipe_params):
+        self.remove_cfg_hook()
+        self.cfg_cutoff_step = None
+        self.cfg_threshold = 0
+        self.cfg_similarity = None
+
+        if 'callback_on_step_end_tensor_inputs' not in pipe_params:
+            return
+
+        # Cached deep features keep the batch size of the step that computed them
+        if self.step_cache and self.step_cache.active:
+            print("UD: CFG truncation is disabled while step caching is active")
+            del pipe_params['callback_on_step_end_tensor_inputs']
+            return
+
+        if params.get('cfg_cutoff', 1) < 1:
+            self.cfg_cutoff_step = max(int(self.planned_steps * params['cfg_cutoff']), 1)
+
+        self.cfg_threshold = params.get('adaptive_cfg', 0)
+        if self.cfg_threshold > 0:
+            self.cfg_hook = self.pipe.unet.register_forward_hook(self.measure_cfg_similarity)
+
+    def remove_cfg_hook(self):
+        if self.cfg_hook:
+            self.cfg_hook.remove()
+            self.cfg_hook = None
+
+    def measure_cfg_similarity(self, module, args, output):
+        noise_pred = output[0]
+        if noise_pred.shape[0] % 2:
+            return
+        uncond, cond = noise_pred.float().chunk(2)
+        self.cfg_similarity = torch.nn.functional.cosine_similarity(uncond.flatten(), cond.flatten(), dim=0).item()
+
+    def truncate_cfg(self, pipe, step_index, callback_kwargs):
+        if 'prompt_embeds' not in callback_kwargs or not pipe.do_classifier_free_guidance:
+            return
+
+        cutoff = self.cfg_cutoff_step is not None and step_index + 1 >= self.cfg_cutoff_step
+        converged = self.cfg_threshold > 0 and self.cfg_similarity is not None and self.cfg_similarity >= self.cfg_threshold
+        if not (cutoff or converged):
+            return
+
+        # The pipeline only checks do_classifier_free_guidance, which follows _guidance_scale, so the next steps run the conditional branch alone
+        pipe._guidance_scale = 0.0
+        for name in cfg_truncation_inputs[self.loaded_model_type]:
+            callback_kwargs[name] = callback_kwargs[name].chunk(2)[-1]
+
+        self.remove_cfg_hook()
+        print(f"UD: guidance dropped after step {step_index + 1}" + (f" (similarity {self.cfg_similarity:.4f})" if converged else ""))
+
     def pipe_callback(self, pipe, step_index, timestep, callback_kwargs):
         if self.manager.stop_process() == 1:
-            self.manager.set_stop_process(0)
             raise Exception("Inference cancelled.") ## No cleaner way found
 
-        self.manager.set_progress(int((step_index + 1) / pipe.num_timesteps * 100))
-        self.manager.set_progress_text(f'Step {step_index + 1} / {pipe.num_timesteps}')
+        total = self.planned_steps or pipe.num_timesteps
+        progress_text = f'Step {step_index + 1} / {total}'
 
-        self.manager.redraw()
+        cuda = tracing.cuda()
+        if cuda and self.device.type == 'cuda':
+            cuda.synchronize(self.device)
+
+        # The first step also includes prompt encoding, so the rate is measured from there
+        now = time.perf_counter()
+        self.manager.tracer.add_span('denoise_step', self.last_step_end, now, step=step_index)
+        self.last_step_end = now
+
+        if self.first_step_time is None:
+            self.first_step_time = now
+        elif step_index > 0:
+            eta = (now - self.first_step_time) / step_index * (total - step_index - 1)
+            progress_text += f' - {format_eta(eta)} left'
+
+        self.manager.set_progress(int((step_index + 1) / total * 100))
+        self.manager.set_progress_text(progress_text)
+
+        if self.checkpointer and self.checkpointer.due(step_index) and 'latents' in callback_kwargs:
+            with self.manager.tracer.span('checkpoint_save', step=step_index):
+                self.checkpointer.save(step_index, timestep, callback_kwargs['latents'], pipe.scheduler)
+
+        self.truncate_cfg(pipe, step_index, callback_kwargs)
 
         return callback_kwargs
     
-    def determine_pipeline_type(self, params, init_image, mask_image):
+    def resolve_quantization(self, params):
+        mode = params.get('quantization', 'DEFAULT')
+        if mode == 'DEFAULT':
+            # Model defaults are bitsandbytes modes, other devices keep loading with CPU offload
+            model = bf.get_model(params['model'])
+            mode = model.quantization if model and self.device.type == 'cuda' else None
+        elif mode == 'NONE':
+            mode = None
+
+        reason = unavailable_reason(mode, self.device) if mode else None
+        if reason:
+            print(f"UD: {reason}, loading without quantization")
+            return None
+        return mode
+
+    def fits_on_device(self, headroom=0.8):
+        if self.device.type != 'cuda':
+            return True
+        free, total = torch.cuda.mem_get_info(self.device)
+        return pipeline_bytes(self.pipe) < free * headroom
+
+    def torch_dtype(self, model_type=None):
+        # Half precision is unsupported or very slow for most CPU kernels
+        if self.device.type == 'cpu':
+            return torch.float32
+        return torch.bfloat16 if model_type == 'SD3' else torch.float16
+
+    def determine_pipeline_type(self, params, init_image, mask):
+        # A fully white mask repaints everything, which is plain img2img
+        inpaint = init_image is not None and mask is not None and not mask.full
+
         if params['pipeline_type'] == 'SDXL':
             if 'controlnet_model' in params:
-                if mask_image and init_image:
+                if inpaint:
                     return 'StableDiffusionXLControlNetInpaintPipeline'
                 return 'StableDiffusionXLControlNetImg2ImgPipeline' if init_image else 'StableDiffusionXLControlNetPipeline'
             elif 't2i_model' in params:
                 return 'StableDiffusionXLAdapterPipeline'
             else:
-                if mask_image and init_image:
+                if inpaint:
                     return 'StableDiffusionXLInpaintPipeline'
                 return 'StableDiffusionXLImg2ImgPipeline' if init_image else 'StableDiffusionXLPipeline'
         elif params['pipeline_type'] == 'FLUX':
@@ -346,7 +1062,7 @@ class UD_Processor():
         if CONTROLNET_MODELS[controlnet_model]['model_type'] == 'diffusers':
             for kwargs in [{"variant": "fp16", "use_safetensors": True}, {"use_safetensors": True}, {}]:
                 try:
-                    return ControlNetModel.from_pretrained(controlnet_model, torch_dtype=torch.float16, **kwargs).to(self.device)
+                    return diffusers.ControlNetModel.from_pretrained(model_fetch.fetcher.resolve(controlnet_model), torch_dtype=self.torch_dtype(), **kwargs).to(self.device)
                 except Exception:
                     continue
 
@@ -357,7 +1073,7 @@ class UD_Processor():
         model = None
 
         try:
-            model = T2IAdapter.from_pretrained(t2i_model, torch_dtype=torch.float16, variant="fp16").to(self.device)
+            model = diffusers.T2IAdapter.from_pretrained(model_fetch.fetcher.resolve(t2i_model), torch_dtype=self.torch_dtype(), variant="fp16").to(self.device)
             return model
         except Exception as e:
             pass
@@ -367,9 +1083,26 @@ class UD_Processor():
 
         return model
 
-    def unload(self):
+    def evict(self, key=None):
+        # A parked control module by model id, or the loaded pipeline
+        if key is None:
+            self.unload()
+        else:
+            self.module_cache.drop(key)
+
+    def unload(self, clear_modules=False):
 
-        self.manager.set_progress_text('Unloading loaded model...')
+        if self.manager:
+            self.manager.set_progress_text('Unloading loaded model...')
+
+        # Cached control modules outlive the pipeline, so they must not keep its offload hooks
+        if self.offload and hasattr(self, 'pipe'):
+            self.pipe.remove_all_hooks()
+        for key in self.held_modules:
+            self.module_cache.release(key)
+        self.held_modules = ()
+        if clear_modules:
+            self.module_cache.clear()
 
         for item in ['pipe']:
             if hasattr(self, item):
@@ -378,11 +1111,20 @@ class UD_Processor():
 
         torch.cuda.empty_cache()
 
+        self.step_cache = None
         self.loaded_model = None
         self.loaded_model_type = None
         self.loaded_vae = None
         self.loaded_controlnets = None
         self.loaded_t2i = None
-
-        self.manager.set_progress_text('Unloaded')
+        self.loaded_quantization = None
+        self.offload = None
+        self.memory_rung = 0
+        self.loaded_loras = None
+        self.lora_state = None
+        self.fused_loras = None
+        self.prompt_embeds_cache = None
+
+        if self.manager:
+            self.manager.set_progress_text('Unloaded')
         print("GPU cache has been cleared.")
\ No newline at end of file